@@ -9,31 +9,89 @@ if sys.version_info < (3, 10):
             importlib.metadata.packages_distributions = importlib_metadata.packages_distributions
     except ImportError:
         pass
-from email_agent import EmailAgent
+from email_agent import EmailAgent, bold_placeholders, bold_placeholders_stream, load_env
+from response_cache import ResponseCache
+from model_registry import ModelRegistry
+from outbox import Outbox
+from attachment_store import AttachmentStore, QuotaExceeded
+from recipients import parse_recipients
+from persistence import QueryParamSync, SecretStore
+import content_validator
+import html_normalizer
+from profiler import RerunProfiler
+from metrics import default_metrics, InMemorySink, JsonlSink, PrometheusSink
 import os
-
+import uuid
+
+load_env()
+
+# Per-rerun section timings, shared by every session in this process
+@st.cache_resource
+def get_profiler():
+    return RerunProfiler(log_path=os.getenv("EMAIL_AGENT_PROFILE_LOG"))
+
+# Metric sinks for every agent/pool in this process: in-memory for the debug panel,
+# plus a JSONL log and a Prometheus /metrics endpoint when configured
+@st.cache_resource
+def get_metrics_sink():
+    if os.getenv("EMAIL_AGENT_METRICS_LOG"):
+        default_metrics.add_sink(JsonlSink(os.getenv("EMAIL_AGENT_METRICS_LOG")))
+    if os.getenv("EMAIL_AGENT_METRICS_PORT"):
+        default_metrics.add_sink(PrometheusSink()).serve(int(os.getenv("EMAIL_AGENT_METRICS_PORT")))
+    return default_metrics.add_sink(InMemorySink())
+
+# Closes the previous run too, in case it ended early via st.rerun()/st.stop()
+rerun = get_profiler().start_run(st.session_state.get("rerun_timer"))
+st.session_state.rerun_timer = rerun
+metrics_sink = get_metrics_sink()
 
 st.set_page_config(page_title="AI Email Agent", page_icon="favicon.png", layout="wide")
 
 # --- PERSISTENCE LOGIC ---
-if "keys_to_persist" not in st.session_state:
-    st.session_state.keys_to_persist = ["api_key", "mode", "signature", "smtp_server", "smtp_port", "smtp_email", "to_email", "theme"]
-
-for key in st.session_state.keys_to_persist:
-    if key not in st.session_state and key in st.query_params:
-        try:
-            if key == "smtp_port":
-                st.session_state[key] = int(st.query_params[key])
-            else:
-                st.session_state[key] = st.query_params[key]
-        except:
-            pass
+# Optional server-side store for the API key, so it survives a reload without appearing in the URL.
+# Off by default: the `sid` token it puts in the URL unlocks the key for anyone holding the link
+# until it expires, so only turn it on (EMAIL_AGENT_REMEMBER_SECRETS=1) where links aren't shared.
+# Without it the key is never persisted and has to be re-entered after a reload.
+@st.cache_resource
+def get_secret_store():
+    return SecretStore(ttl=int(os.getenv("EMAIL_AGENT_SECRET_TTL", str(24 * 3600))))
+
+# Settings are restored from the URL here and written back once, at the end of the rerun, if they changed
+if "param_sync" not in st.session_state:
+    st.session_state.param_sync = QueryParamSync(
+        ["mode", "signature", "smtp_server", "smtp_port", "smtp_email", "to_email", "theme"],
+        secret_keys=["api_key"],
+        secret_store=get_secret_store() if os.getenv("EMAIL_AGENT_REMEMBER_SECRETS", "0") == "1" else None)
+st.session_state.param_sync.restore(st.session_state, st.query_params, types={"smtp_port": int})
+rerun.lap("query_param_sync")
 
 def get_persisted_value(key, default=""):
     if key in st.session_state:
         return st.session_state[key]
     return default
 
+# Content-addressed spool for uploaded attachments, shared by every session in this process
+@st.cache_resource
+def get_attachment_store():
+    return AttachmentStore(os.getenv("EMAIL_AGENT_ATTACHMENT_DIR", "attachment_store"),
+                           session_quota=int(os.getenv("EMAIL_AGENT_ATTACHMENT_QUOTA_MB", "200")) * 1024 * 1024).start()
+
+# Durable outbox + background send workers, shared by every session in this process.
+# Queued jobs reference spooled attachments instead of copying their bytes.
+@st.cache_resource
+def get_outbox():
+    return Outbox(os.getenv("EMAIL_OUTBOX_DB", "outbox.db"), agent=EmailAgent(mock_mode=False),
+                  store=get_attachment_store()).start()
+
+def release_upload(file):
+    """Drops Streamlit's in-memory copy of an upload once it has been spooled to disk."""
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        Runtime.instance().uploaded_file_mgr.remove_file(get_script_run_ctx().session_id, file.file_id)
+    except Exception as e:
+        print(f"Could not release upload {file.name}: {e}")
+
 # --- THEME SELECTION ---
 with st.sidebar:
     st.image("logo.png", width=140)
@@ -42,7 +100,7 @@ with st.sidebar:
     theme_val = get_persisted_value("theme", "Light")
     theme_index = 0 if theme_val == "Light" else 1
     theme = st.radio("Theme", ["Light", "Dark"], index=theme_index, horizontal=True, key="theme")
-    st.query_params["theme"] = theme
+rerun.lap("theme_picker")
 
 # --- DYNAMIC CSS ---
 if theme == "Dark":
@@ -414,6 +472,7 @@ st.markdown(f"""
 
 </style>
 """, unsafe_allow_html=True)
+rerun.lap("css")
 
 # --- APPLE MAIL / macOS UI STYLING ---
 
@@ -456,6 +515,7 @@ with st.sidebar:
     if smtp_email: smtp_email = smtp_email.strip().replace('\xa0', '')
     if smtp_password: smtp_password = smtp_password.strip().replace('\xa0', '')
     
+    smtp_settings = None
     if smtp_server and smtp_port and smtp_email and smtp_password:
         smtp_settings = {
             "server": smtp_server,
@@ -463,38 +523,55 @@ with st.sidebar:
             "email": smtp_email,
             "password": smtp_password
         }
+        # Lets the outbox resume any queued sends for this account (password stays in memory)
+        get_outbox().register_credentials(smtp_settings)
         
         if st.button("🔗 Connect mail", help="Tests the SMTP connection for sending emails. Does not import contacts."):
             with st.spinner("Testing SMTP Connection..."):
                 try:
-                    import smtplib
-                    server = smtplib.SMTP(smtp_settings['server'], smtp_settings['port'])
-                    server.starttls()
-                    server.login(smtp_settings['email'], smtp_settings['password'])
-                    server.quit()
+                    # Leaves the session open in the shared pool so the next send reuses it
+                    from smtp_pool import default_pool
+                    default_pool.warm(smtp_settings)
                     st.success("✅ Connected successfully!")
                 except Exception as e:
                     st.error(f"❌ Connection failed: {e}")
     else:
         st.warning("Please fill all SMTP details.")
 
-    # Update Query Params (Sync state to URL)
-    st.query_params["api_key"] = api_key
-    st.query_params["signature"] = signature
-    st.query_params["smtp_server"] = smtp_server
-    st.query_params["smtp_port"] = str(smtp_port)
-    st.query_params["smtp_email"] = smtp_email
+    rerun.lap("sidebar")
+
 
 
+# Response cache shared by every session in this process (optionally backed by SQLite)
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(db_path=os.getenv("EMAIL_AGENT_CACHE_DB"))
+
+# Model discovery + latency/health-based routing, shared by every session in this process
+@st.cache_resource
+def get_model_registry():
+    return ModelRegistry(cache_path=os.getenv("EMAIL_AGENT_MODELS_CACHE", "models_cache.json"),
+                         min_tier=os.getenv("EMAIL_AGENT_MODEL_TIER", "standard"))
+
+def same_text(html_a, html_b):
+    """True when two editor bodies differ only in markup/whitespace."""
+    return " ".join(html_normalizer.to_plaintext(html_a).split()) == " ".join(html_normalizer.to_plaintext(html_b).split())
 
 # Initialize Agent
 if api_key:
     # Re-initialize if key changes or first run
     if 'agent' not in st.session_state or st.session_state.get('last_api_key') != api_key:
-        st.session_state.agent = EmailAgent(api_key=api_key, mock_mode=False)
+        st.session_state.agent = EmailAgent(api_key=api_key, mock_mode=False, cache=get_response_cache(),
+                                            model_registry=get_model_registry())
+        # Optional token budgets, reported in the debug panel
+        for usage, env_name in ((st.session_state.agent.usage, "EMAIL_AGENT_SESSION_TOKEN_BUDGET"),
+                                (st.session_state.agent.key_usage, "EMAIL_AGENT_KEY_TOKEN_BUDGET")):
+            if os.getenv(env_name):
+                usage.budget = int(os.getenv(env_name))
         st.session_state.last_api_key = api_key
 elif 'agent' not in st.session_state:
      st.session_state.agent = EmailAgent(mock_mode=False) # Fallback
+rerun.lap("agent_init")
 
 col1, col2 = st.columns([1, 8], vertical_alignment="center")
 with col1:
@@ -509,11 +586,12 @@ with st.container():
     st.subheader("Email Details")
     # Recipient Email
     to_val = get_persisted_value("to_email", "")
-    to_email = st.text_input("Recipient Email", value=to_val, placeholder="e.g., boss@company.com", key="to_email")
-    
-    # Sync to_email to query params
-    if to_email:
-        st.query_params["to_email"] = to_email
+    to_email = st.text_input("To", value=to_val, placeholder="e.g., boss@company.com, team@company.com", key="to_email")
+    col_cc, col_bcc = st.columns(2)
+    with col_cc:
+        cc_email = st.text_input("CC", placeholder="Comma-separated addresses", key="cc_email")
+    with col_bcc:
+        bcc_email = st.text_input("BCC", placeholder="Comma-separated addresses", key="bcc_email")
     
     # Subject Templates - DISABLED
     # templates = {
@@ -537,8 +615,14 @@ with st.container():
     # Simple subject input without templates
     if "subject_val" not in st.session_state:
         st.session_state.subject_val = ""
-    
-    subject = st.text_input("Subject", value=st.session_state.subject_val, key="subject_input", placeholder="Enter email subject")
+    # The widget is driven through its key; a new subject from the Optimize button is applied before it renders
+    if "subject_update" in st.session_state:
+        st.session_state.subject_val = st.session_state.pop("subject_update")
+        st.session_state.subject_input = st.session_state.subject_val
+    elif "subject_input" not in st.session_state:
+        st.session_state.subject_input = st.session_state.subject_val
+
+    subject = st.text_input("Subject", key="subject_input", placeholder="Enter email subject")
     # Sync back to session state for manual edits
     st.session_state.subject_val = subject
 
@@ -552,25 +636,32 @@ with st.container():
         # Check if there is edited content in the quill editor first
         content_to_optimize = st.session_state.get("quill_editor") or st.session_state.get("generated_email")
         
-        if content_to_optimize:
+        composition = st.session_state.get("composition")
+        if composition and content_to_optimize and same_text(content_to_optimize, st.session_state.generated_email):
+            # The draft is unedited: its subject came with the same model call, no second request needed
+            st.session_state.subject_update = composition["subject"]
+            st.rerun()
+        elif content_to_optimize:
             # Generate from existing body (edited or original)
             with st.spinner("Analyzing content..."):
                 # Quill returns HTML, we might want to strip tags for better context analysis, 
                 # but Gemini handles HTML reasonably well.
                 new_subject = st.session_state.agent.optimize_subject(content_to_optimize)
-                st.session_state.subject_val = new_subject
+                st.session_state.subject_update = new_subject
                 st.rerun()
         elif subject:
              # Optimize existing subject
              with st.spinner("Optimizing subject..."):
                 new_subject = st.session_state.agent.optimize_subject(subject)
-                st.session_state.subject_val = new_subject
+                st.session_state.subject_update = new_subject
                 st.rerun()
         else:
             st.warning("Please enter some content in the Body or a rough Subject first.")
 
 
 
+rerun.lap("inputs")
+
 # Generation Section
 if st.button("🚀 Generate Email"):
     if not subject:
@@ -578,24 +669,37 @@ if st.button("🚀 Generate Email"):
     elif not api_key:
         st.error("Please enter a Gemini API Key in the sidebar.")
     else:
-        with st.spinner("Drafting your email..."):
-            # Get list of file names
-            attachment_names = [] # Attachments are now added after generation
-            
-            email_body = st.session_state.agent.generate_email(subject, attachment_names)
-            
-            # Append Signature
-            if signature:
-                email_body += f"\n\n{signature}"
+        # Get list of file names
+        attachment_names = [] # Attachments are now added after generation
+        
+        # Clicking Generate again for the same subject asks for a fresh draft instead of the cached one
+        regenerate = st.session_state.get("last_generated_subject") == subject
+        st.session_state.last_generated_subject = subject
+        
+        # Render the draft as it streams in; placeholders are bolded (e.g., [Date] -> <b>[Date]</b>) chunk by chunk
+        draft_preview = st.empty()
+        draft_preview.caption("Drafting your email...")
+        email_body = ""
+        rerun.lap("generation")
+        # One call drafts the body and the optimized subject; the subject is kept for the Optimize button
+        for piece in bold_placeholders_stream(st.session_state.agent.compose_stream(subject, attachment_names, regenerate=regenerate)):
+            email_body += piece
+            draft_preview.markdown(email_body.replace("\n", "<br>"), unsafe_allow_html=True)
+        st.session_state.composition = st.session_state.agent.last_composition
+        rerun.lap("model_call")
+        draft_preview.empty()
+        email_body = email_body.strip()
+        
+        # Append Signature
+        if signature:
+            email_body += "\n\n" + bold_placeholders(signature)
+        
+        # Format for HTML Editor (Quill)
+        # Convert newlines to HTML breaks so structure is preserved in the editor
+        email_body = email_body.replace("\n", "<br>")
             
-            # Format for HTML Editor (Quill)
-            import re
-            # Bold placeholders (e.g., [Date] -> <b>[Date]</b>)
-            email_body = re.sub(r'(\[.*?\])', r'<b>\1</b>', email_body)
-            # Convert newlines to HTML breaks so structure is preserved in the editor
-            email_body = email_body.replace("\n", "<br>")
-                
-            st.session_state.generated_email = email_body
+        st.session_state.generated_email = email_body
+rerun.lap("generation_render")
 
 # Display & Send Section
 if 'generated_email' in st.session_state:
@@ -609,22 +713,61 @@ if 'generated_email' in st.session_state:
         del st.session_state.validation_error
     
     # Attachments (Moved here)
-    uploaded_files = st.file_uploader("📎 Attachments (Max 10MB)", accept_multiple_files=True, key="file_uploader")
-    valid_attachments = []
+    # Attachments are base64-encoded straight into the SMTP stream, so the cap is set by the relay, not server memory
+    max_attachment_mb = int(os.getenv("MAX_ATTACHMENT_MB", "50"))
+    # Uploads are spooled to the attachment store as soon as they arrive and dropped from memory;
+    # the uploader is then cleared (new key) and the spooled files are listed below it
+    store = get_attachment_store()
+    if 'attachment_session' not in st.session_state:
+        st.session_state.attachment_session = uuid.uuid4().hex
+        st.session_state.attachments = {}  # (name, digest) -> attachment_store.StoredFile
+        st.session_state.uploader_generation = 0
+    store.touch(st.session_state.attachment_session)
+    uploaded_files = st.file_uploader(f"📎 Attachments (Max {max_attachment_mb}MB)", accept_multiple_files=True,
+                                      key=f"file_uploader_{st.session_state.uploader_generation}")
     if uploaded_files:
+        errors = []
         for file in uploaded_files:
-            if file.size > 10 * 1024 * 1024: # 10MB
-                st.error(f"File {file.name} is too large (>10MB).")
+            if file.size > max_attachment_mb * 1024 * 1024:
+                errors.append(f"File {file.name} is too large (>{max_attachment_mb}MB).")
             else:
-                valid_attachments.append(file)
+                try:
+                    stored = store.put(st.session_state.attachment_session, file)
+                    st.session_state.attachments[(stored.name, stored.digest)] = stored
+                except QuotaExceeded as e:
+                    errors.append(str(e))
+            release_upload(file)
+        st.session_state.attachment_errors = errors
+        st.session_state.uploader_generation += 1
+        st.rerun()
+    for error in st.session_state.pop("attachment_errors", []):
+        st.error(error)
+    for key, stored in list(st.session_state.attachments.items()):
+        if not os.path.exists(stored.path):
+            st.warning(f"{stored.name} expired from the attachment store; please upload it again.")
+            del st.session_state.attachments[key]
+            continue
+        name_col, remove_col = st.columns([8, 1])
+        name_col.caption(f"📄 {stored.name} ({stored.size / 1024:,.0f} KB)")
+        if remove_col.button("✕", key=f"remove_attachment_{stored.digest}_{stored.name}"):
+            del st.session_state.attachments[key]
+            if all(other.digest != stored.digest for other in st.session_state.attachments.values()):
+                store.release(st.session_state.attachment_session, stored.digest)
+            st.rerun()
+    valid_attachments = list(st.session_state.attachments.values())
+    if valid_attachments:
+        st.caption(f"{store.usage(st.session_state.attachment_session) / (1024 * 1024):.1f} MB of "
+                   f"{store.session_quota / (1024 * 1024):.0f} MB attachment quota used")
 
     # Allow user to edit the generated email using WYSIWYG editor
+    rerun.lap("attachments")
     final_body = st_quill(
         value=st.session_state.generated_email,
         html=True,
         key="quill_editor",
         placeholder="Write your email here..."
     )
+    rerun.lap("quill_editor")
     
     col1, col2 = st.columns([1, 4])
     with col1:
@@ -632,56 +775,40 @@ if 'generated_email' in st.session_state:
     
     if send_clicked:
         print("DEBUG: Send button clicked")
-        if not to_email:
+        recipients = parse_recipients(to_email, cc_email, bcc_email)
+        if not recipients.to:
             st.toast("❌ Recipient email is missing!", icon="❌")
             st.error("Please specify a recipient email.")
+        elif recipients.invalid:
+            st.error(f"These don't look like email addresses: {', '.join(recipients.invalid)}")
         else:
             # 1. Validate Subject for Placeholders
-            import re
-            subject_placeholders = re.findall(r'\[(.*?)\]', subject)
+            subject_placeholders = [f.text for f in content_validator.scan(subject) if f.kind in ("placeholder", "bracket")]
             if subject_placeholders:
                 st.toast("⚠️ Subject line contains placeholders!", icon="⚠️")
-                st.warning(f"⚠️ Subject line contains placeholders: {', '.join(['['+p+']' for p in subject_placeholders])}")
+                st.warning(f"⚠️ Subject line contains placeholders: {', '.join(subject_placeholders)}")
                 st.error("Please optimize the subject line or fill in the details before sending.")
                 st.stop() # Stop execution here
 
-            # 2. Validate Body for Placeholders
-            missing_placeholders = st.session_state.agent.validate_email(final_body)
+            # 2. Validate Body for Placeholders, empty links and missing attachments (one scan)
+            body_findings = [f for f in content_validator.scan(final_body, len(valid_attachments)) if f.kind != "bracket"]
             
-            if missing_placeholders:
+            if body_findings:
                 st.toast("⚠️ Missing information in email body!", icon="⚠️")
                 
                 # Store error in session state so it survives the rerun
-                st.session_state.validation_error = f"⚠️ Missing Information Detected in Body: {', '.join(missing_placeholders)}"
+                st.session_state.validation_error = f"⚠️ Missing Information Detected in Body: {', '.join(content_validator.describe(f) for f in body_findings)}"
                 
-                # Highlight placeholders in the editor
-                highlighted_body = final_body
-                for placeholder in missing_placeholders:
-                    # Simple replacement to highlight
-                    highlighted_body = highlighted_body.replace(
-                        placeholder, 
-                        f'<span style="background-color: #ffcccc; color: red; font-weight: bold;">{placeholder}</span>'
-                    )
+                # Highlight findings in the editor using their offsets (single rewrite)
+                highlighted_body = content_validator.highlight(final_body, body_findings)
                 
                 st.session_state.generated_email = highlighted_body
                 st.rerun()
 
             else:
-                # 3. Aggressive HTML Cleanup
-                cleaned_body = final_body.replace("<p><br></p>", "<br>")
-                cleaned_body = cleaned_body.replace("<p></p>", "")
-                cleaned_body = re.sub(r'<p.*?>', '', cleaned_body)
-                cleaned_body = cleaned_body.replace('</p>', '<br>')
-                cleaned_body = re.sub(r'(<br>\s*){2,}', '<br><br>', cleaned_body)
-                cleaned_body = cleaned_body.strip()
-                if cleaned_body.startswith("<br>"): cleaned_body = cleaned_body[4:]
-                if cleaned_body.endswith("<br>"): cleaned_body = cleaned_body[:-4]
-
-                styled_body = f"""
-                <div style="font-family: 'Calibri', 'Arial', sans-serif; font-size: 11pt; color: #000000;">
-                    {cleaned_body}
-                </div>
-                """
+                # 3. Normalize editor HTML into email-safe HTML (one parse)
+                cleaned_body, _ = html_normalizer.normalize(final_body)
+                styled_body = html_normalizer.wrap_email_html(cleaned_body)
                 
                 # INITIATE COUNTDOWN
                 import time
@@ -691,66 +818,107 @@ if 'generated_email' in st.session_state:
                 st.rerun()
 
     # --- HANDLE COUNTDOWN & SENDING ---
-    if st.session_state.get('sending_phase') == 'countdown':
+    # The countdown lives in a self-refreshing fragment: each tick redraws only the
+    # progress widget, and the full script reruns once, when time is up or on undo.
+    @st.fragment(run_every=1)
+    def undo_send_countdown():
         import time
+        if st.session_state.get('sending_phase') != 'countdown':
+            return
         elapsed = time.time() - st.session_state.countdown_start
         remaining = 10 - int(elapsed)
         
         if remaining <= 0:
             # TIME UP - SEND EMAIL
             st.session_state.sending_phase = 'sending' # Transition to sending
-            st.rerun()
+            st.rerun(scope="app")
+        
+        # SHOW COUNTDOWN
+        st.info(f"⏳ Sending email in {remaining} seconds...")
+        progress = min(elapsed / 10.0, 1.0)
+        st.progress(progress)
+        
+        col_undo, col_dummy = st.columns([1, 4])
+        with col_undo:
+            if st.button("↩️ Undo Send", key="undo_btn"):
+                st.session_state.sending_phase = 'cancelled'
+                st.toast("🛑 Sending cancelled!", icon="🛑")
+                st.rerun(scope="app")
+
+    # Polls the outbox job without rerunning the page; reruns it once the send settles.
+    @st.fragment(run_every=1)
+    def outbox_send_status():
+        if st.session_state.get('sending_phase') != 'queued':
+            return
+        job = get_outbox().status(st.session_state.outbox_job_id)
+        if job["status"] in ("sent", "failed"):
+            st.session_state.send_outcome = job
+            st.session_state.sending_phase = None
+            st.rerun(scope="app")
+        
+        if job["attempts"]:
+            st.status(f"Retrying send (attempt {job['attempts'] + 1})... Last error: {job['error']}", state="running")
         else:
-            # SHOW COUNTDOWN
-            st.info(f"⏳ Sending email in {remaining} seconds...")
-            progress = min(elapsed / 10.0, 1.0)
-            st.progress(progress)
-            
-            col_undo, col_dummy = st.columns([1, 4])
-            with col_undo:
-                if st.button("↩️ Undo Send", key="undo_btn"):
-                    st.session_state.sending_phase = 'cancelled'
-                    st.toast("🛑 Sending cancelled!", icon="🛑")
-                    st.rerun()
-            
-            time.sleep(1)
-            st.rerun()
+            st.status("Sending email...", state="running")
+
+    # Report the result of the last queued send once
+    send_outcome = st.session_state.pop('send_outcome', None)
+    if send_outcome and send_outcome["status"] == "sent":
+        st.toast("✅ Email sent successfully!", icon="✅")
+        st.success(f"Email sent to {send_outcome['to_email']}!")
+        for address, (code, reason) in send_outcome["refused"].items():
+            st.warning(f"{address} was refused by the server ({code} {reason}).")
+    elif send_outcome:
+        st.toast("❌ Failed to send email.", icon="❌")
+        st.error(f"Failed to send email. Check your SMTP settings. ({send_outcome['error']})")
 
+    if st.session_state.get('sending_phase') == 'countdown':
+        undo_send_countdown()
     elif st.session_state.get('sending_phase') == 'sending':
-        # ACTUAL SEND LOGIC
+        # HAND OFF TO THE OUTBOX
+        # Background workers send (and retry) from the durable outbox, so a slow relay
+        # doesn't block this session and closing the tab doesn't lose the email.
         styled_body = st.session_state.get('final_body_to_send', "")
         
-        status_placeholder = st.empty()
-        success = False
-        
-        try:
-            with status_placeholder.status("Making sure to attach files...", expanded=True) as status:
-                if valid_attachments:
-                    for file in valid_attachments:
-                        st.write(f"🔄 Attaching {file.name}...")
-                
-                st.write("Sending email...")
-                success = st.session_state.agent.send_email(to_email, subject, styled_body, smtp_settings, valid_attachments)
-                
-                if success:
-                    status.update(label="Email Sent!", state="complete", expanded=False)
-                else:
-                    status.update(label="Failed to send", state="error", expanded=True)
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-            success = False
-        
-        if success:
-            status_placeholder.empty()
-            st.toast("✅ Email sent successfully!", icon="✅")
-            st.success(f"Email sent to {to_email}!")
+        if not smtp_settings:
+            st.error("Please fill all SMTP details.")
+            st.session_state.sending_phase = None
         else:
-            st.toast("❌ Failed to send email.", icon="❌")
-            st.error("Failed to send email. Check your SMTP settings.")
-        
-        # Reset phase
-        st.session_state.sending_phase = None
+            # One message and one SMTP transaction for every To/CC/BCC address
+            recipients = parse_recipients(to_email, cc_email, bcc_email)
+            handle = get_outbox().enqueue(recipients.to, subject, styled_body, smtp_settings, valid_attachments,
+                                          cc=recipients.cc, bcc=recipients.bcc)
+            st.session_state.outbox_job_id = handle.job_id
+            st.session_state.sending_phase = 'queued'
         
     elif st.session_state.get('sending_phase') == 'cancelled':
         st.warning("Sending was cancelled.")
         st.session_state.sending_phase = None
+
+    if st.session_state.get('sending_phase') == 'queued':
+        outbox_send_status()
+rerun.lap("send_flow")
+
+# --- DEBUG: RERUN PROFILE (?debug=1 or EMAIL_AGENT_PROFILE=1) ---
+if st.query_params.get("debug") == "1" or os.getenv("EMAIL_AGENT_PROFILE") == "1":
+    with st.sidebar.expander("⏱️ Rerun profile (p50/p95 per section)"):
+        st.dataframe(get_profiler().summary(), hide_index=True)
+        st.download_button("Export JSONL", get_profiler().to_jsonl(), file_name="rerun_profile.jsonl", mime="application/jsonl")
+        st.caption("Generation / send latency (ms)")
+        st.dataframe([
+            {"metric": name, **{f"p{pct}": round((metrics_sink.percentile(name, pct) or 0) * 1000, 1) for pct in (50, 95, 99)}}
+            for name in ("model_latency_seconds", "model_first_chunk_seconds", "send_seconds")
+        ], hide_index=True)
+        st.caption("Encoded attachment cache")
+        st.dataframe([st.session_state.agent.attachment_cache.stats()], hide_index=True)
+        st.caption("Model routing")
+        st.dataframe(get_model_registry().stats(), hide_index=True)
+        st.caption("Tokens this session / for this API key")
+        st.dataframe(st.session_state.agent.usage.report(), hide_index=True)
+        st.dataframe(st.session_state.agent.key_usage.report(), hide_index=True)
+rerun.lap("debug_panel")
+
+# One URL update per rerun, with only the settings that changed (reruns cut short flush on the next one)
+st.session_state.param_sync.flush(st.session_state, st.query_params)
+rerun.lap("query_param_flush")
+rerun.finish()
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import time
+from email_agent import (EmailAgent, _COMPOSE_CONFIG, _answered_by, _composition, _falls_back, _request_options,
+                         parse_composition)
+from model_registry import bind_async_client
+from recipients import parse_recipients
+from resilience import CircuitOpenError, is_retryable
+from smtp_pool import SMTPConnectionPool
+
+try:
+    import aiosmtplib
+except ImportError:
+    # Without aiosmtplib, sends fall back to the thread-backed smtplib pool.
+    aiosmtplib = None
+
+
+class AsyncSMTPPool:
+    """Asyncio counterpart of smtp_pool.SMTPConnectionPool, built on aiosmtplib.
+
+    Must be used from a single event loop. At most `max_per_key` sessions are
+    open per (server, port, account); extra sends wait for a free session.
+    """
+
+    key_for = staticmethod(SMTPConnectionPool.key_for)
+
+    def __init__(self, max_per_key=10, idle_timeout=120, health_check_after=10, timeout=30):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._idle = {}   # key -> [(client, password, last_used), ...]
+        self._slots = {}  # key -> asyncio.Semaphore
+
+    async def _connect(self, smtp_settings):
+        client = aiosmtplib.SMTP(
+            hostname=smtp_settings['server'],
+            port=int(smtp_settings['port']),
+            timeout=self.timeout,
+            start_tls=smtp_settings.get('use_tls', True),
+        )
+        await client.connect()
+        try:
+            if smtp_settings.get('password'):
+                await client.login(smtp_settings['email'], smtp_settings['password'])
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    async def _acquire(self, key, smtp_settings):
+        """Returns (client, reused), preferring a healthy idle session."""
+        idle = self._idle.get(key, [])
+        now = time.time()
+        while idle:
+            client, password, last_used = idle.pop()
+            if password != smtp_settings.get('password') or now - last_used >= self.idle_timeout:
+                await self._close(client)
+                continue
+            if now - last_used >= self.health_check_after:
+                try:
+                    await client.noop()
+                except Exception:
+                    client.close()
+                    continue
+            return client, True
+        return await self._connect(smtp_settings), False
+
+    def _release(self, key, client, password):
+        self._idle.setdefault(key, []).append((client, password, time.time()))
+
+    @staticmethod
+    async def _close(client):
+        try:
+            await client.quit()
+        except Exception:
+            client.close()
+
+    async def sendmail(self, smtp_settings, from_addr, to_addrs, message):
+        """Sends through a pooled session, reconnecting once if it went stale."""
+        key = self.key_for(smtp_settings)
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.max_per_key))
+        async with slots:
+            for attempt in range(2):
+                client, reused = await self._acquire(key, smtp_settings)
+                try:
+                    result = await client.sendmail(from_addr, to_addrs, message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    client.close()
+                    # Only a reused session is worth retrying; a fresh one failing is a real error.
+                    if attempt or not reused:
+                        raise
+                    continue
+                except Exception:
+                    client.close()
+                    raise
+                self._release(key, client, smtp_settings.get('password'))
+                return result
+
+    async def close_all(self):
+        idle, self._idle = self._idle, {}
+        for sessions in idle.values():
+            for client, _, _ in sessions:
+                await self._close(client)
+
+
+class AsyncEmailAgent(EmailAgent):
+    """EmailAgent with a non-blocking surface for use inside an asyncio event loop.
+
+    `generate_email`, `compose`, `optimize_subject` and `send_email` are
+    coroutines, so a single loop can drive hundreds of drafts and sends at
+    once. The inherited sync methods (deliver, send_many, generate_template)
+    call the base implementations and keep working. Model calls are routed
+    through `model_registry` like the sync ones; `max_concurrency` bounds
+    how many are in flight.
+    """
+
+    def __init__(self, api_key=None, mock_mode=True, smtp_pool=None, cache=None, async_smtp_pool=None, max_concurrency=200,
+                 metrics=None, resilience=None, model_registry=None, attachment_cache=None):
+        super().__init__(api_key=api_key, mock_mode=mock_mode, smtp_pool=smtp_pool, cache=cache, metrics=metrics,
+                         resilience=resilience, model_registry=model_registry, attachment_cache=attachment_cache)
+        if async_smtp_pool is None and aiosmtplib is not None:
+            async_smtp_pool = AsyncSMTPPool()
+        self.async_smtp_pool = async_smtp_pool
+        self.max_concurrency = max_concurrency
+        self._model_slots = None
+
+    def _slots(self):
+        # Created lazily so the semaphore binds to the loop that actually runs the agent.
+        if self._model_slots is None:
+            self._model_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._model_slots
+
+    async def _generate_text_async(self, prompt, kind="email", generation_config=None):
+        """Async counterpart of EmailAgent._generate_text; holds a concurrency slot for the call."""
+        async with self._slots():
+            start = time.perf_counter()
+            with self.metrics.timer("model_latency_seconds", kind=kind):
+                response = await self._call_model_async(
+                    lambda model, timeout: self._generate_once_async(model, prompt, timeout, generation_config), kind)
+                text = response.text
+        self.metrics.observe("response_chars", len(text), kind=kind)
+        self._record_usage(kind, prompt, response, text, time.perf_counter() - start)
+        return text
+
+    async def _call_model_async(self, request, kind):
+        """Async counterpart of EmailAgent._call_model: routed through the registry, falling through on failure."""
+        if self.model_registry is None or self._model is not None:
+            model = self._model_for(self.model_name, kind)
+            self.last_model = self.model_name
+            _answered_by.set(self.model_name)
+            return await self.resilience.call_async(lambda timeout: request(model, timeout), kind=kind)
+
+        error = None
+        for name in self.model_registry.route(self.api_key, preferred=[self.model_name]):
+            model = self._model_for(name, kind)
+            start = time.monotonic()
+            try:
+                result = await self._caller_for(name).call_async(lambda timeout: request(model, timeout), kind=kind)
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    self.model_registry.record(name, time.monotonic() - start, ok=False)
+                if not (is_retryable(e) or isinstance(e, CircuitOpenError)):
+                    raise
+                self.metrics.incr("model_fallbacks_total", model=name, kind=kind)
+                error = e
+                continue
+            self.model_registry.record(name, time.monotonic() - start, ok=True)
+            self.last_model = name
+            _answered_by.set(name)
+            return result
+        raise error
+
+    async def _generate_once_async(self, model, prompt, timeout, generation_config=None):
+        bind_async_client(model, self.api_key)
+        return await model.generate_content_async(prompt, generation_config=generation_config,
+                                                  request_options=_request_options(timeout))
+
+    async def generate_email(self, subject, attachment_names=None, regenerate=False, variables=None):
+        """Generates an email body based on the subject using Gemini (see EmailAgent.generate_email)."""
+        if not self.api_key:
+            return "Error: API Key missing. Cannot generate email."
+
+        prompt = self._build_email_prompt(subject, attachment_names, variables)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate)
+        if cached is not None:
+            return cached
+        try:
+            email_text = self._clean_email_text(await self._generate_text_async(prompt))
+        except Exception as e:
+            return f"Error generating email: {e}"
+        self._cache_store(key, email_text)
+        return email_text
+
+    async def compose(self, subject, attachment_names=None, regenerate=False):
+        """Drafts body, subject, tone and placeholders in one call (see EmailAgent.compose)."""
+        if not self.api_key:
+            return _composition("Error: API Key missing. Cannot generate email.", subject)
+
+        prompt = self._build_email_prompt(subject, attachment_names)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate, kind="compose")
+        if cached is not None:
+            return json.loads(cached)
+        try:
+            composition = parse_composition(
+                await self._generate_text_async(prompt, kind="compose", generation_config=_COMPOSE_CONFIG))
+        except Exception as e:
+            if not _falls_back(e):
+                return _composition(f"Error generating email: {e}", subject)
+            self.metrics.incr("compose_fallbacks_total", reason=type(e).__name__)
+            body = await self.generate_email(subject, attachment_names, regenerate=regenerate)
+            if body.startswith("Error"):
+                return _composition(body, subject)
+            new_subject = await self.optimize_subject(body, regenerate=regenerate)
+            return _composition(body, subject if new_subject.startswith("Error") else new_subject)
+        self._cache_store(key, json.dumps(composition))
+        return composition
+
+    async def optimize_subject(self, content, regenerate=False):
+        """Generates a concise, professional subject line based on content/purpose."""
+        if not self.api_key:
+            return "Error: API Key missing."
+
+        prompt = self._build_subject_prompt(content)
+        key, cached = self._cache_lookup(prompt, regenerate=regenerate, kind="subject")
+        if cached is not None:
+            return cached
+        try:
+            subject = self._clean_subject(await self._generate_text_async(prompt, kind="subject"))
+        except Exception as e:
+            return f"Error: {e}"
+        self._cache_store(key, subject)
+        return subject
+
+    async def send_email(self, to_email, subject, body, smtp_settings=None, attachments=None, cc=None, bcc=None):
+        """Sends the email with optional attachments to To (and optional CC/BCC) addresses, in one transaction."""
+        if self.mock_mode:
+            return EmailAgent.send_email(self, to_email, subject, body, smtp_settings, attachments, cc=cc, bcc=bcc)
+        if not smtp_settings:
+            print("Error: SMTP settings required for real sending.")
+            return False
+
+        try:
+            recipients = parse_recipients(to_email, cc, bcc)
+            envelope = recipients.to + recipients.cc + recipients.bcc
+            for address in recipients.invalid:
+                print(f"Recipient refused: {address} (501 invalid address)")
+            if not envelope:
+                raise ValueError(f"no valid recipients in {to_email!r}")
+            # Materialized for aiosmtplib, but attachments still come from (and fill) the encoded-part cache
+            text = self._build_streaming_message(smtp_settings['email'], recipients.to, subject, body, attachments,
+                                                 cc=recipients.cc).as_bytes()
+            self.metrics.observe("message_bytes", len(text))
+            with self.metrics.timer("send_seconds", mode="async"):
+                if self.async_smtp_pool is not None:
+                    refused, _ = await self.async_smtp_pool.sendmail(smtp_settings, smtp_settings['email'], envelope, text)
+                else:
+                    refused = await asyncio.to_thread(self.smtp_pool.sendmail, smtp_settings, smtp_settings['email'],
+                                                      envelope, text)
+            for address, (code, reason) in refused.items():
+                print(f"Recipient refused: {address} ({code} {reason})")
+            print(f"Email sent successfully to {to_email}")
+            return True
+        except Exception as e:
+            print(f"Error sending email: {e}")
+            return False
@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from metrics import default_metrics
+
+
+def content_key(name, blocks):
+    """Cache key for an attachment: SHA-256 of its bytes (fed in as `blocks`) plus its filename."""
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest(), name
+
+
+class AttachmentCache:
+    """LRU of base64-encoded attachment parts (part headers + encoded body), capped in bytes.
+
+    Sending the same file to many recipients then encodes it twice; later
+    messages splice in the stored part. A part is only kept once its key has
+    been seen before (admit()), so files sent once never occupy memory.
+    Parts are stored as the encoder's block-sized chunks, never joined, so
+    serving one doesn't build a second copy. Parts larger than
+    `max_part_bytes` are never stored, so one huge file can't flush
+    everything else.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_part_bytes=None, metrics=None, max_seen=4096):
+        self.max_bytes = max_bytes
+        self.max_part_bytes = max_part_bytes if max_part_bytes is not None else max_bytes // 4
+        self.metrics = metrics or default_metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0  # encoded bytes served from the cache instead of re-encoded
+        self.size = 0
+        self.max_seen = max_seen
+        self._parts = OrderedDict()  # key -> (chunks, size)
+        self._seen = OrderedDict()   # keys looked up but not stored yet
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The part's chunks, or None."""
+        with self._lock:
+            entry = self._parts.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += entry[1]
+        self.metrics.incr("attachment_cache_lookups_total", result="miss" if entry is None else "hit")
+        if entry is None:
+            return None
+        self.metrics.incr("attachment_cache_bytes_saved_total", entry[1])
+        return entry[0]
+
+    def admit(self, key):
+        """True if `key` was seen before and its part should be stored; otherwise remembers it."""
+        with self._lock:
+            if key in self._seen:
+                del self._seen[key]
+                return True
+            self._seen[key] = None
+            while len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+            return False
+
+    def put(self, key, chunks):
+        """Stores a part's chunks, evicting least recently used parts past `max_bytes`; ignores oversized parts."""
+        chunks = tuple(chunks)
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_part_bytes:
+            return
+        with self._lock:
+            previous = self._parts.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._parts[key] = (chunks, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._parts.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self._seen.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "entries": len(self._parts),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Process-wide cache shared by EmailAgent, the outbox workers and batch sends.
+default_attachment_cache = AttachmentCache()
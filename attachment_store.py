@@ -0,0 +1,207 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+_COPY_SIZE = 1024 * 1024
+_SPOOL_PREFIX = ".spool-"
+
+
+class QuotaExceeded(ValueError):
+    """Storing a file would take a session past its attachment quota."""
+
+
+class StoredFile:
+    """A spooled attachment; quacks like Streamlit's UploadedFile, but its bytes are read through a memory map.
+
+    Mapped pages live in the OS page cache, not the process heap, so they can
+    be shared between sends and dropped under memory pressure.
+    """
+
+    def __init__(self, path, name, size, digest):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.digest = digest
+
+    def view(self):
+        """Read-only memoryview of the file's bytes (zero-copy; slices are safe to share across threads)."""
+        if not self.size:
+            return memoryview(b"")
+        with open(self.path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def getvalue(self):
+        """The whole file as bytes (a full copy; send paths use view() instead)."""
+        return bytes(self.view())
+
+
+def _read_blocks(file):
+    if hasattr(file, "read") and hasattr(file, "seek"):
+        file.seek(0)
+        while True:
+            block = file.read(_COPY_SIZE)
+            if not block:
+                return
+            yield block
+    else:
+        data = memoryview(file.getvalue())
+        for start in range(0, len(data), _COPY_SIZE):
+            yield data[start:start + _COPY_SIZE]
+
+
+class AttachmentStore:
+    """Content-addressed spool directory for uploaded attachments.
+
+    Each file is stored once under the SHA-256 of its bytes, however many
+    sessions or queued emails use it. Sessions hold references in memory and
+    are limited to `session_quota` bytes; a session not seen for
+    `session_ttl` seconds loses its references. cleanup() deletes blobs that
+    no session and no referrer (see add_referrer) still needs, once they are
+    older than `grace` seconds.
+    """
+
+    def __init__(self, root="attachment_store", session_quota=200 * 1024 * 1024, session_ttl=12 * 3600,
+                 grace=600):
+        self.root = root
+        self.session_quota = session_quota
+        self.session_ttl = session_ttl
+        self.grace = grace
+        self._sessions = {}   # session id -> {digest: size}
+        self._last_seen = {}  # session id -> time of last put/touch
+        self._referrers = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._cleaner = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add_referrer(self, digests):
+        """Registers `digests()`, returning digests needed outside any session (e.g. by queued outbox jobs)."""
+        self._referrers.append(digests)
+
+    def put(self, session_id, file):
+        """Spools `file` (UploadedFile or anything with getvalue()) and returns a StoredFile.
+
+        The file is copied in blocks, never held whole. With a `session_id`, the
+        session takes a reference and QuotaExceeded is raised if the file would
+        take it past its quota; with None the file is stored unreferenced, for
+        a referrer to claim within `grace` seconds.
+        """
+        size = getattr(file, "size", None)
+        if session_id is not None and isinstance(size, int) and size > self.session_quota:
+            raise QuotaExceeded(f"{file.name} is larger than the {_megabytes(self.session_quota)} attachment quota")
+
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix=_SPOOL_PREFIX, delete=False) as spool:
+            try:
+                for block in _read_blocks(file):
+                    digest.update(block)
+                    spool.write(block)
+                    size += len(block)
+            except BaseException:
+                spool.close()
+                os.remove(spool.name)
+                raise
+        digest = digest.hexdigest()
+        path = self._path(digest)
+
+        with self._lock:
+            held = self._sessions.get(session_id, {})
+            if session_id is not None and digest not in held and sum(held.values()) + size > self.session_quota:
+                os.remove(spool.name)
+                raise QuotaExceeded(f"Adding {file.name} would exceed the {_megabytes(self.session_quota)} "
+                                    "attachment quota for this session")
+            if os.path.exists(path):
+                os.remove(spool.name)
+                os.utime(path)  # restarts the grace period
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(spool.name, path)
+            if session_id is not None:
+                self._sessions.setdefault(session_id, {})[digest] = size
+                self._last_seen[session_id] = time.time()
+        return StoredFile(path, file.name, size, digest)
+
+    def open(self, digest, name):
+        """A StoredFile for a blob stored earlier; raises FileNotFoundError if it has been cleaned up."""
+        path = self._path(digest)
+        return StoredFile(path, name, os.path.getsize(path), digest)
+
+    def touch(self, session_id):
+        """Marks the session as alive, keeping its references from expiring."""
+        with self._lock:
+            if session_id in self._sessions:
+                self._last_seen[session_id] = time.time()
+
+    def release(self, session_id, digest=None):
+        """Drops the session's reference to `digest`, or to all its files."""
+        with self._lock:
+            if digest is None:
+                self._sessions.pop(session_id, None)
+                self._last_seen.pop(session_id, None)
+            else:
+                self._sessions.get(session_id, {}).pop(digest, None)
+
+    def usage(self, session_id):
+        """Bytes the session currently holds."""
+        with self._lock:
+            return sum(self._sessions.get(session_id, {}).values())
+
+    def cleanup(self, now=None):
+        """Expires idle sessions and deletes unreferenced blobs past their grace period. Returns bytes freed."""
+        now = now if now is not None else time.time()
+        needed = set()
+        for digests in self._referrers:
+            needed.update(digests())
+        freed = 0
+        with self._lock:
+            for session_id, last_seen in list(self._last_seen.items()):
+                if now - last_seen > self.session_ttl:
+                    del self._sessions[session_id], self._last_seen[session_id]
+            for held in self._sessions.values():
+                needed.update(held)
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    if name in needed:
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                        if now - stat.st_mtime > self.grace:
+                            os.remove(path)
+                            freed += stat.st_size
+                    except OSError as e:
+                        print(f"Attachment store: could not remove {path}: {e}")
+        return freed
+
+    def start(self, interval=300.0):
+        """Runs cleanup() every `interval` seconds on a background thread (idempotent)."""
+        if self._cleaner is None:
+            self._stopping.clear()
+            self._cleaner = threading.Thread(target=self._run, args=(interval,), name="attachment-store-cleanup",
+                                             daemon=True)
+            self._cleaner.start()
+        return self
+
+    def _run(self, interval):
+        while not self._stopping.wait(interval):
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Attachment store cleanup error: {e}")
+
+    def stop(self):
+        self._stopping.set()
+        if self._cleaner is not None:
+            self._cleaner.join()
+            self._cleaner = None
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.0f}MB"
@@ -0,0 +1,303 @@
+import csv
+import html
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import html_normalizer
+from email_agent import fill_placeholders
+from rate_limit import RateLimiter
+from templates import EmailTemplate, TemplateError
+
+# Row columns with a fixed meaning; every other column fills the matching [Placeholder].
+_RESERVED = ("id", "to", "email", "subject", "body")
+# Statuses a resumed run never revisits. Invalid and failed rows are retried
+# (reusing their drafted body), since fixing the input or the relay can fix them.
+_FINAL = ("sent", "rejected")
+_DONE = object()  # end-of-stream marker passed down the stage queues
+
+
+def read_rows(path):
+    """Yields each row of a .csv or .jsonl file as a dict, without loading the whole file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+class Checkpoint:
+    """Append-only JSONL log of each row's progress, so an interrupted batch can resume.
+
+    Drafted bodies are logged as soon as they exist, so a resumed run never
+    regenerates them, and sent/rejected rows are skipped entirely. A send
+    that completes but is interrupted before it is logged is sent again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.final = {}      # row id -> final status
+        self.generated = {}  # row id -> drafted body, for rows not yet final
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by the interruption
+                    if entry["status"] == "generated":
+                        self.generated[entry["id"]] = entry["body"]
+                    elif entry["status"] in _FINAL:
+                        self.final[entry["id"]] = entry["status"]
+                        self.generated.pop(entry["id"], None)
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+        self._lock = threading.Lock()
+
+    def record(self, row_id, status, **fields):
+        line = json.dumps({"id": row_id, "status": status, **fields}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def sync(self):
+        """Forces logged lines to disk (called periodically rather than per line)."""
+        with self._lock:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class BatchPipeline:
+    """Streams rows through generate -> validate -> send, each stage with its own worker pool.
+
+    Rows need "to" (or "email") and "subject" columns; a "body" column skips
+    generation, an "id" column names the row in the checkpoint (otherwise its
+    1-based position), and any other column fills matching [Placeholders].
+    Stages are connected by bounded queues, so a large input is never held in
+    memory. Rows whose body still has unfilled placeholders are logged as
+    invalid and not sent.
+
+    With `templates=True`, one body is drafted per distinct subject, with the
+    row's placeholder columns as template variables, and rendered locally
+    for every row that shares the subject.
+    """
+
+    def __init__(self, agent, checkpoint_path, smtp_settings=None, generate_workers=4, validate_workers=1,
+                 send_workers=4, requests_per_minute=60, max_retries=2, queue_size=100, progress_interval=5.0,
+                 templates=False):
+        self.agent = agent
+        self.smtp_settings = smtp_settings
+        self.checkpoint_path = checkpoint_path
+        self.workers = {"generate": generate_workers, "validate": validate_workers, "send": send_workers}
+        self.limiter = RateLimiter(requests_per_minute)
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+        self.counts = dict.fromkeys(("read", "skipped", "generated", "sent", "invalid", "rejected", "failed"), 0)
+        self._counts_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.checkpoint = None
+        self.templates = templates
+        self._templates = {}      # subject -> EmailTemplate
+        self._subject_locks = {}  # subject -> Lock, so each template is drafted once
+        self._templates_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def _finish(self, row_id, status, error=None):
+        self.checkpoint.record(row_id, status, **({"error": error} if error else {}))
+        self._count(status)
+
+    def _read(self, rows, out):
+        for index, row in enumerate(rows, 1):
+            if self._stop.is_set():
+                break
+            self._count("read")
+            row_id = str(row.get("id") or index)
+            if row_id in self.checkpoint.final:
+                self._count("skipped")
+                continue
+            out.put((row_id, row, self.checkpoint.generated.get(row_id)))
+
+    @staticmethod
+    def _variables(row):
+        return {k: v for k, v in row.items() if k not in _RESERVED and v not in (None, "")}
+
+    def _template_for(self, row):
+        """The subject's shared template, drafting (and checkpointing) it on first use; None on failure."""
+        subject = row["subject"]
+        with self._templates_lock:
+            lock = self._subject_locks.setdefault(subject, threading.Lock())
+        with lock:
+            template = self._templates.get(subject)
+            if template is None:
+                key = f"template:{subject}"
+                text = self.checkpoint.generated.get(key)
+                if text is None:
+                    text, _ = self.agent.draft_limited(subject, self.limiter, max_retries=self.max_retries,
+                                                       variables=list(self._variables(row)))
+                    if text.startswith("Error"):
+                        return None
+                    self.checkpoint.record(key, "generated", body=text)
+                    self._count("generated")
+                template = self._templates[subject] = EmailTemplate(text)
+            return template
+
+    def _generate(self, item):
+        row_id, row, body = item
+        if body is None:
+            body = row.get("body")
+        if not body and self.templates:
+            template = self._template_for(row)
+            if template is None:
+                self._finish(row_id, "failed", f"could not draft a template for {row['subject']!r}")
+                return None
+            return row_id, row, template
+        if not body:
+            body, _ = self.agent.draft_limited(row["subject"], self.limiter, max_retries=self.max_retries)
+            if body.startswith("Error"):
+                self._finish(row_id, "failed", body)
+                return None
+            self.checkpoint.record(row_id, "generated", body=body)
+            self._count("generated")
+        return row_id, row, body
+
+    def _validate(self, item):
+        row_id, row, body = item
+        variables = self._variables(row)
+        subject = fill_placeholders(row["subject"], variables)
+        template = body if isinstance(body, EmailTemplate) else None
+        try:
+            body = template.render(variables) if template else fill_placeholders(body, variables)
+        except TemplateError as e:
+            self._finish(row_id, "invalid", str(e))
+            return None
+        problems = self.agent.validate_email(body, template=template)
+        if problems:
+            self._finish(row_id, "invalid", "; ".join(problems))
+            return None
+        cleaned, _ = html_normalizer.normalize(html.escape(body).replace("\n", "<br>"))
+        return row_id, row.get("to") or row["email"], subject, html_normalizer.wrap_email_html(cleaned)
+
+    def _send(self, item):
+        row_id, to_email, subject, body = item
+        for attempt in range(self.max_retries + 1):
+            # 5xx refusals are permanent and final; 4xx (greylisting, throttling) and
+            # transport errors are retried, and left "failed" for a resumed run if they persist
+            try:
+                self.agent.deliver(to_email, subject, body, self.smtp_settings)
+            except smtplib.SMTPRecipientsRefused as e:
+                reply = e.recipients.get(to_email) or next(iter(e.recipients.values()), (550, str(e)))
+                if reply[0] >= 500:
+                    self._finish(row_id, "rejected", str(reply))
+                    return None
+                error = str(reply)
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                if e.smtp_code >= 500:
+                    self._finish(row_id, "rejected", str(e))
+                    return None
+                error = str(e)
+            except Exception as e:
+                error = str(e)
+            else:
+                self._finish(row_id, "sent")
+                return None
+            if attempt < self.max_retries:
+                time.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+        self._finish(row_id, "failed", error)
+        return None
+
+    def _start_stage(self, name, fn, inbox, outbox, next_workers):
+        """Starts `name`'s workers; once they all drain, passes end-of-stream on to the next stage."""
+        def work():
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    return
+                if self._stop.is_set():
+                    continue  # not started yet: left for the resumed run
+                try:
+                    result = fn(item)
+                except Exception as e:
+                    self._finish(item[0], "failed", f"{name}: {e}")
+                    continue
+                if result is not None:
+                    outbox.put(result)
+
+        threads = [threading.Thread(target=work, name=f"batch-{name}", daemon=True)
+                   for _ in range(self.workers[name])]
+        for thread in threads:
+            thread.start()
+
+        def close():
+            for thread in threads:
+                thread.join()
+            for _ in range(next_workers):
+                outbox.put(_DONE)
+
+        closer = threading.Thread(target=close, name=f"batch-{name}-close", daemon=True)
+        closer.start()
+        return closer
+
+    def progress(self, elapsed):
+        counts = dict(self.counts)
+        done = counts["sent"] + counts["rejected"] + counts["invalid"] + counts["failed"]
+        return (f"[batch {elapsed:6.0f}s] read {counts['read']} | skipped {counts['skipped']} | "
+                f"generated {counts['generated']} | sent {counts['sent']} | invalid {counts['invalid']} | "
+                f"rejected {counts['rejected']} | failed {counts['failed']} | "
+                f"{done / elapsed if elapsed > 0 else 0.0:.1f} rows/s")
+
+    def run(self, rows):
+        """Processes `rows` (an iterable of dicts) and returns the final counts.
+
+        Ctrl-C stops the run once the rows currently being worked on are done
+        and logged; rerunning with the same checkpoint picks up from there.
+        """
+        self.checkpoint = Checkpoint(self.checkpoint_path)
+        to_generate, to_validate, to_send = (queue.Queue(self.queue_size) for _ in range(3))
+        stages = [
+            self._start_stage("generate", self._generate, to_generate, to_validate, self.workers["validate"]),
+            self._start_stage("validate", self._validate, to_validate, to_send, self.workers["send"]),
+            self._start_stage("send", self._send, to_send, queue.Queue(), 0),
+        ]
+
+        def read():
+            try:
+                self._read(rows, to_generate)
+            finally:
+                for _ in range(self.workers["generate"]):
+                    to_generate.put(_DONE)
+
+        reader = threading.Thread(target=read, name="batch-read", daemon=True)
+        reader.start()
+        start = time.perf_counter()
+        try:
+            for thread in [reader] + stages:
+                while thread.is_alive():
+                    thread.join(self.progress_interval)
+                    if thread.is_alive():
+                        print(self.progress(time.perf_counter() - start))
+                        self.checkpoint.sync()
+        except KeyboardInterrupt:
+            print("Interrupted: finishing rows in flight; rerun with the same checkpoint to resume.")
+            self._stop.set()
+            for thread in stages:
+                thread.join()
+        finally:
+            self.checkpoint.sync()
+            self.checkpoint.close()
+        print(self.progress(time.perf_counter() - start))
+        return dict(self.counts)
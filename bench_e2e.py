@@ -0,0 +1,155 @@
+"""Offline end-to-end benchmark: EmailAgent against a fake Gemini model and a local SMTP sink.
+
+Measures draft throughput across concurrency levels and send throughput across
+attachment sizes and worker counts, with latency percentiles and peak traced
+memory. Results are compared with a stored baseline and the run fails (exit
+code 1) on regressions beyond --tolerance. Baselines are machine-specific:
+re-record with --save-baseline on the machine that runs the comparison.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import FakeModel, SMTPSink
+from metrics import InMemorySink, Metrics
+from smtp_pool import SMTPConnectionPool
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_e2e_baseline.json")
+# Differences below these are noise, whatever the relative change.
+_SLACK = {"ms": 2.0, "mb": 1.0, "per_s": 0.0}
+
+
+class NamedBytesIO(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _percentiles(sink, name, **labels):
+    values = [v * 1000 for v in sink.values(name, **labels)]
+    if not values:
+        return {}
+    return {f"p{pct}_ms": round(sink.percentile(name, pct, **labels) * 1000, 2) for pct in (50, 95, 99)}
+
+
+def bench_drafts(concurrency, drafts, model_latency, response_chars):
+    sink = InMemorySink()
+    agent = EmailAgent(api_key="bench", mock_mode=True, metrics=Metrics([sink]))
+    agent.model = FakeModel(text="Dear [Name], " + "x" * max(0, response_chars - 13), latency=model_latency)
+    subjects = [f"Quarterly update #{i}" for i in range(drafts)]
+    with patch("builtins.print"):
+        report = agent.generate_emails(subjects, concurrency=concurrency, requests_per_minute=10 ** 9)
+    return {"drafts_per_s": round(drafts / report["wall_time"], 2),
+            **_percentiles(sink, "model_latency_seconds", kind="email")}
+
+
+def bench_sends(workers, messages, attachment_kb, relay_latency, memory_messages):
+    payload = os.urandom(attachment_kb * 1024)
+    attachments = [NamedBytesIO(payload, "report.bin")] if attachment_kb else None
+    body = "<p>Dear [Name],</p><p>Please find the report attached.</p>"
+
+    def run(count, metrics):
+        pool = SMTPConnectionPool(max_per_key=workers, metrics=metrics)
+        agent = EmailAgent(api_key="bench", mock_mode=False, smtp_pool=pool, metrics=metrics)
+        recipients = [(f"user{i}@example.com", {"Name": f"User {i}"}) for i in range(count)]
+        with SMTPSink(latency=relay_latency, keep_data=False) as smtp_sink, patch("builtins.print"):
+            summary = agent.send_many(recipients, "Report for [Name]", body, smtp_sink.settings(),
+                                      attachments, workers=workers)
+            pool.close_all()
+        if summary["accepted"] != count:
+            raise RuntimeError(f"only {summary['accepted']}/{count} messages accepted")
+        return summary
+
+    sink = InMemorySink()
+    summary = run(messages, Metrics([sink]))
+    result = {"sends_per_s": round(summary["throughput"], 2), **_percentiles(sink, "send_seconds", mode="bulk")}
+
+    # Memory is traced in a separate, shorter pass: tracemalloc would skew the timings.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run(memory_messages, Metrics())
+    result["peak_mem_mb"] = round((tracemalloc.get_traced_memory()[1] - before) / 2 ** 20, 2)
+    tracemalloc.stop()
+    return result
+
+
+def run_suite(args):
+    results = {}
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        name = f"drafts c={concurrency}"
+        results[name] = bench_drafts(concurrency, args.drafts, args.model_latency, args.response_chars)
+        print(f"{name:<26} {results[name]}")
+    for attachment_kb in [int(s) for s in args.attachment_kb.split(",")]:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            name = f"sends {attachment_kb}KB w={workers}"
+            results[name] = bench_sends(workers, args.messages, attachment_kb, args.relay_latency, args.memory_messages)
+            print(f"{name:<26} {results[name]}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for scenario, metrics in results.items():
+        for key, value in metrics.items():
+            old = baseline.get(scenario, {}).get(key)
+            if old is None:
+                continue
+            unit = key.rsplit("_", 1)[-1] if not key.endswith("_per_s") else "per_s"
+            if unit == "per_s":
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value > old * (1 + tolerance) and value - old > _SLACK.get(unit, 0.0)
+            if worse:
+                regressions.append(f"{scenario}: {key} {old} -> {value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark")
+    parser.add_argument("--drafts", type=int, default=48)
+    parser.add_argument("--concurrency", default="1,4,16", help="Draft concurrency levels (comma separated)")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="Fake model round trip in seconds")
+    parser.add_argument("--response-chars", type=int, default=1200, help="Fake model response size")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per send scenario")
+    parser.add_argument("--memory-messages", type=int, default=4, help="Messages in the traced memory pass")
+    parser.add_argument("--attachment-kb", default="0,256,4096", help="Attachment sizes in KB (comma separated)")
+    parser.add_argument("--workers", default="1,4", help="Send worker counts (comma separated)")
+    parser.add_argument("--relay-latency", type=float, default=0.0, help="Simulated relay delay per DATA, seconds")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_suite(args)
+    print(f"Finished in {time.perf_counter() - start:.1f}s")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (run with --save-baseline).")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        return 1
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
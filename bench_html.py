@@ -0,0 +1,53 @@
+"""Benchmarks the one-pass HTML normalizer against the old str.replace/re.sub cleanup chain."""
+import argparse
+import html
+import re
+import timeit
+from html_normalizer import normalize
+
+
+def legacy_cleanup(body):
+    """The previous app.py cleanup (HTML only, no plaintext part)."""
+    cleaned_body = body.replace("<p><br></p>", "<br>")
+    cleaned_body = cleaned_body.replace("<p></p>", "")
+    cleaned_body = re.sub(r'<p.*?>', '', cleaned_body)
+    cleaned_body = cleaned_body.replace('</p>', '<br>')
+    cleaned_body = re.sub(r'(<br>\s*){2,}', '<br><br>', cleaned_body)
+    cleaned_body = cleaned_body.strip()
+    if cleaned_body.startswith("<br>"): cleaned_body = cleaned_body[4:]
+    if cleaned_body.endswith("<br>"): cleaned_body = cleaned_body[:-4]
+    return cleaned_body
+
+
+def legacy_cleanup_with_text(body):
+    """The chain plus the extra passes it would need to also produce a plaintext part."""
+    cleaned_body = legacy_cleanup(body)
+    text = re.sub(r'<br\s*/?>', '\n', cleaned_body)
+    text = re.sub(r'<[^>]+>', '', text)
+    return cleaned_body, html.unescape(text)
+
+
+def make_body(size_kb):
+    paragraph = ('<p>Hi <strong>team</strong>, the <em>Q3 &amp; Q4</em> numbers are in. '
+                 'See <a href="https://example.com/report" target="_blank">the report</a>.</p>'
+                 '<p><br></p><p class="ql-align-center">Agenda</p><ul><li>Budget</li><li>Hiring</li></ul><p></p>')
+    return paragraph * max(1, size_kb * 1024 // len(paragraph))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML normalizer benchmark")
+    parser.add_argument("--sizes", default="5,50,500", help="Body sizes in KB (comma separated)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        body = make_body(size)
+        chain = min(timeit.repeat(lambda: legacy_cleanup(body), number=1, repeat=args.repeat))
+        chain_text = min(timeit.repeat(lambda: legacy_cleanup_with_text(body), number=1, repeat=args.repeat))
+        one_pass = min(timeit.repeat(lambda: normalize(body), number=1, repeat=args.repeat))
+        print(f"{size:>6} KB  chain {chain * 1000:8.2f} ms   chain+text {chain_text * 1000:8.2f} ms   "
+              f"one-pass html+text {one_pass * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
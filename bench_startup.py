@@ -0,0 +1,63 @@
+"""Measures cold-import time of email_agent and first-render latency of app.py.
+
+Every measurement runs in a fresh interpreter. The "eager" rows also import
+google.generativeai up front, which is what loading email_agent used to cost.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+{preload}
+import email_agent
+print(time.perf_counter() - start)
+"""
+
+RENDER_SNIPPET = """
+import time
+start = time.perf_counter()
+{preload}
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=60)
+app.run()
+assert not app.exception, app.exception
+print(time.perf_counter() - start)
+"""
+
+EAGER_PRELOAD = "import dotenv, google.generativeai"
+
+
+def run_once(snippet, eager):
+    code = snippet.format(preload=EAGER_PRELOAD if eager else "", app=os.path.join(HERE, "app.py"))
+    env = dict(os.environ, PYTHONPATH=HERE, PYTHONWARNINGS="ignore")
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def report(label, samples):
+    print(f"{label:<38} median {statistics.median(samples) * 1000:8.1f} ms   min {min(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-render", action="store_true", help="Only measure the cold import")
+    args = parser.parse_args()
+
+    for eager in (True, False):
+        label = "eager SDK import" if eager else "lazy SDK import"
+        report(f"import email_agent ({label})", [run_once(IMPORT_SNIPPET, eager) for _ in range(args.repeat)])
+    if not args.skip_render:
+        for eager in (True, False):
+            label = "eager SDK import" if eager else "lazy SDK import"
+            report(f"first render ({label})", [run_once(RENDER_SNIPPET, eager) for _ in range(args.repeat)])
+
+
+if __name__ == "__main__":
+    main()
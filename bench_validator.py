@@ -0,0 +1,57 @@
+"""Benchmarks the single-pass content validator against the old findall/replace chain."""
+import argparse
+import re
+import timeit
+from content_validator import highlight, scan
+
+KEYWORDS = ['date', 'time', 'name', 'insert', 'attach', 'agenda', 'link', 'here']
+SPAN = '<span style="background-color: #ffcccc; color: red; font-weight: bold;">{}</span>'
+
+
+def legacy_validate_and_highlight(body):
+    """The previous flow: findall, a keyword loop per match, then one str.replace per placeholder."""
+    placeholders = re.findall(r'\[(.*?)\]', body)
+    missing = []
+    for p in placeholders:
+        if any(keyword in p.lower() for keyword in KEYWORDS):
+            missing.append(f"[{p}]")
+    highlighted = body
+    for placeholder in missing:
+        highlighted = highlighted.replace(placeholder, SPAN.format(placeholder))
+    return missing, highlighted
+
+
+def single_pass_validate_and_highlight(body):
+    findings = [f for f in scan(body, attachment_count=1) if f.kind != "bracket"]
+    return findings, highlight(body, findings, template=SPAN)
+
+
+def make_body(size_kb, placeholder_every=400):
+    # Placeholders are unique per paragraph: the legacy chain re-wraps repeated ones on every
+    # replace, which nests spans exponentially and would never finish on a large body.
+    paragraph = ("Dear [Name {i}], thanks for the update on the project. Please confirm the meeting on [Date {i}] "
+                 "at [Time {i}] and review ref [PO-{i}] before the <b>[Insert Agenda {i}]</b> session. ")
+    parts, i = [], 0
+    while sum(len(p) for p in parts) < size_kb * 1024:
+        parts.append(paragraph.format(i=i))
+        parts.append("Filler text without any brackets. " * (placeholder_every // 34))
+        i += 1
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content validator benchmark")
+    parser.add_argument("--sizes", default="100,250,500", help="Body sizes in KB (comma separated)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        body = make_body(size)
+        legacy = min(timeit.repeat(lambda: legacy_validate_and_highlight(body), number=1, repeat=args.repeat))
+        single = min(timeit.repeat(lambda: single_pass_validate_and_highlight(body), number=1, repeat=args.repeat))
+        print(f"{size:>6} KB  legacy {legacy * 1000:9.2f} ms   single-pass {single * 1000:9.2f} ms   "
+              f"speedup {legacy / single:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import re
+from collections import namedtuple
+
+# One finding per problem spot; `start`/`end` are character offsets into the scanned text.
+Finding = namedtuple("Finding", "kind text start end")
+
+# Placeholder labels that mean "information still missing" (e.g. [Date], [Your Name], [Insert Link]).
+_MISSING_INFO_RE = re.compile(r'date|time|name|insert|attach|agenda|link|here', re.IGNORECASE)
+
+# Everything is found in a single left-to-right scan of the text.
+_SCAN_RE = re.compile(r"""
+      (?P<bracket>\[(?P<label>[^\]\n]*)\])
+    | (?P<empty_link><a\b[^>]*?\bhref\s*=\s*(?P<quote>["'])\s*(?:\#|https?://)?\s*(?P=quote)[^>]*>)
+    | (?P<attachment>\b(?:attached|attachments?|enclosed)\b)
+""", re.IGNORECASE | re.VERBOSE)
+
+HIGHLIGHT_TEMPLATE = '<span style="background-color: #ffcccc; color: red; font-weight: bold;">{}</span>'
+
+
+def scan(text, attachment_count=None):
+    """Returns every Finding in `text`, in order of appearance.
+
+    Kinds:
+      - "placeholder": a [bracket] whose label signals missing information
+      - "bracket": any other [bracket] (fine in a body, not in a subject)
+      - "empty_link": an <a> tag whose href is empty, "#" or a bare scheme
+      - "attachment": the text mentions an attachment but `attachment_count`
+        is 0 (only checked when a count is given)
+    """
+    findings = []
+    check_attachments = attachment_count == 0
+    for match in _SCAN_RE.finditer(text):
+        kind = match.lastgroup  # the outer named group closes last
+        if kind == "bracket" and _MISSING_INFO_RE.search(match.group("label")):
+            kind = "placeholder"
+        elif kind == "attachment" and not check_attachments:
+            continue
+        findings.append(Finding(kind, match.group(0), match.start(), match.end()))
+    return findings
+
+
+def describe(finding):
+    """Short human-readable label for a finding, as shown in the app's warnings."""
+    if finding.kind == "empty_link":
+        return "empty link"
+    if finding.kind == "attachment":
+        return f'"{finding.text}" but no file is attached'
+    return finding.text
+
+
+def highlight(text, findings, template=HIGHLIGHT_TEMPLATE, kinds=("placeholder", "attachment")):
+    """Wraps each finding of the given kinds with `template`, in one rewrite of `text`."""
+    pieces = []
+    position = 0
+    for finding in findings:
+        if finding.kind not in kinds or finding.start < position:
+            continue
+        pieces.append(text[position:finding.start])
+        pieces.append(template.format(finding.text))
+        position = finding.end
+    pieces.append(text[position:])
+    return "".join(pieces)
@@ -16,6 +16,24 @@ mkdir $STAGING_DIR
 echo "📦 Copying application files..."
 cp app.py $STAGING_DIR/
 cp email_agent.py $STAGING_DIR/
+cp smtp_pool.py $STAGING_DIR/
+cp response_cache.py $STAGING_DIR/
+cp outbox.py $STAGING_DIR/
+cp mime_stream.py $STAGING_DIR/
+cp content_validator.py $STAGING_DIR/
+cp html_normalizer.py $STAGING_DIR/
+cp profiler.py $STAGING_DIR/
+cp metrics.py $STAGING_DIR/
+cp rate_limit.py $STAGING_DIR/
+cp resilience.py $STAGING_DIR/
+cp model_registry.py $STAGING_DIR/
+cp token_usage.py $STAGING_DIR/
+cp batch.py $STAGING_DIR/
+cp templates.py $STAGING_DIR/
+cp recipients.py $STAGING_DIR/
+cp attachment_cache.py $STAGING_DIR/
+cp attachment_store.py $STAGING_DIR/
+cp persistence.py $STAGING_DIR/
 cp requirements.txt $STAGING_DIR/
 cp email_logo_rounded.png $STAGING_DIR/
 # Copy .env if it exists
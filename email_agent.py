@@ -1,98 +1,595 @@
 import os
+import re
+import json
+from html import escape as html_escape
+import time
+import queue
+import random
 import argparse
-from dotenv import load_dotenv
-import google.generativeai as genai
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from smtp_pool import default_pool
+from rate_limit import RateLimiter, is_rate_limited
+from mime_stream import StreamingMessage, send_streaming
+from attachment_cache import default_attachment_cache
+from content_validator import scan, describe
+from html_normalizer import to_plaintext
+from metrics import default_metrics
+from resilience import CircuitOpenError, ResilientCaller, is_retryable, shared_breaker
+from model_registry import get_shared_model
+from token_usage import TokenUsage, estimate_tokens, key_usage, usage_counts
+from templates import EmailTemplate, TemplateError
+from recipients import parse_recipients
+
+# Model that answered the current request's last call (per thread / asyncio task), for cache keys.
+_answered_by = contextvars.ContextVar("answered_by", default=None)
+
+_PLACEHOLDER_RE = re.compile(r'\[(.*?)\]')
+_EXPECTED_OUTPUT_TOKENS = 400
+
+# Static instructions, set once on the model as its system instruction so each
+# request only carries the per-call details (subject, attachments).
+_EMAIL_RULES = """You write email bodies from a subject line.
+Pick the tone from the subject. Business, work or formal subjects (e.g. Invoice, Application, Meeting, Resignation) get a **Professional** tone: formal, polite, concise. Friends, family or casual subjects (e.g. Party, Catch up, Hello, Trip) get a **Personal** tone: friendly, warm, casual.
+Guidelines:
+- Structure: Start directly with a salutation. Use single spacing between paragraphs. Do NOT use excessive newlines.
+- Exclusions: Do NOT include the subject line, closing (Sincerely), signature placeholders (like [Your Name]), or the detected tone label (e.g., "Tone: Professional").
+- Missing Info: If details (dates, names, attachments) are needed, use clear placeholders like [Date], [Name], [Insert Attachment].
+- Attachments: If files are listed as attached, explicitly mention them (e.g., 'Please find attached...').
+- Variables: If variables are listed, the email is a template sent to many recipients: write [Variable] exactly as listed wherever that per-recipient detail belongs."""
+
+EMAIL_SYSTEM_INSTRUCTION = _EMAIL_RULES + """
+Return ONLY the email body text. Do not include any introductory or concluding remarks about the generation."""
+
+SUBJECT_SYSTEM_INSTRUCTION = ("Generate a concise, professional, and attention-grabbing email subject line for the "
+                              "email content/purpose you are given. Return ONLY the subject line, nothing else.")
+
+COMPOSE_SYSTEM_INSTRUCTION = _EMAIL_RULES + """
+Also write a concise, professional, and attention-grabbing subject line for the email.
+Reply in JSON: "body" is the email body, "subject" the subject line, "tone" the detected tone ("Professional" or "Personal"), and "placeholders" lists the placeholders used in the body, e.g. ["Date", "Name"]."""
+
+# Response schema for compose(); Gemini returns properties in alphabetical order, so "body" streams first
+COMPOSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "body": {"type": "string"},
+        "placeholders": {"type": "array", "items": {"type": "string"}},
+        "subject": {"type": "string"},
+        "tone": {"type": "string", "enum": ["Professional", "Personal"]},
+    },
+    "required": ["body", "subject", "tone", "placeholders"],
+}
+_COMPOSE_CONFIG = {"response_mime_type": "application/json", "response_schema": COMPOSE_SCHEMA}
+
+_SYSTEM_INSTRUCTIONS = {"email": EMAIL_SYSTEM_INSTRUCTION, "email_stream": EMAIL_SYSTEM_INSTRUCTION,
+                        "subject": SUBJECT_SYSTEM_INSTRUCTION, "compose": COMPOSE_SYSTEM_INSTRUCTION,
+                        "compose_stream": COMPOSE_SYSTEM_INSTRUCTION}
+
+_env_loaded = False
+
+
+def load_env():
+    """Loads .env into the environment once per process (dotenv is imported on first call)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
-# Load environment variables
-load_dotenv()
 
 class EmailAgent:
-    def __init__(self, api_key=None, mock_mode=True):
+    def __init__(self, api_key=None, mock_mode=True, smtp_pool=None, cache=None, metrics=None, resilience=None,
+                 model_registry=None, attachment_cache=None):
         self.mock_mode = mock_mode
+        self.smtp_pool = smtp_pool or default_pool
+        # Encoded attachment parts, reused when the same file goes out in several messages
+        self.attachment_cache = attachment_cache or default_attachment_cache
+        self.cache = cache  # Optional response_cache.ResponseCache
+        self.metrics = metrics or default_metrics
+        self.model_name = 'gemini-2.0-flash'
+        self._model = None
+        # Optional model_registry.ModelRegistry: routes each call to the fastest healthy model
+        self.model_registry = model_registry
+        self.last_model = None
+        self.last_composition = None  # set by compose_stream once the stream ends
+        # Deadlines, retries and a breaker shared by every agent calling this model
+        self.resilience = resilience or ResilientCaller(
+            breaker=shared_breaker(self.model_name, self.metrics), metrics=self.metrics)
+        self._callers = {self.model_name: self.resilience}
+        load_env()
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        # Token accounting for this agent (one per app session) and for its API key across the process
+        self.usage = TokenUsage()
+        self.key_usage = key_usage(self.api_key)
         
         if not self.api_key:
             print("Warning: GEMINI_API_KEY not found. Email generation will fail unless provided.")
-        else:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-2.0-flash')
-
-    def validate_email(self, body):
-        """Checks the email body for missing information placeholders."""
-        import re
-        # Look for patterns like [Date], [Name], [Insert ...], etc.
-        # This regex looks for square brackets containing text
-        placeholders = re.findall(r'\[(.*?)\]', body)
-        
-        # Filter out common non-error placeholders if any (e.g., if we used [Signature] internally, but we don't)
-        # We want to catch things like [Date], [Time], [Your Name], [Client Name]
-        
-        missing_info = []
-        for p in placeholders:
-            # Simple heuristic: if it looks like a placeholder instruction
-            if any(keyword in p.lower() for keyword in ['date', 'time', 'name', 'insert', 'attach', 'agenda', 'link', 'here']):
-                missing_info.append(f"[{p}]")
-        
-        return missing_info
 
-    def generate_email(self, subject, attachment_names=None):
-        """Generates an email body based on the subject using Gemini."""
+    @property
+    def model(self):
+        """The configured model's shared client (created on first use), unless one was assigned."""
+        if self._model is not None:
+            return self._model
+        return get_shared_model(self.api_key, self.model_name)
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def _model_for(self, model_name, kind):
+        """The shared client for `model_name` carrying the system instruction for `kind`."""
+        if self._model is not None:
+            return self._model
+        return get_shared_model(self.api_key, model_name, _SYSTEM_INSTRUCTIONS.get(kind))
+
+    def count_tokens(self, prompt, kind="email"):
+        """Input tokens for `prompt` (system instruction included), counted by the API."""
+        return self._model_for(self.model_name, kind).count_tokens(prompt).total_tokens
+
+    def _record_usage(self, kind, prompt, response, text, latency):
+        counts = usage_counts(response)
+        estimated = counts is None
+        if estimated:
+            counts = (estimate_tokens(_SYSTEM_INSTRUCTIONS.get(kind, "") + prompt), estimate_tokens(text))
+        for usage in (self.usage, self.key_usage):
+            usage.record(kind, counts[0], counts[1], latency, estimated)
+        self.metrics.observe("input_tokens", counts[0], kind=kind)
+        self.metrics.observe("output_tokens", counts[1], kind=kind)
+
+    def validate_email(self, body, attachments=None, template=None):
+        """Checks the email body for missing information placeholders.
+
+        Flags placeholders like [Date] or [Your Name] and empty links. When
+        `attachments` is given, also flags attachment mentions with nothing attached.
+        With a `template`, any of its variables left unfilled is flagged too.
+        """
+        attachment_count = None if attachments is None else len(attachments)
+        variables = template.variables if template is not None else {}
+        return [describe(f) for f in scan(body, attachment_count)
+                if f.kind != "bracket" or f.text[1:-1].lower() in variables]
+
+    def _build_email_prompt(self, subject, attachment_names=None, variables=None):
+        """Builds the per-call payload for an email body; the rules live in EMAIL_SYSTEM_INSTRUCTION."""
+        start = time.perf_counter()
+        prompt = f"Subject: '{subject}'"
+        if attachment_names:
+            prompt += f"\nAttached files: {', '.join(attachment_names)}"
+        if variables:
+            prompt += f"\nVariables: {', '.join(f'[{name}]' for name in variables)}"
+        self.metrics.observe("prompt_build_seconds", time.perf_counter() - start, kind="email")
+        return prompt
+
+    @staticmethod
+    def _clean_email_text(email_text):
+        # Post-processing
+        if email_text.lower().startswith("subject:"):
+            email_text = email_text.split("\n", 1)[1].strip()
+        return email_text
+
+    @staticmethod
+    def _build_subject_prompt(content):
+        return f"'{content}'"
+
+    @staticmethod
+    def _clean_subject(text):
+        return text.strip().replace("Subject:", "").strip()
+
+    def _cache_model(self):
+        """The model a call would be routed to first, whose cached answers a lookup may reuse."""
+        if self.model_registry is None or self._model is not None:
+            return self.model_name
+        return self.model_registry.route(self.api_key, preferred=[self.model_name], explore=False)[0]
+
+    def _cache_lookup(self, prompt, attachment_names=None, regenerate=False, kind="email"):
+        """Returns (cache_key, cached_text). Both are None when caching is off.
+
+        The key passed to _cache_store is completed with the model that actually answered.
+        """
+        if self.cache is None:
+            return None, None
+        _answered_by.set(None)
+        # The system instruction is part of the key, so editing it invalidates old drafts
+        key = (_SYSTEM_INSTRUCTIONS.get(kind, "") + "\n" + prompt, attachment_names)
+        if regenerate:
+            return key, None
+        return key, self.cache.get(self.cache.make_key(key[0], self._cache_model(), key[1]))
+
+    def _cache_store(self, key, text):
+        if key is not None:
+            self.cache.set(self.cache.make_key(key[0], _answered_by.get() or self.model_name, key[1]), text)
+
+    def _generate_text(self, prompt, kind="email", max_attempts=None, generation_config=None):
+        """One model call through self.resilience. Raises on failure; callers decide how to report it."""
+        def attempt(model, timeout):
+            return model.generate_content(prompt, generation_config=generation_config,
+                                          request_options=_request_options(timeout))
+
+        start = time.perf_counter()
+        with self.metrics.timer("model_latency_seconds", kind=kind):
+            response = self._call_model(attempt, kind, max_attempts)
+            text = response.text
+        self.metrics.observe("response_chars", len(text), kind=kind)
+        self._record_usage(kind, prompt, response, text, time.perf_counter() - start)
+        return text
+
+    def _caller_for(self, model_name):
+        """self.resilience's settings, with the model's own process-wide breaker."""
+        caller = self._callers.get(model_name)
+        if caller is None:
+            caller = self._callers[model_name] = self.resilience.with_breaker(shared_breaker(model_name, self.metrics))
+        return caller
+
+    def _call_model(self, request, kind, max_attempts=None, profile=True):
+        """Runs `request(model, timeout)` with retries/deadline, on the routed model when a registry is set.
+
+        With a registry, models are tried fastest-healthy first and a model that
+        fails with a retryable error (or an open circuit) falls through to the
+        next one. `profile=False` keeps the call out of the latency profiles
+        (e.g. streams, which only measure time to first chunk).
+        """
+        if self.model_registry is None or self._model is not None:
+            model = self._model_for(self.model_name, kind)  # resolved here: attempts may run on a worker thread
+            self.last_model = self.model_name
+            _answered_by.set(self.model_name)
+            return self.resilience.call(lambda timeout: request(model, timeout), kind=kind, max_attempts=max_attempts)
+
+        error = None
+        for name in self.model_registry.route(self.api_key, preferred=[self.model_name], explore=profile):
+            model = self._model_for(name, kind)
+            start = time.monotonic()
+            try:
+                result = self._caller_for(name).call(lambda timeout: request(model, timeout), kind=kind,
+                                                     max_attempts=max_attempts)
+            except Exception as e:
+                if not isinstance(e, CircuitOpenError):
+                    self.model_registry.record(name, time.monotonic() - start, ok=False)
+                if not (is_retryable(e) or isinstance(e, CircuitOpenError)):
+                    raise
+                self.metrics.incr("model_fallbacks_total", model=name, kind=kind)
+                error = e
+                continue
+            if profile:
+                self.model_registry.record(name, time.monotonic() - start, ok=True)
+            self.last_model = name
+            _answered_by.set(name)
+            return result
+        raise error
+
+    def generate_email(self, subject, attachment_names=None, regenerate=False, variables=None):
+        """Generates an email body based on the subject using Gemini.
+
+        Identical requests are served from `self.cache` when one is configured;
+        pass `regenerate=True` to skip the lookup and fetch a fresh draft.
+        `variables` names per-recipient placeholders the body should use.
+        """
         if not self.api_key:
             return "Error: API Key missing. Cannot generate email."
-        
-        # Construct context about attachments
-        attachment_context = ""
-        if attachment_names:
-            file_list = ", ".join(attachment_names)
-            attachment_context = f"The following files are attached to this email: {file_list}. Please explicitly mention them in the email body (e.g., 'Please find attached...')."
 
-        # Updated prompt for clarity, grammar, and official formatting
-        prompt = f"""
-        Analyze the subject '{subject}' to determine the appropriate tone (Professional vs Personal).
-        
-        - If the subject suggests a business, work, or formal context (e.g., "Invoice", "Application", "Meeting", "Resignation"), use a **Professional** tone (Formal, polite, concise).
-        - If the subject suggests a friends, family, or casual context (e.g., "Party", "Catch up", "Hello", "Trip"), use a **Personal** tone (Friendly, warm, casual).
-        
-        Write the email body accordingly.
-        
-        Context:
-        {attachment_context}
-        
-        Guidelines:
-        - Structure: Start directly with a salutation. Use single spacing between paragraphs. Do NOT use excessive newlines.
-        - Exclusions: Do NOT include the subject line, closing (Sincerely), signature placeholders (like [Your Name]), or the detected tone label (e.g., "Tone: Professional").
-        - Missing Info: If details (dates, names, attachments) are needed, use clear placeholders like [Date], [Name], [Insert Attachment].
-        
-        Return ONLY the email body text. Do not include any introductory or concluding remarks about the generation.
+        prompt = self._build_email_prompt(subject, attachment_names, variables)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate)
+        if cached is not None:
+            return cached
+        try:
+            email_text = self._clean_email_text(self._generate_text(prompt))
+        except Exception as e:
+            return f"Error generating email: {e}"
+        self._cache_store(key, email_text)
+        return email_text
+
+    def generate_template(self, subject, variables=None, attachment_names=None, regenerate=False, html=True):
+        """Drafts one body for a whole campaign and compiles it into an EmailTemplate.
+
+        `variables` (e.g. ["Name", "Company"]) are the per-recipient details
+        the model should leave as [Placeholders]; the template then renders
+        locally for each recipient, so one model call serves any list size.
+        With `html=True` the body is converted for an HTML message, as
+        send_many expects. Returns the "Error ..." text on failure.
         """
+        # Called on EmailAgent explicitly: AsyncEmailAgent overrides generate_email with a coroutine
+        body = EmailAgent.generate_email(self, subject, attachment_names, regenerate=regenerate, variables=variables)
+        if body.startswith("Error"):
+            return body
+        if html:
+            body = html_escape(body).replace("\n", "<br>")
+        return EmailTemplate(body, html=html)
+
+    def generate_email_stream(self, subject, attachment_names=None, regenerate=False):
+        """Streaming variant of generate_email: yields the body as text chunks arrive.
+
+        A leading "Subject:" line is dropped incrementally. The full text is
+        cached once the stream completes, and a cache hit is yielded as one chunk.
+        """
+        if not self.api_key:
+            yield "Error: API Key missing. Cannot generate email."
+            return
+
+        prompt = self._build_email_prompt(subject, attachment_names)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        start = time.perf_counter()
         try:
-            response = self.model.generate_content(prompt)
-            email_text = response.text
-            # Post-processing
-            if email_text.lower().startswith("subject:"):
-                email_text = email_text.split("\n", 1)[1].strip()
+            # Retries and the deadline cover the request up to the first chunk
+            response = self._call_model(
+                lambda model, timeout: model.generate_content(prompt, stream=True, request_options=_request_options(timeout)),
+                "email_stream", profile=False)
+            for piece in _strip_subject_stream(chunk.text for chunk in response):
+                if not parts:
+                    self.metrics.observe("model_first_chunk_seconds", time.perf_counter() - start, kind="email")
+                parts.append(piece)
+                yield piece
+        except Exception as e:
+            self.metrics.observe("model_latency_seconds", time.perf_counter() - start, outcome="error", kind="email_stream")
+            yield f"Error generating email: {e}"
+            return
+        latency = time.perf_counter() - start
+        self.metrics.observe("model_latency_seconds", latency, outcome="ok", kind="email_stream")
+        text = "".join(parts).strip()
+        self.metrics.observe("response_chars", len(text), kind="email_stream")
+        self._record_usage("email_stream", prompt, response, text, latency)
+        self._cache_store(key, text)
+
+    def generate_emails(self, subjects, attachment_names=None, concurrency=4, requests_per_minute=60,
+                        tokens_per_minute=None, max_retries=4, rate_limiter=None):
+        """Drafts one email per subject concurrently, within Gemini quota limits.
+
+        At most `concurrency` requests are in flight, and a RateLimiter enforces
+        requests/min and (estimated) tokens/min. 429 responses slow the limiter
+        down and are retried with exponential backoff. Bodies come back in input
+        order, along with wall time compared to the serial baseline (the sum of
+        per-request latencies).
+        """
+        subjects = list(subjects)
+        limiter = rate_limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+        latencies = [0.0] * len(subjects)
+
+        def draft(index):
+            email_text, latencies[index] = self.draft_limited(subjects[index], limiter, attachment_names, max_retries)
             return email_text
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            emails = list(executor.map(draft, range(len(subjects))))
+        wall_time = time.perf_counter() - start
+        serial_time = sum(latencies)
+
+        report = {
+            "emails": emails,
+            "wall_time": wall_time,
+            "serial_time": serial_time,
+            "speedup": serial_time / wall_time if wall_time > 0 else 0.0,
+            "throttled": limiter.throttled,
+        }
+        print(f"Generated {len(emails)} emails in {wall_time:.2f}s "
+              f"(serial baseline {serial_time:.2f}s, {report['speedup']:.1f}x, {limiter.throttled} throttled)")
+        return report
+
+    def compose(self, subject, attachment_names=None, regenerate=False):
+        """Drafts the body, an optimized subject, the tone and the required placeholders in one call.
+
+        Returns a dict with "body", "subject", "tone" and "placeholders". The
+        reply is constrained by COMPOSE_SCHEMA and parsed strictly; if it can't
+        be parsed (or the model rejects the schema), falls back to
+        generate_email + optimize_subject. On failure "body" holds the error.
+        """
+        if not self.api_key:
+            return _composition("Error: API Key missing. Cannot generate email.", subject)
+
+        prompt = self._build_email_prompt(subject, attachment_names)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate, kind="compose")
+        if cached is not None:
+            return json.loads(cached)
+        try:
+            composition = parse_composition(self._generate_text(prompt, kind="compose", generation_config=_COMPOSE_CONFIG))
         except Exception as e:
-            return f"Error generating email: {e}"
+            if not _falls_back(e):
+                return _composition(f"Error generating email: {e}", subject)
+            self.metrics.incr("compose_fallbacks_total", reason=type(e).__name__)
+            return self._compose_fallback(subject, attachment_names, regenerate=regenerate)
+        self._cache_store(key, json.dumps(composition))
+        return composition
+
+    def compose_stream(self, subject, attachment_names=None, regenerate=False):
+        """Streaming variant of compose: yields the body as it arrives.
+
+        The full result (as compose returns it) is in `self.last_composition`
+        once the generator is exhausted; it stays None after an error.
+        """
+        self.last_composition = None
+        if not self.api_key:
+            yield "Error: API Key missing. Cannot generate email."
+            return
+
+        prompt = self._build_email_prompt(subject, attachment_names)
+        key, cached = self._cache_lookup(prompt, attachment_names, regenerate, kind="compose")
+        if cached is not None:
+            self.last_composition = json.loads(cached)
+            yield self.last_composition["body"]
+            return
+
+        raw, parts = [], []
+        start = time.perf_counter()
+        try:
+            response = self._call_model(
+                lambda model, timeout: model.generate_content(prompt, stream=True, generation_config=_COMPOSE_CONFIG,
+                                                              request_options=_request_options(timeout)),
+                "compose_stream", profile=False)
+            for piece in _json_body_stream((chunk.text for chunk in response), raw):
+                if not parts:
+                    self.metrics.observe("model_first_chunk_seconds", time.perf_counter() - start, kind="compose")
+                parts.append(piece)
+                yield piece
+            composition = parse_composition("".join(raw))
+        except Exception as e:
+            if not _falls_back(e) or (parts and not isinstance(e, ValueError)):
+                yield f"Error generating email: {e}"
+                return
+            self.metrics.incr("compose_fallbacks_total", reason=type(e).__name__)
+            if parts:
+                # The body already reached the caller; only the subject needs a second call
+                self.last_composition = self._compose_fallback(subject, body="".join(parts).strip())
+            else:
+                self.last_composition = self._compose_fallback(subject, attachment_names, regenerate=regenerate)
+                yield self.last_composition["body"]
+            return
+        latency = time.perf_counter() - start
+        self.metrics.observe("model_latency_seconds", latency, outcome="ok", kind="compose_stream")
+        self._record_usage("compose_stream", prompt, response, "".join(raw), latency)
+        if not parts:
+            yield composition["body"]  # "body" wasn't the first key, so nothing was streamed
+        self._cache_store(key, json.dumps(composition))
+        self.last_composition = composition
 
-    def optimize_subject(self, content):
+    def _compose_fallback(self, subject, attachment_names=None, regenerate=False, body=None):
+        """The two-call path: generate_email (unless `body` is given), then optimize_subject on the body."""
+        # Called on EmailAgent explicitly: AsyncEmailAgent overrides both with coroutines
+        if body is None:
+            body = EmailAgent.generate_email(self, subject, attachment_names, regenerate=regenerate)
+            if body.startswith("Error"):
+                return _composition(body, subject)
+        new_subject = EmailAgent.optimize_subject(self, body, regenerate=regenerate)
+        return _composition(body, subject if new_subject.startswith("Error") else new_subject)
+
+    def draft_limited(self, subject, limiter, attachment_names=None, max_retries=4, variables=None):
+        """One generate_email call paced by a shared RateLimiter.
+
+        429 responses slow the limiter down and are retried with exponential
+        backoff. Returns (body or "Error ..." text, seconds spent in model calls).
+        """
+        if not self.api_key:
+            return "Error: API Key missing. Cannot generate email.", 0.0
+        prompt = self._build_email_prompt(subject, attachment_names, variables)
+        key, cached = self._cache_lookup(prompt, attachment_names)
+        if cached is not None:
+            return cached, 0.0
+        # Measured input size of earlier calls when known, else ~4 characters per token; plus room for the reply
+        average_input = self.key_usage.average_input_tokens("email")
+        estimated_tokens = int(average_input or estimate_tokens(EMAIL_SYSTEM_INSTRUCTION + prompt)) + _EXPECTED_OUTPUT_TOKENS
+        latency = 0.0
+        for attempt in range(max_retries + 1):
+            limiter.acquire(estimated_tokens)
+            start = time.perf_counter()
+            try:
+                # 429s are retried here, against the shared limiter, not inside the call
+                email_text = self._clean_email_text(self._generate_text(prompt, max_attempts=1))
+            except Exception as e:
+                latency += time.perf_counter() - start
+                if is_rate_limited(e) and attempt < max_retries:
+                    limiter.on_throttled()
+                    time.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+                    continue
+                return f"Error generating email: {e}", latency
+            latency += time.perf_counter() - start
+            limiter.on_success()
+            self._cache_store(key, email_text)
+            return email_text, latency
+
+    def optimize_subject(self, content, regenerate=False):
         """Generates a concise, professional subject line based on content/purpose."""
         if not self.api_key:
             return "Error: API Key missing."
         
-        prompt = f"Generate a concise, professional, and attention-grabbing email subject line for the following email content/purpose:\n\n'{content}'\n\nReturn ONLY the subject line, nothing else."
+        prompt = self._build_subject_prompt(content)
+        key, cached = self._cache_lookup(prompt, regenerate=regenerate, kind="subject")
+        if cached is not None:
+            return cached
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip().replace("Subject:", "").strip()
+            subject = self._clean_subject(self._generate_text(prompt, kind="subject"))
         except Exception as e:
             return f"Error: {e}"
+        self._cache_store(key, subject)
+        return subject
 
-    def send_email(self, to_email, subject, body, smtp_settings=None, attachments=None):
-        """Sends the email with optional attachments."""
+    def _build_message(self, from_email, to_email, subject, body, attachments=None, text_body=None, cc=None):
+        """Builds the MIME message, once for all of its recipients.
+
+        `to_email` and `cc` are an address or a list of addresses (BCC never
+        appears in the headers). The body goes out as multipart/alternative
+        (plaintext + HTML); the plaintext is derived from the HTML unless
+        `text_body` is given.
+        """
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.base import MIMEBase
+        from email import encoders
+
+        msg = MIMEMultipart()
+        msg['From'] = from_email
+        msg['To'] = to_email if isinstance(to_email, str) else ", ".join(to_email)
+        if cc:
+            msg['Cc'] = ", ".join(cc)
+        msg['Subject'] = subject
+        if text_body is None:
+            text_body = to_plaintext(body)
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText(text_body, 'plain'))
+        alternative.attach(MIMEText(body, 'html'))
+        msg.attach(alternative)
+
+        # Process Attachments
+        if attachments:
+            for file in attachments:
+                try:
+                    part = MIMEBase('application', "octet-stream")
+                    part.set_payload(file.getvalue())
+                    encoders.encode_base64(part)
+                    part.add_header('Content-Disposition', f'attachment; filename="{file.name}"')
+                    msg.attach(part)
+                except Exception as e:
+                    print(f"Error attaching file {file.name}: {e}")
+        return msg
+
+    def _build_streaming_message(self, from_email, to_email, subject, body, attachments=None, cc=None):
+        """Like _build_message, but attachments are encoded lazily (or taken from the cache) while the message is sent."""
+        return StreamingMessage(self._build_message(from_email, to_email, subject, body, cc=cc), attachments,
+                                cache=self.attachment_cache)
+
+    def deliver(self, to_email, subject, body, smtp_settings, attachments=None, cc=None, bcc=None):
+        """Builds one message and sends it to every To/CC/BCC address in a single SMTP transaction.
+
+        Addresses are normalized and deduplicated (see recipients.parse_recipients).
+        Returns {address: (code, reason text)} for each refused or malformed address;
+        raises only when no recipient is accepted, or on a transport failure.
+        """
+        recipients = parse_recipients(to_email, cc, bcc)
+        refused = {address: (501, "invalid address") for address in recipients.invalid}
+        envelope = recipients.to + recipients.cc + recipients.bcc
+        if not envelope:
+            import smtplib
+            raise smtplib.SMTPRecipientsRefused(refused or {to_email: (501, "no recipients")})
+        if self.mock_mode:
+            # The base implementation, so subclasses with a coroutine send_email still send
+            EmailAgent.send_email(self, to_email, subject, body, smtp_settings, attachments, cc=cc, bcc=bcc)
+            return refused
+        message = self._build_streaming_message(smtp_settings['email'], recipients.to, subject, body, attachments,
+                                                cc=recipients.cc)
+        # Reuses a warm authenticated session when one is available; attachments are
+        # encoded straight into the DATA stream instead of being built in memory first
+        with self.metrics.timer("send_seconds", mode="single"):
+            rejected = self.smtp_pool.transact(
+                smtp_settings,
+                lambda server: send_streaming(server, smtp_settings['email'], envelope, message, self.metrics))
+        self.metrics.observe("message_recipients", len(envelope))
+        for address, (code, reason) in rejected.items():
+            refused[address] = (code, reason.decode("utf-8", "replace") if isinstance(reason, bytes) else str(reason))
+        return refused
+
+    def send_email(self, to_email, subject, body, smtp_settings=None, attachments=None, cc=None, bcc=None):
+        """Sends the email with optional attachments to To (and optional CC/BCC) addresses.
+
+        Returns True when at least one recipient was accepted; refused
+        addresses are reported one by one.
+        """
         if self.mock_mode:
             print("\n" + "="*30)
             print(f" [MOCK SEND] Sending Email...")
             print(f" To: {to_email}")
+            if cc or bcc:
+                print(f" CC: {cc or ''} | BCC: {bcc or ''}")
             print(f" Subject: {subject}")
             print(f" Attachments: {len(attachments) if attachments else 0} files")
             print(f" Body:\n{body}")
@@ -102,54 +599,370 @@ class EmailAgent:
             if not smtp_settings:
                 print("Error: SMTP settings required for real sending.")
                 return False
-            
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            from email.mime.base import MIMEBase
-            from email import encoders
 
             try:
-                msg = MIMEMultipart()
-                msg['From'] = smtp_settings['email']
-                msg['To'] = to_email
-                msg['Subject'] = subject
-                msg.attach(MIMEText(body, 'html'))
-
-                # Process Attachments
-                if attachments:
-                    for file in attachments:
-                        try:
-                            part = MIMEBase('application', "octet-stream")
-                            part.set_payload(file.getvalue())
-                            encoders.encode_base64(part)
-                            part.add_header('Content-Disposition', f'attachment; filename="{file.name}"')
-                            msg.attach(part)
-                        except Exception as e:
-                            print(f"Error attaching file {file.name}: {e}")
-
-                server = smtplib.SMTP(smtp_settings['server'], smtp_settings['port'])
-                server.starttls()
-                server.login(smtp_settings['email'], smtp_settings['password'])
-                text = msg.as_string()
-                server.sendmail(smtp_settings['email'], to_email, text)
-                server.quit()
+                refused = self.deliver(to_email, subject, body, smtp_settings, attachments, cc=cc, bcc=bcc)
+                for address, (code, reason) in refused.items():
+                    print(f"Recipient refused: {address} ({code} {reason})")
                 print(f"Email sent successfully to {to_email}")
                 return True
             except Exception as e:
                 print(f"Error sending email: {e}")
                 return False
 
+    def send_many(self, recipients, subject, body, smtp_settings=None, attachments=None, workers=4, max_retries=2,
+                  retry_delay=1.0):
+        """Mail-merges `subject`/`body` to many recipients over parallel pooled SMTP sessions.
+
+        Each recipient is an address string, an (address, variables) tuple, or a
+        dict with an "email" key whose other keys are variables. Variables fill
+        matching [Placeholders] in the subject and body. `body` may also be an
+        EmailTemplate (see generate_template): it is rendered per recipient and
+        checked with validate_email, and recipients left with unfilled or
+        mistyped variables are reported as "invalid" instead of being sent.
+        One failing address never stops the batch; every recipient gets a result entry.
+        Temporary (4xx) refusals are retried after a jittered backoff starting at `retry_delay` seconds.
+        """
+        jobs = queue.Queue()
+        addresses = []
+        for recipient in recipients:
+            email, variables = _split_recipient(recipient)
+            jobs.put((len(addresses), email, variables, 0))
+            addresses.append(email)
+        total = len(addresses)
+
+        results = [None] * total
+        start = time.perf_counter()
+
+        if self.mock_mode:
+            while not jobs.empty():
+                index, email, variables, _ = jobs.get()
+                personal_subject, _, problems = self._personalize(subject, body, variables)
+                if problems:
+                    results[index] = {"email": email, "status": "invalid", "attempts": 0, "retried": False,
+                                      "error": "; ".join(problems)}
+                    continue
+                print(f" [MOCK SEND] To: {email} | Subject: {personal_subject}")
+                results[index] = {"email": email, "status": "accepted", "attempts": 1, "retried": False, "error": None}
+        elif not smtp_settings:
+            print("Error: SMTP settings required for real sending.")
+            return None
+        elif total:
+            # The pool caps sessions per account, so extra workers would only queue up.
+            workers = max(1, min(workers, total, self.smtp_pool.max_per_key))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self._send_worker, jobs, results, subject, body, smtp_settings, attachments,
+                                    max_retries, retry_delay)
+                    for _ in range(workers)
+                ]
+                for future in futures:
+                    if future.exception() is not None:
+                        print(f"Send worker error: {future.exception()}")
+            # Anything a crashed worker left behind still gets a result entry
+            for index, result in enumerate(results):
+                if result is None:
+                    results[index] = {"email": addresses[index], "status": "failed", "attempts": 0,
+                                      "retried": False, "error": "not sent: send worker stopped"}
+
+        elapsed = time.perf_counter() - start
+        summary = {
+            "results": results,
+            "accepted": sum(1 for r in results if r["status"] == "accepted"),
+            "rejected": sum(1 for r in results if r["status"] == "rejected"),
+            "failed": sum(1 for r in results if r["status"] == "failed"),
+            "invalid": sum(1 for r in results if r["status"] == "invalid"),
+            "retried": sum(1 for r in results if r["retried"]),
+            "elapsed": elapsed,
+            "throughput": total / elapsed if elapsed > 0 else 0.0,
+        }
+        print(f"Bulk send finished: {summary['accepted']}/{total} accepted in {elapsed:.2f}s "
+              f"({summary['throughput']:.1f} msg/s)")
+        return summary
+
+    def _personalize(self, subject, body, variables):
+        """One recipient's (subject, body, problems); only template bodies are validated."""
+        if not isinstance(body, EmailTemplate):
+            return fill_placeholders(subject, variables), fill_placeholders(body, variables), []
+        try:
+            personal_body = body.render(variables)
+        except TemplateError as e:
+            return None, None, [str(e)]
+        personal_subject = fill_placeholders(subject, variables)
+        return personal_subject, personal_body, (self.validate_email(personal_subject, template=body)
+                                                 + self.validate_email(personal_body, template=body))
+
+    def _send_worker(self, jobs, results, subject, body, smtp_settings, attachments, max_retries, retry_delay=1.0):
+        """Drains the job queue over a single pooled session, reconnecting when it breaks."""
+        import smtplib
+
+        from_email = smtp_settings['email']
+        conn = None
+        try:
+            while True:
+                try:
+                    index, email, variables, attempts = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                attempts += 1
+
+                def record(status, error=None):
+                    results[index] = {"email": email, "status": status, "attempts": attempts,
+                                      "retried": attempts > 1, "error": error}
+
+                def retry_later(code):
+                    """Requeues a 4xx (greylisting / throttling) after a jittered backoff; False if it can't."""
+                    if not (400 <= code < 500 and attempts <= max_retries):
+                        return False
+                    time.sleep(retry_delay * 2 ** (attempts - 1) * random.uniform(0.5, 1.0))
+                    jobs.put((index, email, variables, attempts))
+                    return True
+
+                try:
+                    personal_subject, personal_body, problems = self._personalize(subject, body, variables)
+                    if problems:
+                        record("invalid", "; ".join(problems))
+                        continue
+                    message = self._build_streaming_message(from_email, email, personal_subject, personal_body, attachments)
+                    if conn is None:
+                        conn = self.smtp_pool.acquire(smtp_settings)
+                    with self.metrics.timer("send_seconds", mode="bulk"):
+                        send_streaming(conn.server, from_email, [email], message, self.metrics)
+                    record("accepted")
+                except smtplib.SMTPRecipientsRefused as e:
+                    # Address refused at RCPT; the session itself is still usable.
+                    reply = e.recipients.get(email, (550, str(e)))
+                    if not retry_later(reply[0]):
+                        record("rejected", str(reply))
+                except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    # smtplib has already RSET the session. 4xx replies are worth another try.
+                    if not retry_later(e.smtp_code):
+                        record("rejected", str(e))
+                except (smtplib.SMTPException, OSError) as e:
+                    # Transport failure: drop the session and requeue on a fresh one.
+                    if conn is not None:
+                        self.smtp_pool.release(conn, discard=True)
+                        conn = None
+                    if attempts <= max_retries:
+                        jobs.put((index, email, variables, attempts))
+                    else:
+                        record("failed", str(e))
+                except Exception as e:
+                    # Not a delivery problem (building or encoding the message, say): retrying won't help
+                    if conn is not None:
+                        self.smtp_pool.release(conn, discard=True)
+                        conn = None
+                    record("failed", f"{type(e).__name__}: {e}")
+        finally:
+            if conn is not None:
+                self.smtp_pool.release(conn)
+
+
+def _request_options(timeout):
+    return {"timeout": timeout} if timeout else None
+
+
+def _split_recipient(recipient):
+    """Normalizes a send_many recipient into (address, variables)."""
+    if isinstance(recipient, str):
+        return recipient, {}
+    if isinstance(recipient, dict):
+        variables = {k: v for k, v in recipient.items() if k != "email"}
+        return recipient["email"], variables
+    email, variables = recipient
+    return email, dict(variables or {})
+
+
+def _composition(body, subject, tone=None):
+    placeholders = list(dict.fromkeys(_PLACEHOLDER_RE.findall(subject + "\n" + body)))
+    return {"body": body, "subject": subject, "tone": tone, "placeholders": placeholders}
+
+
+def parse_composition(text):
+    """Parses a compose reply; raises ValueError unless it carries a non-empty body and subject.
+
+    Placeholders are taken from the body and subject themselves rather than
+    trusted from the reply, and an unknown tone becomes None.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("compose reply is not a JSON object")
+    body, subject = data.get("body"), data.get("subject")
+    if not isinstance(body, str) or not body.strip() or not isinstance(subject, str) or not subject.strip():
+        raise ValueError("compose reply is missing the body or subject")
+    tone = data.get("tone")
+    tone = tone.capitalize() if isinstance(tone, str) and tone.capitalize() in ("Professional", "Personal") else None
+    return _composition(EmailAgent._clean_email_text(body.strip()), EmailAgent._clean_subject(subject), tone)
+
+
+def _falls_back(exc):
+    """Whether compose should retry through the two-call path: bad JSON, or the schema was rejected (400)."""
+    return isinstance(exc, ValueError) or getattr(exc, "code", None) == 400
+
+
+_JSON_BODY_KEY_RE = re.compile(r'\s*(?:```(?:json)?\s*)?\{\s*"body"\s*:')
+
+
+def _json_body_stream(chunks, raw):
+    """Yields the decoded "body" string of a streamed JSON reply as it arrives.
+
+    Streams only when "body" is the first key; otherwise yields nothing and
+    the caller takes the body from the parsed reply. Every chunk is also
+    appended to `raw`, so the caller can parse the whole reply afterwards.
+    """
+    buffer = ""
+    pos = None  # next undecoded character of the body string in `buffer`
+    done = False
+    for chunk in chunks:
+        raw.append(chunk)
+        if done:
+            continue
+        buffer += chunk
+        if pos is None:
+            if ":" not in buffer:
+                continue  # Not enough text yet to tell
+            match = _JSON_BODY_KEY_RE.match(buffer)
+            value = buffer[match.end():].lstrip() if match else ""
+            if match and not value:
+                continue
+            if not value.startswith('"'):
+                done = True
+                continue
+            pos = len(buffer) - len(value) + 1
+        end = pos
+        while end < len(buffer):
+            char = buffer[end]
+            if char == '"':
+                done = True
+                break
+            if char == "\\":
+                width = 2
+                if buffer[end + 1:end + 2] == "u":
+                    # Keep surrogate pairs (\ud83d\ude00) together so they decode to one character
+                    width = 12 if buffer[end + 2:end + 4].lower() in ("d8", "d9", "da", "db") else 6
+                if end + width > len(buffer):
+                    break
+                end += width
+            else:
+                end += 1
+        if end > pos:
+            yield json.loads('"' + buffer[pos:end] + '"')
+            pos = end
+
+
+def _strip_subject_stream(chunks):
+    """Incremental version of EmailAgent._clean_email_text: drops a leading "Subject:" line."""
+    prefix = "subject:"
+    state = "detect"
+    buffer = ""
+    for chunk in chunks:
+        if state == "pass":
+            yield chunk
+            continue
+        buffer += chunk
+        if state == "detect":
+            head = buffer.lower()
+            if len(head) < len(prefix) and prefix.startswith(head):
+                continue  # Not enough text yet to tell
+            if not head.startswith(prefix):
+                state = "pass"
+                yield buffer
+                buffer = ""
+                continue
+            state = "skip_line"
+        if state == "skip_line":
+            if "\n" not in buffer:
+                continue
+            buffer = buffer.split("\n", 1)[1]
+            state = "lstrip"
+        if state == "lstrip":
+            buffer = buffer.lstrip()
+            if buffer:
+                state = "pass"
+                yield buffer
+                buffer = ""
+    if state == "detect" and buffer:
+        yield buffer
+
+
+def bold_placeholders(text):
+    """Wraps [Placeholders] in <b> tags for the HTML editor."""
+    return _PLACEHOLDER_RE.sub(r'<b>[\1]</b>', text)
+
+
+def bold_placeholders_stream(chunks):
+    """Applies bold_placeholders to a chunk stream without splitting a placeholder.
+
+    Text from an unclosed "[" is held back until its "]" arrives or a newline
+    rules it out (placeholders never span lines).
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        last_end = 0
+        for match in _PLACEHOLDER_RE.finditer(pending):
+            last_end = match.end()
+        line_start = pending.rfind("\n", last_end) + 1
+        hold = pending.find("[", max(last_end, line_start))
+        if hold == -1:
+            ready, pending = pending, ""
+        else:
+            ready, pending = pending[:hold], pending[hold:]
+        if ready:
+            yield bold_placeholders(ready)
+    if pending:
+        yield bold_placeholders(pending)
+
+
+def fill_placeholders(text, variables):
+    """Replaces [Key] placeholders with values from `variables` (keys match case-insensitively)."""
+    if not variables:
+        return text
+    lookup = {str(k).lower(): str(v) for k, v in variables.items()}
+    return _PLACEHOLDER_RE.sub(lambda m: lookup.get(m.group(1).lower(), m.group(0)), text)
+
+
 def main():
     parser = argparse.ArgumentParser(description="AI Email Agent")
-    parser.add_argument("--subject", required=True, help="Subject of the email")
-    parser.add_argument("--to", required=True, help="Recipient email address")
+    parser.add_argument("--subject", help="Subject of the email")
+    parser.add_argument("--to", help="Recipient email address")
+    parser.add_argument("--input", help="Batch mode: CSV or JSONL file of rows (to, subject, optional body/id, placeholder columns)")
+    parser.add_argument("--checkpoint", help="Batch progress log used to resume (default: <input>.checkpoint.jsonl)")
+    parser.add_argument("--generate-workers", type=int, default=4, help="Concurrent model calls in batch mode")
+    parser.add_argument("--validate-workers", type=int, default=1, help="Concurrent validations in batch mode")
+    parser.add_argument("--send-workers", type=int, default=4, help="Concurrent SMTP sends in batch mode")
+    parser.add_argument("--requests-per-minute", type=int, default=60, help="Gemini request quota in batch mode")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Seconds between batch progress lines")
+    parser.add_argument("--template", action="store_true",
+                        help="Batch mode: draft one template per subject and fill it locally for each row")
+    parser.add_argument("--smtp-server", default="smtp.gmail.com")
+    parser.add_argument("--smtp-port", type=int, default=587)
+    parser.add_argument("--smtp-email", help="Sender address (the password is read from SMTP_PASSWORD)")
     parser.add_argument("--mock", action="store_true", default=True, help="Force mock mode (default)")
     parser.add_argument("--real", action="store_false", dest="mock", help="Enable real email sending")
     
     args = parser.parse_args()
+    if not args.input and not (args.subject and args.to):
+        parser.error("either --input or both --subject and --to are required")
 
     agent = EmailAgent(mock_mode=args.mock)
+    smtp_settings = None
+    if not args.mock:
+        smtp_settings = {"server": args.smtp_server, "port": args.smtp_port, "email": args.smtp_email,
+                         "password": os.getenv("SMTP_PASSWORD")}
+
+    if args.input:
+        from batch import BatchPipeline, read_rows
+        pipeline = BatchPipeline(
+            agent, args.checkpoint or args.input + ".checkpoint.jsonl", smtp_settings,
+            generate_workers=args.generate_workers, validate_workers=args.validate_workers,
+            send_workers=args.send_workers, requests_per_minute=args.requests_per_minute,
+            progress_interval=args.progress_interval, templates=args.template)
+        pipeline.run(read_rows(args.input))
+        return
     
     print(f"Generating email for subject: '{args.subject}'...")
     body = agent.generate_email(args.subject)
@@ -157,7 +970,7 @@ def main():
     if "Error" in body:
         print(body)
     else:
-        agent.send_email(args.to, args.subject, body)
+        agent.send_email(args.to, args.subject, body, smtp_settings)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,218 @@
+"""Offline stand-ins for Gemini and an SMTP relay, used by tests and benchmarks."""
+import asyncio
+import threading
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Mimics the parts of genai.GenerativeModel that EmailAgent uses.
+
+    `text` is either a fixed response string or a callable taking the prompt.
+    `latency` is the simulated model round trip in seconds. Streamed responses
+    are split into `chunk_size`-character chunks.
+    """
+
+    def __init__(self, text="Dear [Name],\n\nThis is a generated email.", latency=0.0, model_name="models/fake-model",
+                 chunk_size=16):
+        self.text = text
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.model_name = model_name
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt):
+        with self._lock:
+            self.calls += 1
+        text = self.text(prompt) if callable(self.text) else self.text
+        return FakeResponse(text)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        response = self._respond(prompt)
+        if stream:
+            text = response.text
+            return [FakeResponse(text[i:i + self.chunk_size]) for i in range(0, len(text), self.chunk_size)]
+        return response
+
+    async def generate_content_async(self, prompt, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(prompt)
+
+
+class SMTPSink:
+    """A minimal in-process SMTP server that records messages instead of relaying them.
+
+    Runs its own event loop on a background thread, so both smtplib and async
+    clients can talk to it. Addresses in `reject` get a 550 at RCPT time,
+    addresses in `drop_once` make the server hang up on the first RCPT for
+    them, addresses in `defer_once` get a 451 for their first message,
+    addresses in `greylist_once` get a 450 at their first RCPT, and
+    `latency` delays each DATA reply to simulate a slow relay.
+    With `keep_data=False` only message sizes are recorded (for benchmarks).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, reject=(), drop_once=(), latency=0.0, keep_data=True,
+                 defer_once=(), greylist_once=()):
+        self.host = host
+        self.port = port
+        self.reject = set(reject)
+        self.drop_once = set(drop_once)
+        self.defer_once = set(defer_once)
+        self.greylist_once = set(greylist_once)
+        self.latency = latency
+        self.keep_data = keep_data
+        self.messages = []
+        self.sessions = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def settings(self, email="sender@example.com", password="secret"):
+        """SMTP settings dict pointing EmailAgent at this sink (no STARTTLS)."""
+        return {"server": self.host, "port": self.port, "email": email, "password": password, "use_tls": False}
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, limit=2 ** 24))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._server.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _handle(self, reader, writer):
+        with self._lock:
+            self.sessions += 1
+
+        def reply(line):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 localhost ESMTP sink")
+        mail_from, rcpts = None, []
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                verb = line.split(" ", 1)[0].upper()
+
+                if verb == "EHLO":
+                    reply("250-localhost")
+                    reply("250-8BITMIME")
+                    reply("250 AUTH PLAIN LOGIN")
+                elif verb == "HELO":
+                    reply("250 localhost")
+                elif verb == "AUTH":
+                    parts = line.split()
+                    if parts[1].upper() == "LOGIN":
+                        reply("334 VXNlcm5hbWU6")
+                        await reader.readline()
+                        reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    elif len(parts) < 3:
+                        reply("334 ")
+                        await reader.readline()
+                    reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    mail_from, rcpts = _address(line), []
+                    reply("250 OK")
+                elif verb == "RCPT":
+                    address = _address(line)
+                    if address in self.drop_once:
+                        self.drop_once.discard(address)
+                        break
+                    if address in self.greylist_once:
+                        self.greylist_once.discard(address)
+                        reply("450 Greylisted, try again later")
+                    elif address in self.reject:
+                        reply("550 No such user")
+                    else:
+                        rcpts.append(address)
+                        reply("250 OK")
+                elif verb == "DATA":
+                    if not rcpts:
+                        reply("503 No valid recipients")
+                        continue
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    chunks = []
+                    size = 0
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b""):
+                            break
+                        if data_line.startswith(b".."):
+                            data_line = data_line[1:]
+                        size += len(data_line)
+                        if self.keep_data:
+                            chunks.append(data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    deferred = self.defer_once.intersection(rcpts)
+                    if deferred:
+                        self.defer_once -= deferred
+                        mail_from, rcpts = None, []
+                        reply("451 Try again later")
+                        await writer.drain()
+                        continue
+                    data = b"".join(chunks) if self.keep_data else None
+                    with self._lock:
+                        self.messages.append({"from": mail_from, "to": list(rcpts), "data": data, "size": size})
+                    mail_from, rcpts = None, []
+                    reply("250 OK queued")
+                elif verb == "RSET":
+                    mail_from, rcpts = None, []
+                    reply("250 OK")
+                elif verb == "NOOP":
+                    reply("250 OK")
+                elif verb == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 Command not implemented")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _address(line):
+    start, end = line.find("<"), line.find(">")
+    if start == -1 or end == -1:
+        return line.split(":", 1)[-1].strip()
+    return line[start + 1:end]
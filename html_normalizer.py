@@ -0,0 +1,261 @@
+import html
+import re
+from html.parser import HTMLParser
+
+# Tags that survive into the email. Anything else is unwrapped (its text is kept).
+_ALLOWED_TAGS = {
+    "a", "b", "strong", "i", "em", "u", "s", "strike", "span", "ul", "ol", "li",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "code", "sub", "sup", "img",
+}
+# Tags dropped together with their content.
+_DROPPED_TAGS = {"script", "style", "iframe", "object", "embed", "head", "title", "noscript"}
+_BLOCK_TAGS = {"li", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "ul", "ol", "div"}
+_VOID_TAGS = {"img"}
+_SAFE_SCHEMES = ("http://", "https://", "mailto:", "tel:")
+_SAFE_IMAGE_SCHEMES = ("http://", "https://", "cid:", "data:image/")
+# Quill formats with classes, which mail clients don't have CSS for; these are its stylesheet's values.
+_QUILL_ALIGN = {"ql-align-center": "center", "ql-align-right": "right", "ql-align-justify": "justify"}
+_QUILL_SIZE = {"ql-size-small": "0.75em", "ql-size-large": "1.5em", "ql-size-huge": "2.5em"}
+_QUILL_FONT = {"ql-font-serif": "Georgia, Times New Roman, serif", "ql-font-monospace": "Monaco, Courier New, monospace"}
+_QUILL_INDENT = re.compile(r"ql-indent-(\d+)$")
+# Paragraph styles worth keeping the paragraph (as a <div>) for
+_BLOCK_STYLES = ("text-align", "padding-left")
+_MAX_BREAKS = 2
+
+EMAIL_WRAPPER = """
+                <div style="font-family: 'Calibri', 'Arial', sans-serif; font-size: 11pt; color: #000000;">
+                    {}
+                </div>
+                """
+
+
+class HtmlNormalizer(HTMLParser):
+    """Turns editor (Quill) HTML into email-safe HTML plus a matching plaintext rendering.
+
+    Works incrementally: call feed() with chunks and close() for the result.
+    Paragraphs become <br> breaks, runs of breaks collapse to at most one
+    blank line, leading/trailing breaks are trimmed, scripts, styles and event
+    handlers are dropped, links and images keep only safe schemes, and
+    Quill's formatting classes become inline styles.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._html = []
+        self._text = []
+        self._pending_breaks = 0    # <br>s owed to both outputs
+        self._pending_newline = False  # block boundary: a line break in plaintext only
+        self._started = False       # any visible content emitted yet
+        self._line_start = True     # plaintext output currently ends a line
+        self._skip_depth = 0        # inside a dropped tag
+        self._para_content = False  # current <p> produced content
+        self._para_breaks = 0       # <br>s seen in the current <p>
+        self._para_div = False      # current <p> was kept as an aligned <div>
+        self._open = []             # allowed tags currently open
+        self._links = []            # hrefs of open <a> tags
+        self._list_depth = 0
+
+    # -- output helpers -------------------------------------------------
+
+    def _break(self, count=1):
+        if self._started:
+            self._pending_breaks = min(self._pending_breaks + count, _MAX_BREAKS)
+
+    def _block_break(self):
+        if self._started and not self._line_start:
+            self._pending_newline = True
+
+    def _flush_breaks(self):
+        if self._pending_breaks:
+            self._html.append("<br>" * self._pending_breaks)
+            self._text.append("\n" * self._pending_breaks)
+            self._line_start = True
+        elif self._pending_newline:
+            self._text.append("\n")
+            self._line_start = True
+        self._pending_breaks = 0
+        self._pending_newline = False
+
+    def _emit(self, markup, text=""):
+        self._flush_breaks()
+        self._html.append(markup)
+        if text:
+            self._text.append(text)
+        self._started = True
+        self._line_start = False
+        self._para_content = True
+
+    # -- parser callbacks -----------------------------------------------
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROPPED_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "p":
+            self._para_content = False
+            self._para_breaks = 0
+            self._para_div = False
+            style = dict(self._clean_attrs(tag, attrs)).get("style")
+            if style and any(prop in style for prop in _BLOCK_STYLES):
+                self._block_break()
+                self._flush_breaks()
+                self._html.append(f'<div style="{html.escape(style)}">')
+                self._para_div = True
+            return
+        if tag == "br":
+            self._para_breaks += 1
+            self._break()
+            return
+        if tag == "div":
+            self._block_break()
+            return
+        if tag not in _ALLOWED_TAGS:
+            return
+
+        if tag in _BLOCK_TAGS:
+            self._block_break()
+        attributes = self._clean_attrs(tag, attrs)
+        text = ""
+        if tag == "li":
+            text = "  " * max(self._list_depth - 1, 0) + "- "
+        if tag in ("ul", "ol"):
+            self._list_depth += 1
+        if tag == "a":
+            self._links.append(dict(attributes).get("href"))
+        if tag == "img":
+            if "src" not in dict(attributes):
+                return
+            alt = dict(attributes).get("alt")
+            text = f"[{alt}]" if alt else ""
+        markup = "<" + tag + "".join(f' {k}="{html.escape(v)}"' for k, v in attributes) + ">"
+        if tag in _BLOCK_TAGS:
+            # Block openers are structural; don't count them as visible content.
+            self._flush_breaks()
+            self._html.append(markup)
+            if text:
+                self._text.append(text)
+        else:
+            self._emit(markup, text)
+        if tag not in _VOID_TAGS:
+            self._open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "p") and tag not in _VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _DROPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+            return
+        if self._skip_depth:
+            return
+        if tag == "p":
+            # <p>text</p> ends a line; <p><br></p> already produced its break; <p></p> produces nothing
+            if self._para_div:
+                self._pending_breaks = 0
+                self._html.append("</div>")
+                self._block_break()
+            elif self._para_content and not self._para_breaks:
+                self._break()
+            self._para_content = False
+            self._para_div = False
+            return
+        if tag == "div":
+            self._block_break()
+            return
+        if tag not in self._open:
+            return
+        # Close anything left open inside this tag so the output stays well-formed.
+        while self._open:
+            open_tag = self._open.pop()
+            self._html.append(f"</{open_tag}>")
+            if open_tag == "a":
+                href = self._links.pop()
+                if href and not href.startswith("mailto:"):
+                    self._text.append(f" ({href})")
+            if open_tag in ("ul", "ol"):
+                self._list_depth -= 1
+            if open_tag == tag:
+                break
+        if tag in _BLOCK_TAGS:
+            self._block_break()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if not data.strip():
+            # Whitespace between breaks is layout, not content
+            if self._started and not (self._pending_breaks or self._pending_newline):
+                self._html.append(" ")
+                self._text.append(" ")
+            return
+        if not self._started:
+            data = data.lstrip()
+        self._emit(html.escape(data, quote=False), data)
+
+    # -- attributes -------------------------------------------------------
+
+    @staticmethod
+    def _clean_attrs(tag, attrs):
+        cleaned = []
+        styles = []
+        for name, value in attrs:
+            value = value or ""
+            if name == "href" and tag == "a":
+                if value.strip().lower().startswith(_SAFE_SCHEMES):
+                    cleaned.append(("href", value.strip()))
+            elif tag == "img" and name in ("src", "alt", "width", "height"):
+                if name == "src" and value.strip().lower().startswith(_SAFE_IMAGE_SCHEMES):
+                    cleaned.append(("src", value.strip()))
+                elif name == "alt":
+                    cleaned.append(("alt", value))
+                elif name in ("width", "height") and value.strip().isdigit():
+                    cleaned.append((name, value.strip()))
+            elif name == "style":
+                if "expression" not in value.lower() and "url(" not in value.lower():
+                    styles.append(value.strip().rstrip(";"))
+            elif name == "class":
+                for cls in value.split():
+                    indent = _QUILL_INDENT.match(cls)
+                    if cls in _QUILL_ALIGN:
+                        styles.append(f"text-align: {_QUILL_ALIGN[cls]}")
+                    elif cls in _QUILL_SIZE:
+                        styles.append(f"font-size: {_QUILL_SIZE[cls]}")
+                    elif cls in _QUILL_FONT:
+                        styles.append(f"font-family: {_QUILL_FONT[cls]}")
+                    elif indent:
+                        styles.append(f"padding-left: {3 * int(indent.group(1))}em")
+        if styles:
+            cleaned.append(("style", "; ".join(styles)))
+        return cleaned
+
+    # -- result -----------------------------------------------------------
+
+    def close(self):
+        """Finishes parsing and returns (email_html, plaintext)."""
+        super().close()
+        while self._open:
+            self.handle_endtag(self._open[-1])
+        # Trailing breaks are dropped (never flushed)
+        self._pending_breaks = 0
+        self._pending_newline = False
+        return "".join(self._html).rstrip(), "".join(self._text).strip()
+
+
+def normalize(editor_html):
+    """One-pass conversion of editor HTML into (email_html, plaintext)."""
+    normalizer = HtmlNormalizer()
+    normalizer.feed(editor_html)
+    return normalizer.close()
+
+
+def to_plaintext(body_html):
+    return normalize(body_html)[1]
+
+
+def wrap_email_html(body_html):
+    """Applies the house email styling around normalized body HTML."""
+    return EMAIL_WRAPPER.format(body_html)
@@ -1,14 +1,26 @@
+import argparse
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=api_key)
-
-try:
-    for m in genai.list_models():
-        if 'generateContent' in m.supported_generation_methods:
-            print(m.name)
-except Exception as e:
-    print(f"Error listing models: {e}")
+from email_agent import load_env
+from model_registry import ModelRegistry, model_tier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List Gemini models that support generateContent")
+    parser.add_argument("--refresh", action="store_true", help="Bypass the on-disk model cache")
+    parser.add_argument("--tier", default=os.getenv("EMAIL_AGENT_MODEL_TIER", "standard"),
+                        help="Minimum quality tier the router may use (lite, standard, pro)")
+    args = parser.parse_args()
+
+    load_env()
+    registry = ModelRegistry(cache_path=os.getenv("EMAIL_AGENT_MODELS_CACHE", "models_cache.json"), min_tier=args.tier)
+    api_key = os.getenv("GEMINI_API_KEY")
+    names = registry.models(api_key, refresh=args.refresh)
+    eligible = set(registry.eligible(names))
+    for name in names:
+        marker = "*" if name in eligible else " "
+        print(f"{marker} {name:<45} {model_tier(name)}")
+    print(f"\n* = eligible for routing (tier >= {args.tier}); routing order: {', '.join(registry.route(api_key, explore=False))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import bisect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets by unit suffix of the metric name.
+_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MiB
+
+
+class Metrics:
+    """Fans timings and counters out to any number of sinks.
+
+    With no sinks attached every call is a cheap no-op, so instrumented code
+    pays nothing until a sink is added. Labels are plain keyword arguments.
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def observe(self, name, value, **labels):
+        for sink in self.sinks:
+            sink.observe(name, value, labels)
+
+    def incr(self, name, amount=1, **labels):
+        for sink in self.sinks:
+            sink.incr(name, amount, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the block's duration in seconds, with outcome="ok" or "error"."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - start, outcome="error", **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, outcome="ok", **labels)
+
+
+def _series(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class InMemorySink:
+    """Keeps the most recent `max_samples` observations per series, for percentiles in-process."""
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = _series(name, labels)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.max_samples)
+            samples.append(value)
+
+    def incr(self, name, amount, labels):
+        key = _series(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def values(self, name, **labels):
+        """All samples of `name` whose labels include `labels`."""
+        wanted = set(labels.items())
+        with self._lock:
+            return [v for (n, l), samples in self._samples.items()
+                    if n == name and wanted <= set(l) for v in samples]
+
+    def counter(self, name, **labels):
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(v for (n, l), v in self._counters.items() if n == name and wanted <= set(l))
+
+    def percentile(self, name, pct, **labels):
+        values = sorted(self.values(name, **labels))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._counters.clear()
+
+
+class JsonlSink:
+    """Appends every observation and counter increment to a JSONL file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, event):
+        line = json.dumps(event) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def observe(self, name, value, labels):
+        self._write({"ts": time.time(), "type": "observe", "name": name, "value": value, "labels": labels})
+
+    def incr(self, name, amount, labels):
+        self._write({"ts": time.time(), "type": "incr", "name": name, "value": amount, "labels": labels})
+
+
+class PrometheusSink:
+    """Aggregates into Prometheus histograms/counters and renders the text exposition format.
+
+    Histograms use latency buckets for names ending in `_seconds` and size
+    buckets otherwise; p95/p99 come from histogram_quantile() on the server.
+    """
+
+    def __init__(self, namespace="emailagent"):
+        self.namespace = namespace
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _buckets(name):
+        return _TIME_BUCKETS if name.endswith("_seconds") else _SIZE_BUCKETS
+
+    def observe(self, name, value, labels):
+        key = _series(name, labels)
+        buckets = self._buckets(name)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                hist[0][index] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def incr(self, name, amount, labels):
+        key = _series(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._histograms.items())
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            metric = f"{self.namespace}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets(name), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_labels(labels, le=_format(bound))} {cumulative}")
+            lines.append(f'{metric}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f"{metric}_sum{_labels(labels)} {_format(total)}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = f"{self.namespace}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        """Serves render() at /metrics from a daemon thread; returns the server."""
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+# Process-wide metrics used by EmailAgent and the SMTP pool unless they are given their own.
+default_metrics = Metrics()
@@ -0,0 +1,207 @@
+import base64
+import io
+import re
+import smtplib
+import time
+import uuid
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from attachment_cache import content_key
+from metrics import default_metrics
+
+# 57 raw bytes encode to exactly one 76-character base64 line, so blocks that
+# are a multiple of 57 bytes keep line breaks aligned across blocks.
+_BLOCK_SIZE = 57 * 1024
+_LEADING_DOT_RE = re.compile(rb'(?m)^\.')
+# Small chunks are coalesced up to this size before hitting the socket: separate tiny
+# writes (headers, closing boundary, terminator) stall on Nagle + delayed ACK.
+_SEND_BUFFER = 64 * 1024
+
+
+class StreamingMessage:
+    """A MIME message whose attachments are base64-encoded on the fly while it is written.
+
+    `skeleton` is the multipart/mixed message without its attachments (headers
+    and body parts only). Attachment bytes are read and encoded one block at a
+    time, so memory use stays flat no matter how large the files are.
+
+    With an attachment_cache.AttachmentCache as `cache`, each encoded part is
+    stored under its content hash and filename, and later messages carrying
+    the same file splice it in instead of encoding it again.
+    """
+
+    def __init__(self, skeleton, attachments=None, cache=None):
+        self.skeleton = skeleton
+        self.attachments = list(attachments or [])
+        self.cache = cache
+        self.bytes_written = 0
+        self.encode_seconds = 0.0
+
+    def iter_chunks(self):
+        """Yields the message as CRLF-terminated byte chunks. Can be called again to resend."""
+        boundary = "===============" + uuid.uuid4().hex + "=="
+        self.skeleton.set_boundary(boundary)
+        delimiter = b"--" + boundary.encode("ascii")
+        self.bytes_written = 0
+        self.encode_seconds = 0.0
+
+        # Everything up to the closing delimiter comes straight from the skeleton.
+        head = _to_bytes(self.skeleton)
+        head = head[:head.rindex(delimiter + b"--")]
+        yield self._count(head)
+
+        for file in self.attachments:
+            yield self._count(delimiter + b"\r\n")
+            # base64 grows data by 4/3; files the cache wouldn't store skip hashing and stream as before
+            if self.cache is None or _size(file) * 4 // 3 > self.cache.max_part_bytes:
+                yield from self._encode_part(file)
+                continue
+            key = content_key(file.name, _iter_blocks(file))
+            chunks = self.cache.get(key)
+            if chunks is not None:
+                for chunk in chunks:
+                    yield self._count(chunk)
+                continue
+            if not self.cache.admit(key):
+                yield from self._encode_part(file)  # first sighting: nothing kept
+                continue
+            # Seen before: keep references to the chunks as they stream (no extra copy) and store them
+            kept = []
+            for chunk in self._encode_part(file):
+                kept.append(chunk)
+                yield chunk
+            self.cache.put(key, kept)
+
+        yield self._count(delimiter + b"--\r\n")
+
+    def _encode_part(self, file):
+        yield self._count(_attachment_headers(file.name))
+        for block in _iter_blocks(file):
+            start = time.perf_counter()
+            encoded = base64.encodebytes(block).replace(b"\n", b"\r\n")
+            self.encode_seconds += time.perf_counter() - start
+            yield self._count(encoded)
+
+    def _count(self, chunk):
+        self.bytes_written += len(chunk)
+        return chunk
+
+    def as_bytes(self):
+        """Materializes the whole message (for tests and small messages only)."""
+        return b"".join(self.iter_chunks())
+
+
+def _to_bytes(msg):
+    buf = io.BytesIO()
+    BytesGenerator(buf, mangle_from_=False, policy=msg.policy.clone(linesep="\r\n")).flatten(msg)
+    return buf.getvalue()
+
+
+def _attachment_headers(filename):
+    # Same headers EmailAgent._build_message puts on an attachment part
+    part = MIMEBase('application', "octet-stream")
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+    part.set_payload("")
+    return _to_bytes(part)
+
+
+def _size(file):
+    if isinstance(getattr(file, "size", None), int):
+        return file.size
+    if hasattr(file, "seek") and hasattr(file, "tell"):
+        file.seek(0, io.SEEK_END)
+        return file.tell()
+    return len(file.getvalue())
+
+
+def _iter_blocks(file):
+    """Reads an attachment in fixed-size blocks without copying it whole."""
+    if hasattr(file, "read") and hasattr(file, "seek"):
+        file.seek(0)
+        while True:
+            block = file.read(_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+    else:
+        # attachment_store.StoredFile: slices of a memory map, so nothing is copied up front
+        data = file.view() if hasattr(file, "view") else memoryview(file.getvalue())
+        for start in range(0, len(data), _BLOCK_SIZE):
+            yield data[start:start + _BLOCK_SIZE]
+
+
+def send_streaming(server, from_addr, to_addrs, message, metrics=None):
+    """Runs one SMTP transaction on `server`, streaming `message` into DATA.
+
+    Mirrors smtplib.SMTP.sendmail: raises SMTPSenderRefused,
+    SMTPRecipientsRefused (all recipients refused) or SMTPDataError, and
+    returns a dict of the recipients that were refused. The MAIL/RCPT and
+    DATA phases are timed on `metrics` (default_metrics when omitted).
+    """
+    metrics = metrics or default_metrics
+    if isinstance(to_addrs, str):
+        to_addrs = [to_addrs]
+    server.ehlo_or_helo_if_needed()
+
+    with metrics.timer("smtp_phase_seconds", phase="envelope"):
+        refused = _envelope(server, from_addr, to_addrs)
+
+    with metrics.timer("smtp_phase_seconds", phase="data"):
+        _data(server, message)
+    metrics.observe("message_bytes", message.bytes_written)
+    metrics.observe("attachment_encode_seconds", message.encode_seconds)
+    return refused
+
+
+def _envelope(server, from_addr, to_addrs):
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        _rset(server, code)
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for rcpt in to_addrs:
+        code, resp = server.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    return refused
+
+
+def _data(server, message):
+    code, resp = server.docmd("data")
+    if code != 354:
+        _rset(server, code)
+        raise smtplib.SMTPDataError(code, resp)
+
+    first = True
+    pending, pending_size = [], 0
+    for chunk in message.iter_chunks():
+        if first:
+            # Only the skeleton can contain user text; encoded attachments never start a line with '.'.
+            # Stuffing happens per chunk, before coalescing, so write boundaries can't split a dot line.
+            chunk = _LEADING_DOT_RE.sub(b"..", chunk)
+            first = False
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= _SEND_BUFFER:
+            server.send(b"".join(pending))
+            pending, pending_size = [], 0
+    pending.append(b".\r\n")
+    server.send(b"".join(pending))
+
+    code, resp = server.getreply()
+    if code != 250:
+        _rset(server, code)
+        raise smtplib.SMTPDataError(code, resp)
+
+
+def _rset(server, code):
+    # smtplib closes the connection on 421; anything else can be reset and reused.
+    if code == 421:
+        server.close()
+    else:
+        server.rset()
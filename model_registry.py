@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from collections import deque
+
+# Process-wide model clients, one per (api_key, model_name), shared by every agent/session.
+# The lock also serializes every use of the SDK's global genai.configure.
+_shared_models = {}
+_shared_models_lock = threading.Lock()
+
+TIERS = {"lite": 0, "standard": 1, "pro": 2}
+# Assumed latency (s) for models without enough samples yet, so measured models are compared fairly.
+_PRIOR_LATENCY = {"lite": 1.0, "standard": 1.5, "pro": 4.0}
+# Non-chat variants that also list generateContent.
+_EXCLUDED = ("embedding", "image", "tts", "audio", "live", "vision", "aqa", "gemma", "learnlm")
+DEFAULT_MODELS = ["gemini-2.0-flash"]
+_VERSION_RE = re.compile(r"gemini-(\d+(?:\.\d+)?)")
+_SMALL_RE = re.compile(r"-\d+b(?:-|$)")  # parameter-count variants such as flash-8b
+
+
+def get_shared_model(api_key, model_name, system_instruction=None):
+    """Returns the process-wide GenerativeModel for this key and system instruction, building it on first use.
+
+    The Gemini SDK is imported here rather than at module load, since it
+    dominates cold-start time. `genai.configure` is global, so each model is
+    bound to its own key's client while the lock is held; later configure
+    calls for other keys don't affect it. The async client needs an event
+    loop, so it is bound on first async use (see bind_async_client).
+    """
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not set")
+    cache_key = (api_key, model_name, system_instruction)
+    model = _shared_models.get(cache_key)
+    if model is not None:
+        return model
+    with _shared_models_lock:
+        model = _shared_models.get(cache_key)
+        if model is None:
+            import google.generativeai as genai
+            from google.generativeai import client
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+            model._client = client.get_default_generative_client()
+            _shared_models[cache_key] = model
+    return model
+
+
+def bind_async_client(model, api_key):
+    """Binds a shared model's async client to `api_key`; call from inside the event loop."""
+    if getattr(model, "_async_client", False) is not None:
+        return  # already bound, or not an SDK model (e.g. a test fake)
+    with _shared_models_lock:
+        if model._async_client is None:
+            import google.generativeai as genai
+            from google.generativeai import client
+            genai.configure(api_key=api_key)
+            model._async_client = client.get_default_generative_async_client()
+
+
+def list_generate_models(api_key):
+    """Names of the models this key can call generateContent on (one API round trip)."""
+    with _shared_models_lock:
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        models = list(genai.list_models())
+    return [m.name.split("/", 1)[-1] for m in models if 'generateContent' in m.supported_generation_methods]
+
+
+def model_tier(name):
+    if "lite" in name or _SMALL_RE.search(name):
+        return "lite"
+    if "pro" in name:
+        return "pro"
+    return "standard"
+
+
+def _version(name):
+    match = _VERSION_RE.match(name)
+    return float(match.group(1)) if match else 0.0
+
+
+class ModelProfile:
+    """Rolling latency/error window for one model.
+
+    A model is taken out of rotation for `cooldown` seconds after 3
+    consecutive failures, or when more than half of its recent calls failed.
+    """
+
+    def __init__(self, window=50, cooldown=60.0):
+        self.cooldown = cooldown
+        self._calls = deque(maxlen=window)  # (latency, ok)
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def record(self, latency, ok):
+        self._calls.append((latency, ok))
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= 3 or (len(self._calls) >= 4 and self.error_rate() > 0.5):
+            self.down_until = time.monotonic() + self.cooldown
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.down_until
+
+    def error_rate(self):
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def latency(self, min_samples=3):
+        """Median latency of recent successful calls, or None with too few samples."""
+        latencies = [latency for latency, ok in self._calls if ok]
+        return statistics.median(latencies) if len(latencies) >= min_samples else None
+
+    @property
+    def calls(self):
+        return len(self._calls)
+
+
+class ModelRegistry:
+    """Discovers generateContent models and ranks them by measured latency and health.
+
+    The model list is cached on disk per API key (hashed) for `ttl` seconds.
+    `route()` returns eligible models, fastest healthy first; callers fall
+    back down the list when a model fails. Unmeasured models are ranked by
+    a per-tier prior, and ties go to the caller's preferred models, then
+    DEFAULT_MODELS, then newer versions. Every `explore_every`-th route puts
+    the least-sampled healthy model first, so models that were never picked
+    still get measured. Models below `min_tier` ("lite" < "standard" <
+    "pro") are never routed to, and preview or experimental models only
+    when `include_preview` is set.
+    """
+
+    def __init__(self, cache_path="models_cache.json", ttl=86400, min_tier="standard", include_preview=False,
+                 max_fallbacks=2, cooldown=60.0, lister=None, explore_every=20):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.min_tier = min_tier
+        self.include_preview = include_preview
+        self.max_fallbacks = max_fallbacks
+        self.cooldown = cooldown
+        self.lister = lister or list_generate_models
+        self.explore_every = explore_every
+        self._routes = 0
+        self._models = {}    # key hash -> (names, fetched_at)
+        self._profiles = {}  # name -> ModelProfile
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key_hash(api_key):
+        return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, key_hash, names, fetched_at):
+        if not self.cache_path:
+            return
+        data = self._read_cache()
+        data[key_hash] = {"models": names, "fetched_at": fetched_at}
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def models(self, api_key, refresh=False):
+        """All generateContent models for this key, from memory, disk, or the API."""
+        key_hash = self._key_hash(api_key)
+        now = time.time()
+        with self._lock:
+            cached = self._models.get(key_hash)
+            if cached is None and self.cache_path and not refresh:
+                entry = self._read_cache().get(key_hash)
+                if entry:
+                    cached = self._models[key_hash] = (entry["models"], entry["fetched_at"])
+            if cached and not refresh and now - cached[1] < self.ttl:
+                return cached[0]
+            try:
+                names = self.lister(api_key)
+            except Exception as e:
+                print(f"Model discovery failed: {e}")
+                names = cached[0] if cached else list(DEFAULT_MODELS)
+                # Keep serving the fallback for a while instead of listing on every call.
+                self._models[key_hash] = (names, now - self.ttl + min(self.ttl, 300))
+                return names
+            self._models[key_hash] = (names, now)
+            self._write_cache(key_hash, names, now)
+            return names
+
+    def eligible(self, names):
+        floor = TIERS.get(self.min_tier, 0)
+        eligible = [
+            name for name in names
+            if name.startswith("gemini") and not any(word in name for word in _EXCLUDED)
+            and (self.include_preview or not ("preview" in name or "exp" in name))
+            and TIERS[model_tier(name)] >= floor
+        ]
+        return eligible or list(DEFAULT_MODELS)
+
+    def profile(self, name):
+        with self._lock:
+            profile = self._profiles.get(name)
+            if profile is None:
+                profile = self._profiles[name] = ModelProfile(cooldown=self.cooldown)
+            return profile
+
+    def record(self, name, latency, ok):
+        profile = self.profile(name)
+        with self._lock:
+            profile.record(latency, ok)
+
+    def route(self, api_key, preferred=None, explore=True):
+        """Eligible models to try in order (at most 1 + max_fallbacks): fastest healthy first.
+
+        `preferred` (e.g. the agent's configured model) wins ties; `explore=False`
+        skips exploration, for lookups and calls that won't be profiled.
+        """
+        now = time.monotonic()
+        preference = list(preferred or []) + [name for name in DEFAULT_MODELS if name not in (preferred or [])]
+
+        def order(name):
+            return (preference.index(name) if name in preference else len(preference), -_version(name), name)
+
+        def rank(name):
+            profile = self._profiles.get(name)
+            measured = profile.latency() if profile else None
+            healthy = profile is None or profile.healthy(now)
+            return (not healthy, measured if measured is not None else _PRIOR_LATENCY[model_tier(name)]) + order(name)
+
+        names = self.eligible(self.models(api_key))
+        with self._lock:
+            ranked = sorted(names, key=rank)
+            if explore and self.explore_every:
+                self._routes += 1
+                if self._routes % self.explore_every == 0:
+                    healthy = [name for name in ranked
+                               if name not in self._profiles or self._profiles[name].healthy(now)]
+                    if healthy:
+                        least_sampled = min(healthy, key=lambda name: (
+                            self._profiles[name].calls if name in self._profiles else 0,) + order(name))
+                        ranked.remove(least_sampled)
+                        ranked.insert(0, least_sampled)
+        return ranked[:self.max_fallbacks + 1]
+
+    def stats(self):
+        """Per-model profile rows (for list_models.py and the app's debug panel)."""
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for name, profile in sorted(self._profiles.items()):
+                latency = profile.latency(min_samples=1)
+                rows.append({"model": name, "tier": model_tier(name), "calls": profile.calls,
+                             "p50_ms": round(latency * 1000, 1) if latency is not None else None,
+                             "error_rate": round(profile.error_rate(), 3), "healthy": profile.healthy(now)})
+            return rows
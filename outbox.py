@@ -0,0 +1,295 @@
+import json
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    smtp_server TEXT NOT NULL,
+    smtp_port INTEGER NOT NULL,
+    smtp_email TEXT NOT NULL,
+    use_tls INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    name TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt_at);
+"""
+# Columns added after the first release; created on open for older databases.
+_ADDED_COLUMNS = {
+    # lease_until: while a job is 'sending', when its claim lapses and another worker may take it over
+    "jobs": {"cc": "TEXT", "bcc": "TEXT", "refused": "TEXT", "lease_until": "REAL"},
+    # Set when the bytes live in an attachment_store.AttachmentStore; `data` is then empty
+    "attachments": {"digest": "TEXT"},
+}
+
+# Errors that retrying will not fix (FileNotFoundError: a stored attachment was cleaned up).
+_PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError, FileNotFoundError)
+
+
+def _joined(addresses):
+    if not addresses or isinstance(addresses, str):
+        return addresses or None
+    return ", ".join(addresses)
+
+
+class StoredAttachment:
+    """An attachment read back from the outbox; quacks like Streamlit's UploadedFile."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.size = len(data)
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+class OutboxHandle:
+    """Lightweight handle the UI can poll for a queued send."""
+
+    def __init__(self, outbox, job_id):
+        self.outbox = outbox
+        self.job_id = job_id
+
+    def status(self):
+        return self.outbox.status(self.job_id)
+
+    @property
+    def done(self):
+        return self.status()["status"] in ("sent", "failed")
+
+
+class Outbox:
+    """Durable local queue of outgoing emails, drained by background workers.
+
+    Jobs (final body, recipient, subject, attachments and SMTP settings minus
+    the password) are stored in SQLite in WAL mode, so they survive a closed
+    tab or a process restart. Passwords are only kept in memory: after a
+    restart, pending jobs for an account resume once its credentials are
+    registered again. Failed sends are retried with exponential backoff.
+
+    Several processes can share one database. A claimed job is leased for
+    `lease_seconds`, which must outlast the slowest send: a job left 'sending'
+    by a crashed process is taken over once its lease runs out, never while
+    another process may still be sending it.
+
+    With an attachment_store.AttachmentStore as `store`, jobs keep references
+    to spooled files instead of copies of their bytes, and the store keeps
+    those files until the job is settled.
+    """
+
+    def __init__(self, db_path="outbox.db", agent=None, max_attempts=5, base_delay=5.0, poll_interval=1.0,
+                 store=None, lease_seconds=300):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.agent = agent
+        self.store = store
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.poll_interval = poll_interval
+        self._credentials = {}  # (server, port, email) -> password
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._workers = []
+
+        db = self._db()
+        db.executescript(_SCHEMA)
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        db.commit()
+        if store is not None:
+            store.add_referrer(self.attachment_digests)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _account(server, port, email):
+        return (server, int(port), email)
+
+    def register_credentials(self, smtp_settings):
+        """Makes the account's password available to workers (memory only)."""
+        key = self._account(smtp_settings['server'], smtp_settings['port'], smtp_settings['email'])
+        self._credentials[key] = smtp_settings.get('password')
+        self._wakeup.set()
+
+    def enqueue(self, to_email, subject, body, smtp_settings, attachments=None, cc=None, bcc=None):
+        """Stores the message durably and returns an OutboxHandle.
+
+        Address arguments are strings or lists; they're stored comma-separated.
+        """
+        self.register_credentials(smtp_settings)
+        if self.store is not None:
+            attachments = [file if hasattr(file, "digest") else self.store.put(None, file)
+                           for file in attachments or []]
+        now = time.time()
+        db = self._db()
+        with db:
+            cur = db.execute(
+                "INSERT INTO jobs (status, to_email, cc, bcc, subject, body, smtp_server, smtp_port, smtp_email,"
+                " use_tls, next_attempt_at, created_at, updated_at)"
+                " VALUES ('pending', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (_joined(to_email), _joined(cc), _joined(bcc), subject, body, smtp_settings['server'],
+                 int(smtp_settings['port']), smtp_settings['email'], int(smtp_settings.get('use_tls', True)),
+                 now, now, now))
+            job_id = cur.lastrowid
+            for file in attachments or []:
+                if self.store is not None:
+                    db.execute("INSERT INTO attachments (job_id, name, data, digest) VALUES (?, ?, ?, ?)",
+                               (job_id, file.name, b"", file.digest))
+                else:
+                    db.execute("INSERT INTO attachments (job_id, name, data) VALUES (?, ?, ?)",
+                               (job_id, file.name, file.getvalue()))
+        self._wakeup.set()
+        return OutboxHandle(self, job_id)
+
+    def status(self, job_id):
+        row = self._db().execute(
+            "SELECT status, attempts, last_error, to_email, refused FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return {"status": "unknown", "attempts": 0, "error": None, "to_email": None, "refused": {}}
+        return {"status": row[0], "attempts": row[1], "error": row[2], "to_email": row[3],
+                "refused": json.loads(row[4]) if row[4] else {}}
+
+    def attachment_digests(self):
+        """Digests of stored attachments that unsettled jobs still need."""
+        return {row[0] for row in self._db().execute(
+            "SELECT DISTINCT digest FROM attachments WHERE digest IS NOT NULL")}
+
+    def _attachments(self, job_id):
+        attachments = []
+        for name, data, digest in self._db().execute(
+                "SELECT name, data, digest FROM attachments WHERE job_id = ?", (job_id,)).fetchall():
+            attachments.append(self.store.open(digest, name) if digest else StoredAttachment(name, data))
+        return attachments
+
+    def _claim(self):
+        """Atomically marks the next due job (with known credentials) as 'sending' and leases it.
+
+        A send interrupted by a crash is retried once its lease expires (delivery is at-least-once);
+        rows from before leases existed count as expired.
+        """
+        accounts = list(self._credentials)
+        if not accounts:
+            return None
+        db = self._db()
+        # Filtered in SQL, so a backlog for an account still waiting for its password can't
+        # fill the window and starve the accounts that can send.
+        placeholders = ", ".join("(?, ?, ?)" for _ in accounts)
+        with self._claim_lock:
+            now = time.time()
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE ((status = 'pending' AND next_attempt_at <= ?)"
+                " OR (status = 'sending' AND COALESCE(lease_until, 0) <= ?))"
+                f" AND (smtp_server, smtp_port, smtp_email) IN (VALUES {placeholders})"
+                " ORDER BY next_attempt_at LIMIT 50",
+                (now, now, *(value for account in accounts for value in account))).fetchall()
+            for (job_id,) in rows:
+                now = time.time()
+                with db:
+                    claimed = db.execute(
+                        "UPDATE jobs SET status = 'sending', lease_until = ?, updated_at = ? WHERE id = ?"
+                        " AND (status = 'pending' OR (status = 'sending' AND COALESCE(lease_until, 0) <= ?))",
+                        (now + self.lease_seconds, now, job_id, now)).rowcount
+                if claimed:
+                    return job_id
+        return None
+
+    def process_next(self):
+        """Sends one due job, if any. Returns True when a job was attempted."""
+        job_id = self._claim()
+        if job_id is None:
+            return False
+
+        db = self._db()
+        (to_email, cc, bcc, subject, body, server, port, email, use_tls, attempts) = db.execute(
+            "SELECT to_email, cc, bcc, subject, body, smtp_server, smtp_port, smtp_email, use_tls, attempts"
+            " FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        smtp_settings = {"server": server, "port": port, "email": email, "use_tls": bool(use_tls),
+                         "password": self._credentials.get(self._account(server, port, email))}
+
+        attempts += 1
+        try:
+            attachments = self._attachments(job_id)
+            refused = self.agent.deliver(to_email, subject, body, smtp_settings, attachments, cc=cc, bcc=bcc)
+        except Exception as e:
+            if isinstance(e, _PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                self._finish(job_id, "failed", attempts, str(e))
+            else:
+                delay = self.base_delay * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+                with db:
+                    db.execute(
+                        "UPDATE jobs SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?,"
+                        " updated_at = ? WHERE id = ?",
+                        (attempts, str(e), time.time() + delay, time.time(), job_id))
+            print(f"Outbox: attempt {attempts} for job {job_id} failed: {e}")
+            return True
+
+        self._finish(job_id, "sent", attempts, None, refused)
+        print(f"Outbox: email sent successfully to {to_email}")
+        return True
+
+    def _finish(self, job_id, status, attempts, error, refused=None):
+        db = self._db()
+        # Addresses the relay refused while accepting the others: {address: [code, reason]}
+        refused = json.dumps(refused) if refused else None
+        with db:
+            db.execute("UPDATE jobs SET status = ?, attempts = ?, last_error = ?, refused = ?, updated_at = ?"
+                       " WHERE id = ?", (status, attempts, error, refused, time.time(), job_id))
+            # The payload is no longer needed once the job is settled.
+            db.execute("DELETE FROM attachments WHERE job_id = ?", (job_id,))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                worked = self.process_next()
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                worked = False
+            if not worked:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self, workers=2):
+        """Starts background worker threads (idempotent)."""
+        if self._workers:
+            return self
+        self._stopping.clear()
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._workers.append(thread)
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._workers:
+            thread.join()
+        self._workers = []
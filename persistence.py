@@ -0,0 +1,115 @@
+import secrets
+import threading
+import time
+
+
+class SecretStore:
+    """Server-side home for secrets that would otherwise ride in the URL, keyed by opaque tokens.
+
+    Values live in this process's memory only: a token unlocks nothing
+    anywhere else, and expires after `ttl` seconds without use. Within this
+    process, though, the token is a bearer credential: whoever has it (e.g.
+    from a shared link) gets the values.
+    """
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        self._entries = {}  # token -> (values, expires_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_token():
+        return secrets.token_urlsafe(16)
+
+    def load(self, token):
+        """The token's values (an empty dict if unknown or expired); extends its lifetime."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(token, None)
+                return {}
+            self._entries[token] = (entry[0], now + self.ttl)
+            return dict(entry[0])
+
+    def save(self, token, values):
+        now = time.time()
+        with self._lock:
+            for stale in [t for t, (_, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[stale]
+            self._entries[token] = (dict(values), now + self.ttl)
+
+
+class QueryParamSync:
+    """Persists selected session_state keys across reloads, writing to the URL only what changed.
+
+    Every URL write is a round trip to the browser, so flush() diffs the
+    session against what was last synced and sends the changed keys in one
+    query_params.update() (or a single from_dict() when keys must be
+    removed), once per rerun. `secret_keys` never reach the URL: with a
+    SecretStore they are kept server-side under an opaque token (the
+    `token_param` query param), without one they aren't persisted at all.
+    """
+
+    def __init__(self, keys, secret_keys=(), secret_store=None, token_param="sid"):
+        self.keys = list(keys)
+        self.secret_keys = list(secret_keys)
+        self.secret_store = secret_store
+        self.token_param = token_param
+        self.token = None
+        self.writes = 0       # URL updates sent so far
+        self._synced = None   # key -> value as last written to (or read from) the URL / secret store
+        self._restored = {}   # key -> value to seed session_state with
+
+    def restore(self, session_state, query_params, types=None):
+        """Seeds keys missing from `session_state` with their persisted values (`types` converts them)."""
+        if self._synced is None:
+            self._synced = {k: query_params[k] for k in self.keys if k in query_params}
+            self.token = query_params.get(self.token_param)
+            if self.secret_store is not None and self.token:
+                self._synced.update(self.secret_store.load(self.token))
+            self._restored = dict(self._synced)
+            # Links from before secrets left the URL still work; flush() moves them server-side
+            for key in self.secret_keys:
+                if key in query_params and key not in self._restored:
+                    self._restored[key] = query_params[key]
+        types = types or {}
+        for key, value in self._restored.items():
+            if key not in session_state:
+                try:
+                    session_state[key] = types[key](value) if key in types else value
+                except (TypeError, ValueError):
+                    pass
+
+    def flush(self, session_state, query_params):
+        """Writes the keys that changed since the last sync. Returns True if the URL was updated."""
+        if self._synced is None:
+            self.restore({}, query_params)
+        values = {}
+        for key in self.keys + self.secret_keys:
+            value = session_state.get(key)
+            values[key] = "" if value is None else str(value)
+        changed = {k: v for k, v in values.items() if v != self._synced.get(k, "")}
+        stale = [k for k in self.secret_keys if k in query_params]
+        if not changed and not stale:
+            return False
+
+        public = {k: v for k, v in changed.items() if k not in self.secret_keys}
+        if self.secret_store is not None and any(k in self.secret_keys for k in changed):
+            if not self.token:
+                self.token = public[self.token_param] = self.secret_store.new_token()
+            self.secret_store.save(self.token, {k: values[k] for k in self.secret_keys if values[k]})
+        self._synced.update(changed)
+
+        updates = {k: v for k, v in public.items() if v}
+        removed = [k for k, v in public.items() if not v and k in query_params] + stale
+        if removed:
+            params = {k: query_params[k] for k in query_params if k not in removed}
+            params.update(updates)
+            query_params.from_dict(params)
+        elif updates:
+            query_params.update(updates)
+        else:
+            return False
+        self.writes += 1
+        return True
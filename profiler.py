@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class RunTimer:
+    """Times the named sections of one script run.
+
+    `lap(name)` charges the time since the previous checkpoint to `name`, which
+    suits a flat script: drop a lap after each region. `section(name)` times a
+    nested block on its own. Repeated names within a run are summed.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._checkpoint = self._start
+        self._last_end = self._start
+        self.sections = {}
+        self.finished = False
+
+    def _add(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0.0) + seconds * 1000
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self._add(name, now - self._checkpoint)
+        self._checkpoint = self._last_end = now
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._add(name, end - start)
+            self._last_end = max(self._last_end, end)
+
+    def finish(self, interrupted=False):
+        """Records the run once. `total_ms` ends at the last timed point, not at the call."""
+        if self.finished:
+            return None
+        self.finished = True
+        record = {
+            "ts": self.started_at,
+            "total_ms": (self._last_end - self._start) * 1000,
+            "sections": self.sections,
+            "interrupted": interrupted,
+        }
+        self.profiler.record(record)
+        return record
+
+
+class RerunProfiler:
+    """Ring buffer of per-rerun section timings with percentile summaries.
+
+    A run cut short by st.rerun() or st.stop() never reaches its finish() call;
+    start_run() closes it (marked interrupted) when the session reruns.
+    Set `log_path` to also append every record to a JSONL file.
+    """
+
+    def __init__(self, capacity=500, log_path=None):
+        self.log_path = log_path
+        self._runs = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def start_run(self, previous=None):
+        if previous is not None and not previous.finished:
+            previous.finish(interrupted=True)
+        return RunTimer(self)
+
+    def record(self, record):
+        with self._lock:
+            self._runs.append(record)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def runs(self):
+        with self._lock:
+            return list(self._runs)
+
+    def summary(self):
+        """Per-section count, mean, p50 and p95 in ms, slowest p95 first ("total" included)."""
+        samples = {}
+        for run in self.runs():
+            for name, ms in run["sections"].items():
+                samples.setdefault(name, []).append(ms)
+            samples.setdefault("total", []).append(run["total_ms"])
+        rows = []
+        for name, values in samples.items():
+            values.sort()
+            rows.append({
+                "section": name,
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(_percentile(values, 50), 2),
+                "p95_ms": round(_percentile(values, 95), 2),
+            })
+        rows.sort(key=lambda row: row["p95_ms"], reverse=True)
+        return rows
+
+    def to_jsonl(self):
+        return "".join(json.dumps(run) + "\n" for run in self.runs())
+
+    def export_jsonl(self, path):
+        """Writes the buffered runs to `path`; returns how many were written."""
+        runs = self.runs()
+        with open(path, "w", encoding="utf-8") as f:
+            for run in runs:
+                f.write(json.dumps(run) + "\n")
+        return len(runs)
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_minute = float(rate_per_minute)
+        self.capacity = float(capacity or rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_minute / 60.0)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Blocks until `amount` tokens are available, then takes them. Returns seconds waited."""
+        # A single oversized request would otherwise wait forever.
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill_locked()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) * 60.0 / self.rate_per_minute
+            time.sleep(delay)
+            waited += delay
+
+    def set_rate(self, rate_per_minute):
+        with self._lock:
+            self._refill_locked()
+            self.rate_per_minute = float(rate_per_minute)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits with adaptive backoff.
+
+    A throttled (429) response halves both rates; each success then creeps them
+    back up by `recovery` of the configured limit.
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=None, min_fraction=0.1, recovery=0.05):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_fraction = min_fraction
+        self.recovery = recovery
+        self.throttled = 0
+        self._fraction = 1.0
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=0):
+        """Waits for one request slot and `tokens` of token budget. Returns seconds waited."""
+        waited = self._requests.acquire(1)
+        if self._tokens is not None and tokens:
+            waited += self._tokens.acquire(tokens)
+        return waited
+
+    def _apply_fraction_locked(self):
+        self._requests.set_rate(self.requests_per_minute * self._fraction)
+        if self._tokens is not None:
+            self._tokens.set_rate(self.tokens_per_minute * self._fraction)
+
+    def on_throttled(self):
+        with self._lock:
+            self.throttled += 1
+            self._fraction = max(self.min_fraction, self._fraction / 2)
+            self._apply_fraction_locked()
+
+    def on_success(self):
+        with self._lock:
+            if self._fraction < 1.0:
+                self._fraction = min(1.0, self._fraction + self.recovery)
+                self._apply_fraction_locked()
+
+
+def is_rate_limited(exc):
+    """True for quota errors (HTTP 429 / RESOURCE_EXHAUSTED) from the Gemini client."""
+    code = getattr(exc, "code", None)
+    if code == 429:
+        return True
+    text = str(exc)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "ResourceExhausted" in type(exc).__name__
@@ -0,0 +1,46 @@
+import re
+from collections import namedtuple
+from email.utils import getaddresses
+
+# Normalized, deduplicated address lists for one message; `invalid` holds entries that aren't addresses.
+Recipients = namedtuple("Recipients", "to cc bcc invalid")
+
+_ADDRESS_RE = re.compile(r"^[^@\s<>()\[\],;:\"]+@[^@\s<>()\[\],;:\"]+\.[^@\s<>()\[\],;:\".]+$")
+
+
+def _split(value):
+    """Address entries from a string ("a@x.com, Ann <b@y.com>; c@z.com") or an iterable of them."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    entries = [entry.replace(";", ",").replace("\n", ",") for entry in value]
+    return [address for _, address in getaddresses(entries) if address.strip()]
+
+
+def normalize_address(address):
+    """Trims the address and lowercases its domain; returns None if it isn't a plausible address."""
+    address = address.strip().replace("\xa0", "")
+    if not _ADDRESS_RE.match(address):
+        return None
+    local, domain = address.rsplit("@", 1)
+    return f"{local}@{domain.lower()}"
+
+
+def parse_recipients(to, cc=None, bcc=None):
+    """Normalizes To/CC/BCC and drops duplicates, including across lists (To wins over CC over BCC).
+
+    Addresses are compared case-insensitively; each is kept as first written.
+    """
+    seen = set()
+    lists = ([], [], [])
+    invalid = []
+    for target, value in zip(lists, (to, cc, bcc)):
+        for entry in _split(value):
+            address = normalize_address(entry)
+            if address is None:
+                invalid.append(entry.strip())
+            elif address.lower() not in seen:
+                seen.add(address.lower())
+                target.append(address)
+    return Recipients(*lists, invalid)
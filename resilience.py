@@ -0,0 +1,284 @@
+import asyncio
+import copy
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from metrics import default_metrics
+from rate_limit import is_rate_limited
+
+# HTTP-style status codes (as carried by google.api_core errors) worth retrying.
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+# Attempts run here so a call can be abandoned at its deadline (and hedged).
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="model-call")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call (including retries) did not finish within its deadline."""
+
+
+def is_retryable(exc):
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(exc, "code", None) in _RETRYABLE_CODES
+
+
+def _is_upstream_failure(exc):
+    # Throttling means "slow down", not "unhealthy"; generate_emails' limiter handles it.
+    return is_retryable(exc) and not is_rate_limited(exc)
+
+
+class CircuitBreaker:
+    """Fails fast after `failure_threshold` consecutive upstream failures.
+
+    After `reset_timeout` seconds one probe call is let through (half-open);
+    its outcome closes the circuit again or re-opens it. Errors the upstream
+    answered deliberately (bad request, auth) count as healthy responses.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="gemini", metrics=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.metrics = metrics or default_metrics
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state_locked(self, state):
+        if state != self.state:
+            self.state = state
+            self.metrics.incr("circuit_state_changes_total", upstream=self.name, state=state)
+
+    def allow(self):
+        """Raises CircuitOpenError unless a call may go upstream now; returns True for the half-open probe."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.metrics.incr("circuit_rejected_total", upstream=self.name)
+                    raise CircuitOpenError(f"{self.name} is unavailable; retrying in {remaining:.0f}s")
+                self._set_state_locked("half_open")
+            if self.state == "half_open":
+                if self._probing:
+                    self.metrics.incr("circuit_rejected_total", upstream=self.name)
+                    raise CircuitOpenError(f"{self.name} is recovering; try again shortly")
+                self._probing = True
+                return True
+        return False
+
+    def release_probe(self):
+        """Ends a probe whose outcome said nothing about health (throttled, cancelled); the next call probes again."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._set_state_locked("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state_locked("open")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def shared_breaker(name, metrics=None):
+    """Process-wide breaker per upstream name, so every session sees the same health."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name=name, metrics=metrics)
+        return breaker
+
+
+class ResilientCaller:
+    """Runs upstream calls with a deadline, jittered retries, hedging and a circuit breaker.
+
+    `fn(timeout)` performs one attempt and should pass `timeout` (seconds left
+    before the deadline, or None) on to the client. Retryable errors are retried
+    with exponential backoff while the deadline allows. With `hedge` on, a
+    duplicate attempt starts once the first has run longer than the recent p95
+    latency, and whichever finishes first wins.
+    """
+
+    def __init__(self, deadline=30.0, max_attempts=3, base_delay=0.5, max_delay=8.0, hedge=False,
+                 hedge_quantile=95, hedge_min_delay=0.2, hedge_min_samples=20, breaker=None, metrics=None):
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.metrics = metrics or default_metrics
+        self.breaker = breaker or CircuitBreaker(metrics=self.metrics)
+        self._latencies = deque(maxlen=200)
+
+    def with_breaker(self, breaker):
+        """A caller with these deadline/retry/hedging settings, but its own breaker and latency history."""
+        caller = copy.copy(self)
+        caller.breaker = breaker
+        caller._latencies = deque(maxlen=self._latencies.maxlen)
+        return caller
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, from recent latencies (None until there are enough)."""
+        if not self.hedge:
+            return None
+        samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        p = samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile / 100))]
+        return max(self.hedge_min_delay, p)
+
+    def _backoff(self, attempt):
+        return min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+    def _remaining(self, deadline_at):
+        return None if deadline_at is None else deadline_at - time.monotonic()
+
+    def _on_error(self, exc, attempt, attempts, deadline_at, kind):
+        """Books the failure; returns the backoff delay, or None when the error should propagate."""
+        if _is_upstream_failure(exc):
+            self.breaker.record_failure()
+        elif not is_retryable(exc):
+            self.breaker.record_success()
+        if not is_retryable(exc) or attempt >= attempts:
+            return None
+        delay = self._backoff(attempt)
+        remaining = self._remaining(deadline_at)
+        if remaining is not None and delay >= remaining:
+            return None
+        self.metrics.incr("model_retries_total", kind=kind, reason=type(exc).__name__)
+        return delay
+
+    def _on_success(self, start, kind, hedged_winner=None):
+        latency = time.monotonic() - start
+        self._latencies.append(latency)
+        self.metrics.observe("model_attempt_seconds", latency, kind=kind)
+        if hedged_winner:
+            self.metrics.incr("model_hedge_wins_total", kind=kind, winner=hedged_winner)
+        self.breaker.record_success()
+
+    def _deadline_exceeded(self, kind, timeout):
+        self.metrics.incr("model_deadline_exceeded_total", kind=kind)
+        return DeadlineExceeded(f"{kind} call exceeded its {timeout:.1f}s deadline")
+
+    def call(self, fn, kind="call", max_attempts=None):
+        attempts = max_attempts or self.max_attempts
+        deadline_at = None if self.deadline is None else time.monotonic() + self.deadline
+        for attempt in range(1, attempts + 1):
+            remaining = self._remaining(deadline_at)
+            if remaining is not None and remaining <= 0:
+                raise self._deadline_exceeded(kind, self.deadline)
+            probe = self.breaker.allow()
+            try:
+                return self._attempt(fn, remaining, kind)
+            except Exception as e:
+                delay = self._on_error(e, attempt, attempts, deadline_at, kind)
+                if delay is None:
+                    raise
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+            time.sleep(delay)
+
+    def _attempt(self, fn, timeout, kind):
+        start = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        if timeout is None and hedge_delay is None:
+            # Nothing to enforce from the outside; run inline.
+            result = fn(None)
+            self._on_success(start, kind)
+            return result
+
+        futures = [_executor.submit(fn, timeout)]
+        if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+            if not wait(futures, timeout=hedge_delay)[0]:
+                futures.append(_executor.submit(fn, None if timeout is None else timeout - hedge_delay))
+                self.metrics.incr("model_hedges_total", kind=kind)
+
+        pending, error = set(futures), None
+        while pending:
+            left = None if timeout is None else start + timeout - time.monotonic()
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    winner = None if len(futures) == 1 else ("primary" if future is futures[0] else "hedge")
+                    self._on_success(start, kind, winner)
+                    return future.result()
+                error = future.exception()
+        if not pending and error is not None:
+            raise error
+        raise self._deadline_exceeded(kind, timeout)
+
+    async def call_async(self, fn, kind="call", max_attempts=None):
+        """Asyncio counterpart of call(); `fn(timeout)` returns an awaitable."""
+        attempts = max_attempts or self.max_attempts
+        deadline_at = None if self.deadline is None else time.monotonic() + self.deadline
+        for attempt in range(1, attempts + 1):
+            remaining = self._remaining(deadline_at)
+            if remaining is not None and remaining <= 0:
+                raise self._deadline_exceeded(kind, self.deadline)
+            probe = self.breaker.allow()
+            try:
+                return await self._attempt_async(fn, remaining, kind)
+            except Exception as e:
+                delay = self._on_error(e, attempt, attempts, deadline_at, kind)
+                if delay is None:
+                    raise
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+            await asyncio.sleep(delay)
+
+    async def _attempt_async(self, fn, timeout, kind):
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(fn(timeout))]
+        hedge_delay = self.hedge_delay()
+        pending, error = set(tasks), None
+        try:
+            if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+                if not (await asyncio.wait(tasks, timeout=hedge_delay))[0]:
+                    tasks.append(asyncio.ensure_future(fn(None if timeout is None else timeout - hedge_delay)))
+                    self.metrics.incr("model_hedges_total", kind=kind)
+                    pending = set(tasks)
+            while pending:
+                left = None if timeout is None else start + timeout - time.monotonic()
+                done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        winner = None if len(tasks) == 1 else ("primary" if task is tasks[0] else "hedge")
+                        self._on_success(start, kind, winner)
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        if not pending and error is not None:
+            raise error
+        raise self._deadline_exceeded(kind, timeout)
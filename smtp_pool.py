@@ -0,0 +1,207 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from metrics import default_metrics
+
+
+class PooledConnection:
+    """An authenticated SMTP session owned by an SMTPConnectionPool."""
+
+    def __init__(self, key, server, password, metrics=None):
+        self.key = key
+        self.server = server
+        self.password = password
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.reused = False
+        self.metrics = metrics or default_metrics
+
+    def close(self):
+        try:
+            with self.metrics.timer("smtp_phase_seconds", phase="quit"):
+                self.server.quit()
+        except Exception:
+            # The server may already have dropped us; just release the socket.
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive between sends.
+
+    Sessions are keyed by (server, port, account). Idle sessions are checked
+    with NOOP before reuse, dropped after `idle_timeout` seconds, and a send
+    on a stale session is retried once on a fresh one.
+    """
+
+    def __init__(self, max_per_key=4, idle_timeout=120, health_check_after=10, timeout=30, metrics=None):
+        self.max_per_key = max_per_key
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.metrics = metrics or default_metrics
+        self._idle = {}      # key -> [PooledConnection, ...] (most recent last)
+        self._in_use = {}    # key -> number of checked-out sessions
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def key_for(smtp_settings):
+        return (smtp_settings['server'], int(smtp_settings['port']), smtp_settings['email'])
+
+    def _connect(self, key, smtp_settings):
+        with self.metrics.timer("smtp_phase_seconds", phase="connect"):
+            server = smtplib.SMTP(smtp_settings['server'], smtp_settings['port'], timeout=self.timeout)
+        try:
+            if smtp_settings.get('use_tls', True):
+                with self.metrics.timer("smtp_phase_seconds", phase="starttls"):
+                    server.starttls()
+            if smtp_settings.get('password'):
+                with self.metrics.timer("smtp_phase_seconds", phase="auth"):
+                    server.login(smtp_settings['email'], smtp_settings['password'])
+        except Exception:
+            server.close()
+            raise
+        return PooledConnection(key, server, smtp_settings.get('password'), self.metrics)
+
+    def _is_healthy(self, conn):
+        # Sessions used a moment ago are almost certainly still alive; skip the round trip.
+        if time.time() - conn.last_used < self.health_check_after:
+            return True
+        try:
+            return conn.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _evict_expired_locked(self):
+        now = time.time()
+        expired = []
+        for key, conns in list(self._idle.items()):
+            keep = [c for c in conns if now - c.last_used < self.idle_timeout]
+            expired.extend(c for c in conns if now - c.last_used >= self.idle_timeout)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return expired
+
+    def evict_idle(self):
+        """Closes every idle session that has outlived `idle_timeout`."""
+        with self._cond:
+            expired = self._evict_expired_locked()
+        for conn in expired:
+            conn.close()
+        return len(expired)
+
+    def acquire(self, smtp_settings):
+        """Checks out a healthy, authenticated session, connecting if needed."""
+        key = self.key_for(smtp_settings)
+        password = smtp_settings.get('password')
+        stale = []
+        conn = None
+        with self._cond:
+            stale.extend(self._evict_expired_locked())
+            while self._in_use.get(key, 0) >= self.max_per_key:
+                self._cond.wait()
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                if candidate.password == password:
+                    conn = candidate
+                    break
+                # Credentials changed since this session was opened.
+                stale.append(candidate)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+
+        for old in stale:
+            old.close()
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self._connect(key, smtp_settings)
+            else:
+                conn.reused = True
+            self.metrics.incr("smtp_sessions_total", reused=str(conn.reused).lower())
+            return conn
+        except Exception:
+            with self._cond:
+                self._in_use[key] -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """Returns a session to the pool, or closes it if `discard` is set."""
+        with self._cond:
+            self._in_use[conn.key] = max(self._in_use.get(conn.key, 1) - 1, 0)
+            if not discard:
+                conn.last_used = time.time()
+                self._idle.setdefault(conn.key, []).append(conn)
+            self._cond.notify()
+        if discard:
+            conn.close()
+
+    @contextmanager
+    def connection(self, smtp_settings):
+        """Context manager yielding a pooled session; it is discarded on error."""
+        conn = self.acquire(smtp_settings)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    def transact(self, smtp_settings, transaction):
+        """Runs `transaction(server)` on a pooled session, reconnecting once if it went stale."""
+        for attempt in range(2):
+            conn = self.acquire(smtp_settings)
+            try:
+                result = transaction(conn.server)
+            except smtplib.SMTPServerDisconnected:
+                self.release(conn, discard=True)
+                # Only a reused session is worth retrying; a fresh one failing is a real error.
+                if attempt or not conn.reused:
+                    raise
+                continue
+            except smtplib.SMTPRecipientsRefused:
+                # The session itself is fine; the server just rejected every recipient.
+                self.release(conn)
+                raise
+            except Exception:
+                self.release(conn, discard=True)
+                raise
+            self.release(conn)
+            return result
+
+    def sendmail(self, smtp_settings, from_addr, to_addrs, msg):
+        """Sends through a pooled session, reconnecting once if it went stale."""
+        return self.transact(smtp_settings, lambda server: server.sendmail(from_addr, to_addrs, msg))
+
+    def warm(self, smtp_settings):
+        """Opens (or verifies) a session and leaves it idle for the next send."""
+        with self.connection(smtp_settings):
+            pass
+        return True
+
+    def close_all(self):
+        with self._cond:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def idle_count(self, smtp_settings=None):
+        with self._cond:
+            if smtp_settings is None:
+                return sum(len(v) for v in self._idle.values())
+            return len(self._idle.get(self.key_for(smtp_settings), []))
+
+
+# Process-wide pool shared by EmailAgent and the app's "Connect mail" check,
+# so a successful connection test becomes the warm session the next send uses.
+default_pool = SMTPConnectionPool()
@@ -0,0 +1,91 @@
+import datetime
+import html
+import re
+from collections import namedtuple
+
+_PLACEHOLDER_RE = re.compile(r'\[([^\[\]\n]*)\]')
+
+# A [Placeholder] slot; `type` decides how values are checked and formatted.
+Variable = namedtuple("Variable", "name type")
+
+_TYPE_HINTS = (
+    ("date", ("date", "deadline", "day")),
+    ("amount", ("amount", "price", "total", "fee", "cost", "balance")),
+    ("url", ("link", "url", "website")),
+    ("email", ("email",)),
+)
+
+
+class TemplateError(ValueError):
+    """A value doesn't fit its variable's type."""
+
+
+def variable_type(name):
+    """Infers a variable's type from its placeholder name ([Due Date] -> "date"), else "text"."""
+    lowered = name.lower()
+    for type_, hints in _TYPE_HINTS:
+        if any(hint in lowered for hint in hints):
+            return type_
+    return "text"
+
+
+class EmailTemplate:
+    """An email body with typed [Variable] slots, compiled once and rendered locally per recipient.
+
+    Values are matched to variables case-insensitively. Dates (date objects or
+    ISO strings) are formatted with `date_format`, numbers for amount
+    variables get thousands separators, and url/email variables must look
+    like one. A variable without a value is left as its [Placeholder], for
+    validate_email to flag. With `html=True` values are HTML-escaped.
+    """
+
+    def __init__(self, text, html=False, date_format="%B %d, %Y"):
+        self.text = text
+        self.html = html
+        self.date_format = date_format
+        # Literal text at even indexes, variable keys (lowercased names) at odd ones
+        self._parts = _PLACEHOLDER_RE.split(text)
+        self.variables = {}
+        for index in range(1, len(self._parts), 2):
+            name = self._parts[index]
+            self.variables.setdefault(name.lower(), Variable(name, variable_type(name)))
+            self._parts[index] = name.lower()
+
+    def _format(self, variable, value):
+        if variable.type == "date":
+            if isinstance(value, str):
+                try:
+                    value = datetime.date.fromisoformat(value.strip())
+                except ValueError:
+                    return value  # free text like "next Tuesday" goes in as written
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                return value.strftime(self.date_format)
+        elif variable.type == "amount" and isinstance(value, (int, float)):
+            return f"{value:,.2f}"
+        elif variable.type == "url" and not str(value).startswith(("http://", "https://")):
+            raise TemplateError(f"[{variable.name}] needs an http(s) link, got {value!r}")
+        elif variable.type == "email" and "@" not in str(value):
+            raise TemplateError(f"[{variable.name}] needs an email address, got {value!r}")
+        return str(value)
+
+    def render(self, values):
+        """Fills the variables from `values`; raises TemplateError for a value of the wrong type."""
+        lookup = {str(k).lower(): v for k, v in values.items() if v not in (None, "")} if values else {}
+        parts = self._parts[:]
+        for index in range(1, len(parts), 2):
+            variable = self.variables[parts[index]]
+            value = lookup.get(parts[index])
+            if value is None:
+                parts[index] = f"[{variable.name}]"
+                continue
+            value = self._format(variable, value)
+            parts[index] = html.escape(value) if self.html else value
+        return "".join(parts)
+
+    def missing(self, values):
+        """Names of the variables `values` has nothing for."""
+        provided = {str(k).lower() for k, v in values.items() if v not in (None, "")} if values else set()
+        return [variable.name for key, variable in self.variables.items() if key not in provided]
+
+    def __str__(self):
+        return self.text
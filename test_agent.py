@@ -1,14 +1,20 @@
 import unittest
 from unittest.mock import MagicMock, patch
-from email_agent import EmailAgent
+import re
+import model_registry
+import json
+from email_agent import EmailAgent, fill_placeholders, bold_placeholders_stream, parse_composition
+from fakes import FakeModel, SMTPSink
+from smtp_pool import SMTPConnectionPool
 
 class TestEmailAgent(unittest.TestCase):
     def test_mock_initialization(self):
         agent = EmailAgent(api_key="dummy", mock_mode=True)
         self.assertTrue(agent.mock_mode)
 
-    @patch('email_agent.genai.GenerativeModel')
+    @patch('google.generativeai.GenerativeModel')
     def test_generate_email(self, mock_model_class):
+        self.addCleanup(model_registry._shared_models.clear)
         # Setup mock
         mock_model_instance = MagicMock()
         mock_model_class.return_value = mock_model_instance
@@ -21,6 +27,17 @@ class TestEmailAgent(unittest.TestCase):
         
         self.assertIn("This is a test email", email_content)
 
+    def test_model_client_is_shared_per_key(self):
+        self.addCleanup(model_registry._shared_models.clear)
+        with patch('google.generativeai.GenerativeModel', side_effect=lambda name, **kwargs: MagicMock()) as model_class:
+            first = EmailAgent(api_key="key-a", mock_mode=True)
+            second = EmailAgent(api_key="key-a", mock_mode=True)
+            other = EmailAgent(api_key="key-b", mock_mode=True)
+            self.assertEqual(model_class.call_count, 0)  # nothing built until first use
+            self.assertIs(first.model, second.model)
+            self.assertIsNot(first.model, other.model)
+        self.assertEqual(model_class.call_count, 2)
+
     def test_send_email_mock(self):
         agent = EmailAgent(api_key="dummy", mock_mode=True)
         # Capture stdout to verify print
@@ -30,5 +47,137 @@ class TestEmailAgent(unittest.TestCase):
             # Check if print was called (mock sending)
             self.assertTrue(mock_print.called)
 
+
+class TestStreaming(unittest.TestCase):
+    def test_stream_matches_blocking_generation(self):
+        text = "Subject: Meeting\n\nDear [Name],\nLet's meet on [Date] at [Time]."
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = FakeModel(text=text, chunk_size=3)
+
+        chunks = list(agent.generate_email_stream("Meeting"))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), agent.generate_email("Meeting"))
+
+    def test_placeholder_bolding_never_splits_a_placeholder(self):
+        text = "Hi [Name], on [Date\nthe [Insert Attachment] is [ready]"
+        expected = re.sub(r'(\[.*?\])', r'<b>\1</b>', text)
+        for size in range(1, 8):
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual("".join(bold_placeholders_stream(chunks)), expected)
+
+class TestSendMany(unittest.TestCase):
+    settings = {"server": "smtp.example.com", "port": 587, "email": "me@example.com", "password": "secret"}
+
+    def test_fill_placeholders(self):
+        self.assertEqual(fill_placeholders("Hi [Name], see you [date]. [Other]", {"name": "Ann", "Date": "Monday"}),
+                         "Hi Ann, see you Monday. [Other]")
+
+    def test_send_many_reports_per_recipient_results(self):
+        with SMTPSink(reject={"bad@example.com"}, drop_once={"flaky@example.com"}) as sink:
+            pool = SMTPConnectionPool()
+            agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+            recipients = [("ann@example.com", {"Name": "Ann"}), "bad@example.com",
+                          {"email": "flaky@example.com", "Name": "Flo"}]
+
+            with patch('builtins.print'):
+                summary = agent.send_many(recipients, "Hello [Name]", "Dear [Name]", sink.settings(), workers=2)
+            pool.close_all()
+
+        statuses = [(r["email"], r["status"], r["retried"]) for r in summary["results"]]
+        self.assertEqual(statuses, [("ann@example.com", "accepted", False),
+                                    ("bad@example.com", "rejected", False),
+                                    ("flaky@example.com", "accepted", True)])
+        self.assertEqual((summary["accepted"], summary["rejected"], summary["retried"]), (2, 1, 1))
+        sent = {m["to"][0]: m["data"] for m in sink.messages}
+        self.assertIn(b"Dear Ann", sent["ann@example.com"])
+        self.assertIn(b"Subject: Hello Flo", sent["flaky@example.com"])
+        # Sessions are reused across messages: two workers plus one reconnect after the drop
+        self.assertLessEqual(sink.sessions, 3)
+
+    def test_an_unexpected_error_fails_one_recipient_not_the_batch(self):
+        with SMTPSink() as sink:
+            pool = SMTPConnectionPool()
+            agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+            build = agent._build_streaming_message
+
+            def broken_for_bob(from_email, to_email, *args, **kwargs):
+                if to_email == "bob@example.com":
+                    raise UnicodeEncodeError("ascii", "é", 0, 1, "cannot encode")
+                return build(from_email, to_email, *args, **kwargs)
+
+            with patch.object(agent, "_build_streaming_message", side_effect=broken_for_bob), \
+                    patch('builtins.print'):
+                summary = agent.send_many(["ann@example.com", "bob@example.com", "cy@example.com"], "Hi", "Body",
+                                          sink.settings(), workers=1)
+            pool.close_all()
+
+        self.assertEqual([r["status"] for r in summary["results"]], ["accepted", "failed", "accepted"])
+        self.assertIn("UnicodeEncodeError", summary["results"][1]["error"])
+        self.assertEqual(summary["failed"], 1)
+
+    def test_temporary_refusals_are_retried_after_a_backoff(self):
+        with SMTPSink(defer_once={"ann@example.com"}) as sink:
+            pool = SMTPConnectionPool()
+            agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+            with patch('email_agent.time.sleep') as sleep, patch('builtins.print'):
+                summary = agent.send_many(["ann@example.com"], "Hi", "Body", sink.settings(), retry_delay=2.0)
+            pool.close_all()
+
+        self.assertEqual((summary["results"][0]["status"], summary["retried"]), ("accepted", 1))
+        sleep.assert_called_once()
+        self.assertTrue(1.0 <= sleep.call_args[0][0] <= 2.0)
+
+    def test_greylisted_recipients_are_retried(self):
+        with SMTPSink(greylist_once={"ann@example.com"}, reject={"bob@example.com"}) as sink:
+            pool = SMTPConnectionPool()
+            agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+            with patch('email_agent.time.sleep') as sleep, patch('builtins.print'):
+                summary = agent.send_many(["ann@example.com", "bob@example.com"], "Hi", "Body", sink.settings())
+            pool.close_all()
+
+        ann, bob = summary["results"]
+        self.assertEqual((ann["status"], ann["attempts"]), ("accepted", 2))
+        self.assertEqual((bob["status"], bob["attempts"]), ("rejected", 1))
+        self.assertIn("550", bob["error"])
+        sleep.assert_called_once()
+        self.assertEqual([m["to"] for m in sink.messages], [["ann@example.com"]])
+
+class TestCompose(unittest.TestCase):
+    REPLY = json.dumps({"body": "Dear [Name],\n\nThe \"Q3\" invoice is due on [Date].", "placeholders": ["Name"],
+                        "subject": "Subject: Q3 invoice", "tone": "professional"})
+
+    def test_one_call_returns_body_subject_tone_and_placeholders(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = FakeModel(text=self.REPLY)
+        composition = agent.compose("Invoice")
+        self.assertEqual(composition["subject"], "Q3 invoice")
+        self.assertEqual(composition["tone"], "Professional")
+        self.assertEqual(composition["placeholders"], ["Name", "Date"])  # taken from the body, not the reply
+        self.assertEqual(agent.model.calls, 1)
+
+    def test_unparseable_reply_falls_back_to_two_calls(self):
+        replies = iter(["Sure! Here is your email.", "Hi [Name], see you Friday.", "Friday plans"])
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = FakeModel(text=lambda prompt: next(replies))
+        composition = agent.compose("Catch up")
+        self.assertEqual(composition, {"body": "Hi [Name], see you Friday.", "subject": "Friday plans",
+                                       "tone": None, "placeholders": ["Name"]})
+
+    def test_stream_yields_body_then_sets_last_composition(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = FakeModel(text=self.REPLY, chunk_size=3)  # splits escapes across chunks
+        pieces = list(agent.compose_stream("Invoice"))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual("".join(pieces), 'Dear [Name],\n\nThe "Q3" invoice is due on [Date].')
+        self.assertEqual(agent.last_composition["subject"], "Q3 invoice")
+
+    def test_parse_is_strict_about_body_and_subject(self):
+        with self.assertRaises(ValueError):
+            parse_composition('{"body": "Hello", "tone": "Personal"}')
+        with self.assertRaises(ValueError):
+            parse_composition('["Hello"]')
+        self.assertEqual(parse_composition('```json\n{"body": "Hi", "subject": "Hey"}\n```')["subject"], "Hey")
+
+
 if __name__ == '__main__':
     unittest.main()
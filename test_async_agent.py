@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from async_agent import AsyncEmailAgent, AsyncSMTPPool
+from fakes import FakeModel, SMTPSink
+from model_registry import ModelRegistry
+from resilience import CircuitBreaker, ResilientCaller
+from response_cache import ResponseCache
+from smtp_pool import SMTPConnectionPool
+
+
+class UpstreamError(Exception):
+    code = 503
+
+
+class TestAsyncEmailAgent(unittest.TestCase):
+    def setUp(self):
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+
+    def test_concurrent_generate_and_send(self):
+        model = FakeModel(text="Subject: Hi\nDear team, see you soon.", latency=0.05)
+
+        async def run():
+            agent = AsyncEmailAgent(api_key="dummy", mock_mode=False, async_smtp_pool=AsyncSMTPPool(max_per_key=4))
+            agent.model = model
+
+            async def draft_and_send(i):
+                body = await agent.generate_email(f"Status {i}")
+                return await agent.send_email(f"user{i}@example.com", f"Status {i}", body, self.sink.settings())
+
+            results = await asyncio.gather(*(draft_and_send(i) for i in range(100)))
+            await agent.async_smtp_pool.close_all()
+            return results
+
+        with patch('builtins.print'):
+            results = asyncio.run(run())
+
+        self.assertTrue(all(results))
+        self.assertEqual(model.calls, 100)
+        self.assertEqual(len(self.sink.messages), 100)
+        self.assertNotIn(b"Subject: Hi\n", self.sink.messages[0]["data"])
+        # Sends share a handful of pooled sessions rather than one connection each
+        self.assertLessEqual(self.sink.sessions, 4)
+
+    def test_compose_returns_body_and_subject_from_one_call(self):
+        model = FakeModel(text='{"body": "Dear [Name], see you soon.", "subject": "Catch up", "tone": "Personal"}')
+
+        async def run():
+            agent = AsyncEmailAgent(api_key="dummy", mock_mode=True)
+            agent.model = model
+            return await agent.compose("Catch up soon")
+
+        composition = asyncio.run(run())
+        self.assertEqual((composition["subject"], composition["placeholders"]), ("Catch up", ["Name"]))
+        self.assertEqual(model.calls, 1)
+
+    def test_generate_email_takes_template_variables(self):
+        model = FakeModel(text=lambda prompt: prompt)
+        agent = AsyncEmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = model
+        prompt = asyncio.run(agent.generate_email("Renewal", variables=["Name", "Plan"]))
+        self.assertIn("Variables: [Name], [Plan]", prompt)
+
+    def test_calls_are_routed_and_cached_under_the_answering_model(self):
+        registry = ModelRegistry(cache_path=None, explore_every=0,
+                                 lister=lambda key: ["gemini-reg-flash", "gemini-reg-pro"])
+        failing = [True]
+
+        def flash(prompt):
+            if failing:
+                raise UpstreamError()
+            return "Dear team, flash answered."
+
+        models = {"gemini-reg-flash": FakeModel(text=flash), "gemini-reg-pro": FakeModel(text="Dear team, pro answered.")}
+        agent = AsyncEmailAgent(api_key="dummy", mock_mode=True, model_registry=registry, cache=ResponseCache())
+        for name in models:
+            agent._callers[name] = ResilientCaller(max_attempts=1, breaker=CircuitBreaker())
+
+        async def run():
+            drafts = [await agent.generate_email("Status")]
+            failing.clear()
+            drafts += [await agent.generate_email("Status") for _ in range(2)]
+            return drafts
+
+        with patch('email_agent.get_shared_model', side_effect=lambda key, name, instruction: models[name]):
+            drafts = asyncio.run(run())
+        # pro took over while flash failed; flash's own answer is then cached and reused
+        self.assertEqual(drafts, ["Dear team, pro answered."] + ["Dear team, flash answered."] * 2)
+        self.assertEqual((models["gemini-reg-flash"].calls, models["gemini-reg-pro"].calls), (2, 1))
+
+    def test_rejected_recipient_returns_false(self):
+        self.sink.reject.add("nobody@example.com")
+
+        async def run():
+            agent = AsyncEmailAgent(api_key="dummy", mock_mode=False)
+            return await agent.send_email("nobody@example.com", "Hi", "Body", self.sink.settings())
+
+        with patch('builtins.print'):
+            self.assertFalse(asyncio.run(run()))
+
+    def test_thread_pool_fallback_without_aiosmtplib(self):
+        pool = SMTPConnectionPool()
+        self.addCleanup(pool.close_all)
+
+        async def run():
+            agent = AsyncEmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+            agent.async_smtp_pool = None
+            return await agent.send_email("a@example.com", "Hi", "Body", self.sink.settings())
+
+        with patch('builtins.print'):
+            self.assertTrue(asyncio.run(run()))
+        self.assertEqual(self.sink.messages[0]["to"], ["a@example.com"])
+
+    def test_inherited_sync_sends_still_send(self):
+        agent = AsyncEmailAgent(api_key="dummy", mock_mode=True)
+        with patch('builtins.print') as printed:
+            self.assertEqual(agent.deliver("a@example.com", "Hi", "Body", self.sink.settings()), {})
+            summary = agent.send_many(["b@example.com", "c@example.com"], "Hi", "Body", self.sink.settings())
+        self.assertEqual(summary["accepted"], 2)
+        mock_sends = [c for c in printed.call_args_list if "[MOCK SEND]" in str(c)]
+        self.assertEqual(len(mock_sends), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import email
+import os
+import tracemalloc
+import unittest
+from attachment_cache import AttachmentCache, content_key
+from email_agent import EmailAgent
+from mime_stream import StreamingMessage
+from mime_stream import send_streaming
+from test_mime_stream import NamedBytesIO, NullServer
+
+
+class TestAttachmentCache(unittest.TestCase):
+    def test_evicts_least_recently_used_past_the_byte_cap(self):
+        cache = AttachmentCache(max_bytes=10, max_part_bytes=10)
+        cache.put("a", [b"12", b"34"])
+        cache.put("b", [b"5678"])
+        cache.get("a")
+        cache.put("c", [b"90ab"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), (b"12", b"34"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["bytes"], 8)
+
+    def test_oversized_parts_are_not_stored(self):
+        cache = AttachmentCache(max_bytes=100, max_part_bytes=4)
+        cache.put("a", [b"123", b"45"])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_parts_are_admitted_on_their_second_sighting(self):
+        cache = AttachmentCache()
+        self.assertFalse(cache.admit("a"))
+        self.assertTrue(cache.admit("a"))
+
+    def test_key_covers_content_and_filename(self):
+        self.assertEqual(content_key("a.pdf", [b"x", b"y"]), content_key("a.pdf", [b"xy"]))
+        self.assertNotEqual(content_key("a.pdf", [b"xy"]), content_key("b.pdf", [b"xy"]))
+        self.assertNotEqual(content_key("a.pdf", [b"xy"]), content_key("a.pdf", [b"xz"]))
+
+
+class TestCachedStreamingMessage(unittest.TestCase):
+    def setUp(self):
+        self.cache = AttachmentCache()
+        self.agent = EmailAgent(api_key="dummy", mock_mode=True, attachment_cache=self.cache)
+
+    def _message(self, files):
+        return self.agent._build_streaming_message("me@example.com", "you@example.com", "Hi", "Body", files)
+
+    def test_repeated_sends_reuse_the_encoded_part(self):
+        payload = os.urandom(300_000)
+        messages = [self._message([NamedBytesIO(payload, "report.pdf")]) for _ in range(3)]
+        sent = [message.as_bytes() for message in messages]
+
+        # Sent once: streamed and forgotten. Sent again: kept. From then on: spliced in.
+        self.assertEqual(self.cache.stats()["entries"], 1)
+        self.assertGreater(messages[1].encode_seconds, 0)
+        self.assertEqual(messages[2].encode_seconds, 0)
+        self.assertEqual(messages[2].bytes_written, len(sent[2]))
+        parsed = email.message_from_bytes(sent[2]).get_payload()
+        self.assertEqual(parsed[1].get_filename(), "report.pdf")
+        self.assertEqual(parsed[1].get_payload(decode=True), payload)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertGreater(stats["bytes_saved"], 400_000)
+        self.assertLess(abs(len(sent[0]) - len(sent[2])), 10)  # only the boundaries differ
+
+    def test_cached_sends_keep_memory_flat(self):
+        attachment = NamedBytesIO(os.urandom(4 * 1024 * 1024), "report.bin")
+        for _ in range(2):
+            send_streaming(NullServer(), "me@example.com", ["you@example.com"], self._message([attachment]))
+        peaks = []
+        for _ in range(2):
+            message = self._message([attachment])
+            tracemalloc.start()
+            try:
+                send_streaming(NullServer(), "me@example.com", ["you@example.com"], message)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(self.cache.stats()["hits"], 2)
+        # Splicing the ~5.5MB cached part must not join it into a fresh copy
+        self.assertLess(max(peaks), 1024 * 1024)
+
+    def test_changed_content_is_encoded_again(self):
+        for _ in range(2):
+            self._message([NamedBytesIO(b"v1", "notes.txt")]).as_bytes()
+        message = self._message([NamedBytesIO(b"v2", "notes.txt")])
+        parsed = email.message_from_bytes(message.as_bytes()).get_payload()
+        self.assertEqual(parsed[1].get_payload(decode=True), b"v2")
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    def test_files_too_large_for_the_cache_stream_uncached(self):
+        cache = AttachmentCache(max_bytes=1024 * 1024)
+        skeleton = self.agent._build_message("me@example.com", "you@example.com", "Hi", "Body")
+        payload = os.urandom(512 * 1024)
+        for _ in range(2):
+            message = StreamingMessage(skeleton, [NamedBytesIO(payload, "big.bin")], cache=cache)
+            parsed = email.message_from_bytes(message.as_bytes()).get_payload()
+            self.assertEqual(parsed[1].get_payload(decode=True), payload)
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.stats()["hits"] + cache.stats()["misses"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
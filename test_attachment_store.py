@@ -0,0 +1,91 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from attachment_store import AttachmentStore, QuotaExceeded
+
+
+class Upload(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+class TestAttachmentStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.store = AttachmentStore(self.root, session_quota=1000, grace=0)
+
+    def _blobs(self):
+        return [name for _, _, names in os.walk(self.root) for name in names]
+
+    def test_identical_files_are_stored_once_and_read_through_a_map(self):
+        first = self.store.put("s1", Upload(b"report", "a.pdf"))
+        second = self.store.put("s2", Upload(b"report", "b.pdf"))
+        self.assertEqual(first.digest, second.digest)
+        self.assertEqual(len(self._blobs()), 1)
+        self.assertEqual((second.name, second.size), ("b.pdf", 6))
+        self.assertEqual(bytes(second.view()[2:4]), b"po")
+        self.assertEqual(self.store.open(first.digest, "c.pdf").getvalue(), b"report")
+
+    def test_empty_files(self):
+        stored = self.store.put("s1", Upload(b"", "empty.txt"))
+        self.assertEqual(stored.getvalue(), b"")
+
+    def test_session_quota(self):
+        self.store.put("s1", Upload(b"x" * 600, "a.bin"))
+        self.store.put("s1", Upload(b"x" * 600, "copy.bin"))  # same bytes: no extra space
+        with self.assertRaises(QuotaExceeded):
+            self.store.put("s1", Upload(b"y" * 600, "b.bin"))
+        with self.assertRaises(QuotaExceeded):
+            self.store.put("s2", Upload(b"z" * 1001, "huge.bin"))
+        self.assertEqual(self.store.usage("s1"), 600)
+        self.assertEqual(len(self._blobs()), 1)
+        self.store.put("s2", Upload(b"y" * 600, "b.bin"))
+
+    def test_cleanup_keeps_referenced_files_and_removes_orphans(self):
+        kept = self.store.put("s1", Upload(b"kept", "a.txt"))
+        released = self.store.put("s1", Upload(b"released", "b.txt"))
+        queued = self.store.put(None, Upload(b"queued", "c.txt"))
+        self.store.add_referrer(lambda: {queued.digest})
+        self.store.release("s1", released.digest)
+
+        self.assertEqual(self.store.cleanup(now=time.time() + 1), len(b"released"))
+        self.assertTrue(os.path.exists(kept.path))
+        self.assertTrue(os.path.exists(queued.path))
+        self.assertFalse(os.path.exists(released.path))
+        with self.assertRaises(FileNotFoundError):
+            self.store.open(released.digest, "b.txt")
+
+    def test_idle_sessions_expire(self):
+        self.store.session_ttl = 60
+        stored = self.store.put("s1", Upload(b"data", "a.txt"))
+        self.store.cleanup(now=time.time() + 30)
+        self.assertTrue(os.path.exists(stored.path))
+        self.store.cleanup(now=time.time() + 120)
+        self.assertFalse(os.path.exists(stored.path))
+        self.assertEqual(self.store.usage("s1"), 0)
+
+    def test_new_files_get_a_grace_period(self):
+        self.store.grace = 600
+        stored = self.store.put(None, Upload(b"data", "a.txt"))
+        self.store.cleanup()
+        self.assertTrue(os.path.exists(stored.path))
+
+    def test_failed_spool_leaves_nothing_behind(self):
+        upload = Upload(b"data", "a.txt")
+        with patch.object(upload, "read", side_effect=OSError("disconnected")):
+            with self.assertRaises(OSError):
+                self.store.put("s1", upload)
+        self.assertEqual(self._blobs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import json
+import os
+import smtplib
+import tempfile
+import unittest
+from unittest.mock import patch
+from batch import BatchPipeline, Checkpoint, read_rows
+from email_agent import EmailAgent
+from fakes import FakeModel, SMTPSink
+from smtp_pool import SMTPConnectionPool
+
+
+class TestBatchPipeline(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.checkpoint = os.path.join(self.dir.name, "run.checkpoint.jsonl")
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+        pool = SMTPConnectionPool()
+        self.addCleanup(pool.close_all)
+        self.agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+        self.agent.model = FakeModel(text="Dear [Name],\n\nThe report is ready.")
+
+    def run_pipeline(self, rows):
+        pipeline = BatchPipeline(self.agent, self.checkpoint, self.sink.settings(), generate_workers=3,
+                                 send_workers=2, requests_per_minute=10 ** 6, progress_interval=60)
+        with patch("builtins.print"):
+            return pipeline.run(rows)
+
+    def test_rows_flow_through_generate_validate_send(self):
+        rows = [{"to": f"user{i}@example.com", "subject": f"Report {i}", "Name": f"User {i}"} for i in range(10)]
+        rows.append({"to": "anon@example.com", "subject": "Report"})  # [Name] left unfilled
+
+        counts = self.run_pipeline(rows)
+
+        self.assertEqual((counts["sent"], counts["invalid"], counts["generated"]), (10, 1, 11))
+        self.assertEqual(len(self.sink.messages), 10)
+        self.assertIn(b"Dear User", self.sink.messages[0]["data"])
+
+    def test_template_mode_drafts_once_per_subject(self):
+        rows = [{"to": f"user{i}@example.com", "subject": f"Report {i % 2}", "Name": f"User {i}"} for i in range(20)]
+
+        pipeline = BatchPipeline(self.agent, self.checkpoint, self.sink.settings(), requests_per_minute=10 ** 6,
+                                 progress_interval=60, templates=True)
+        with patch("builtins.print"):
+            counts = pipeline.run(rows)
+
+        self.assertEqual(self.agent.model.calls, 2)
+        self.assertEqual((counts["generated"], counts["sent"]), (2, 20))
+
+    def test_resume_skips_sent_rows_and_reuses_drafts(self):
+        with open(self.checkpoint, "w") as f:
+            f.write(json.dumps({"id": "1", "status": "generated", "body": "Hi [Name], draft one."}) + "\n")
+            f.write(json.dumps({"id": "1", "status": "sent"}) + "\n")
+            f.write(json.dumps({"id": "2", "status": "generated", "body": "Hi [Name], draft two."}) + "\n")
+            f.write('{"id": "3", "status": "gen')  # cut short by the interruption
+        rows = [{"to": f"user{i}@example.com", "subject": "Report", "Name": "Ann"} for i in range(1, 5)]
+
+        counts = self.run_pipeline(rows)
+
+        self.assertEqual((counts["skipped"], counts["sent"]), (1, 3))
+        self.assertEqual(self.agent.model.calls, 2)  # rows 3 and 4 only
+        self.assertIn(b"draft two", self.sink.messages[0]["data"] + self.sink.messages[1]["data"]
+                      + self.sink.messages[2]["data"])
+        checkpoint = Checkpoint(self.checkpoint)
+        checkpoint.close()
+        self.assertEqual(set(checkpoint.final), {"1", "2", "3", "4"})
+
+    def test_temporary_refusals_are_retried_and_permanent_ones_are_final(self):
+        self.sink.greylist_once.add("ann@example.com")
+        self.sink.defer_once.add("cat@example.com")
+        self.sink.reject.add("bob@example.com")
+        rows = [{"to": f"{name}@example.com", "subject": "Report", "Name": name} for name in ("ann", "bob", "cat")]
+
+        with patch("batch.time.sleep") as sleep:
+            counts = self.run_pipeline(rows)
+
+        self.assertEqual((counts["sent"], counts["rejected"], counts["failed"]), (2, 1, 0))
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(sorted(m["to"][0] for m in self.sink.messages), ["ann@example.com", "cat@example.com"])
+
+    def test_permanent_data_errors_are_not_retried(self):
+        rows = [{"to": "ann@example.com", "subject": "Report", "Name": "Ann"}]
+        error = smtplib.SMTPDataError(554, b"Message rejected as spam")
+        with patch.object(self.agent, "deliver", side_effect=error) as deliver, patch("batch.time.sleep") as sleep:
+            counts = self.run_pipeline(rows)
+
+        self.assertEqual((counts["rejected"], deliver.call_count), (1, 1))
+        sleep.assert_not_called()
+        checkpoint = Checkpoint(self.checkpoint)
+        checkpoint.close()
+        self.assertEqual(checkpoint.final, {"1": "rejected"})
+
+    def test_read_rows_handles_csv_and_jsonl(self):
+        csv_path = os.path.join(self.dir.name, "rows.csv")
+        jsonl_path = os.path.join(self.dir.name, "rows.jsonl")
+        with open(csv_path, "w") as f:
+            f.write("to,subject,Name\na@example.com,Hello,Ann\n")
+        with open(jsonl_path, "w") as f:
+            f.write('{"to": "a@example.com", "subject": "Hello", "Name": "Ann"}\n\n')
+        self.assertEqual(list(read_rows(csv_path)), list(read_rows(jsonl_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from content_validator import highlight, scan
+from email_agent import EmailAgent
+
+
+class TestContentValidator(unittest.TestCase):
+    def test_findings_carry_kinds_and_offsets(self):
+        text = 'Hi [Name], ref [ABC-1]. See <a href="">the doc</a>. Please find attached the file.'
+        findings = scan(text, attachment_count=0)
+
+        self.assertEqual([f.kind for f in findings], ["placeholder", "bracket", "empty_link", "attachment"])
+        for f in findings:
+            self.assertEqual(text[f.start:f.end], f.text)
+
+    def test_attachment_mentions_only_flagged_without_files(self):
+        text = "The report is attached."
+        self.assertEqual(scan(text), [])
+        self.assertEqual(scan(text, attachment_count=1), [])
+        self.assertEqual([f.kind for f in scan(text, attachment_count=0)], ["attachment"])
+
+    def test_highlight_rewrites_every_occurrence_once(self):
+        text = "[Date] and again [Date], but not [ok]"
+        out = highlight(text, scan(text), template="<{}>")
+        self.assertEqual(out, "<[Date]> and again <[Date]>, but not [ok]")
+
+    def test_validate_email_keeps_placeholder_contract(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        self.assertEqual(agent.validate_email("Meet on [Date] with [Client Name] re [PO-7]"),
+                         ["[Date]", "[Client Name]"])
+        self.assertEqual(agent.validate_email("All good."), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
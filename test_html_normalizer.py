@@ -0,0 +1,61 @@
+import email
+import unittest
+from email_agent import EmailAgent
+from html_normalizer import HtmlNormalizer, normalize
+
+
+class TestHtmlNormalizer(unittest.TestCase):
+    def test_quill_paragraphs_become_breaks(self):
+        body = ("<p><br></p><p>Hi John,</p><p><br></p><p>Thanks for the <strong>update</strong> &amp; notes.</p>"
+                "<p><br></p><p><br></p><p></p><p>Best,</p><p>Jane</p><p><br></p>")
+        html, text = normalize(body)
+        self.assertEqual(html, "Hi John,<br><br>Thanks for the <strong>update</strong> &amp; notes.<br><br>Best,<br>Jane")
+        self.assertEqual(text, "Hi John,\n\nThanks for the update & notes.\n\nBest,\nJane")
+
+    def test_unsafe_markup_is_dropped(self):
+        html, text = normalize('<p onclick="x()">Go <a href="javascript:alert(1)">here</a></p>'
+                               '<script>alert(1)</script><p><a href="https://example.com">site</a></p>')
+        self.assertEqual(html, 'Go <a>here</a><br><a href="https://example.com">site</a>')
+        self.assertEqual(text, "Go here\nsite (https://example.com)")
+
+    def test_lists_and_alignment(self):
+        html, text = normalize('<p class="ql-align-center">Agenda</p><ul><li>one</li><li>two</li></ul><p>End</p>')
+        self.assertEqual(html, '<div style="text-align: center">Agenda</div><ul><li>one</li><li>two</li></ul>End')
+        self.assertEqual(text, "Agenda\n- one\n- two\nEnd")
+
+    def test_images_keep_only_safe_sources_and_sizes(self):
+        html, text = normalize('<p>Logo <img src="https://example.com/l.png" alt="Logo" width="80" onerror="x()"></p>'
+                               '<p><img src="cid:chart"><img src="javascript:alert(1)"><img src="data:text/html,x"></p>')
+        self.assertEqual(html, 'Logo <img src="https://example.com/l.png" alt="Logo" width="80"><br><img src="cid:chart">')
+        self.assertEqual(text, "Logo [Logo]")
+
+    def test_small_headings_are_blocks(self):
+        html, text = normalize("<h4>Notes</h4><p>Body</p><h6>Small</h6>")
+        self.assertEqual(html, "<h4>Notes</h4>Body<br><h6>Small</h6>")
+        self.assertEqual(text, "Notes\nBody\nSmall")
+
+    def test_quill_format_classes_become_inline_styles(self):
+        html, _ = normalize('<p class="ql-indent-2">Nested</p><p>Say <span class="ql-size-large ql-font-serif">'
+                            'this</span> <span class="ql-font-monospace ql-size-small">code</span></p>')
+        self.assertEqual(html, '<div style="padding-left: 6em">Nested</div>Say '
+                               '<span style="font-size: 1.5em; font-family: Georgia, Times New Roman, serif">this</span> '
+                               '<span style="font-family: Monaco, Courier New, monospace; font-size: 0.75em">code</span>')
+
+    def test_chunked_feed_matches_single_feed(self):
+        body = "<p>Dear [Name],</p><p><br></p><p>See <em>the &lt;plan&gt;</em>.</p>"
+        normalizer = HtmlNormalizer()
+        for i in range(0, len(body), 7):
+            normalizer.feed(body[i:i + 7])
+        self.assertEqual(normalizer.close(), normalize(body))
+
+    def test_message_carries_plaintext_alternative(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        msg = email.message_from_string(
+            agent._build_message("me@example.com", "you@example.com", "Hi", "Hello<br><b>there</b>").as_string())
+        alternative = msg.get_payload()[0]
+        self.assertEqual([p.get_content_type() for p in alternative.get_payload()], ["text/plain", "text/html"])
+        self.assertEqual(alternative.get_payload()[0].get_payload(), "Hello\nthere")
+
+
+if __name__ == "__main__":
+    unittest.main()
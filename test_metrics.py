@@ -0,0 +1,79 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+from email_agent import EmailAgent
+from fakes import FakeModel, SMTPSink
+from metrics import InMemorySink, JsonlSink, Metrics, PrometheusSink
+from smtp_pool import SMTPConnectionPool
+
+
+class NamedBytesIO(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+class TestMetrics(unittest.TestCase):
+    def test_timer_labels_outcome_and_sinks_fan_out(self):
+        memory = InMemorySink()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.jsonl")
+            metrics = Metrics([memory, JsonlSink(path)])
+            with metrics.timer("model_latency_seconds", kind="email"):
+                pass
+            with self.assertRaises(ValueError), metrics.timer("model_latency_seconds", kind="email"):
+                raise ValueError("boom")
+            metrics.incr("smtp_sessions_total", reused="false")
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+
+        self.assertEqual(len(memory.values("model_latency_seconds", kind="email")), 2)
+        self.assertEqual(len(memory.values("model_latency_seconds", outcome="error")), 1)
+        self.assertEqual(memory.counter("smtp_sessions_total"), 1)
+        self.assertEqual([e["type"] for e in events], ["observe", "observe", "incr"])
+
+    def test_prometheus_text_format_and_endpoint(self):
+        sink = PrometheusSink()
+        for value in (0.02, 0.2, 3.0):
+            sink.observe("send_seconds", value, {"mode": "single"})
+        sink.incr("smtp_sessions_total", 2, {"reused": "true"})
+        text = sink.render()
+        self.assertIn("# TYPE emailagent_send_seconds histogram", text)
+        self.assertIn('emailagent_send_seconds_bucket{mode="single",le="0.025"} 1', text)
+        self.assertIn('emailagent_send_seconds_bucket{mode="single",le="+Inf"} 3', text)
+        self.assertIn('emailagent_send_seconds_count{mode="single"} 3', text)
+        self.assertIn('emailagent_smtp_sessions_total{reused="true"} 2', text)
+
+        server = sink.serve(port=0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            self.assertEqual(response.read().decode(), sink.render())
+
+    def test_agent_reports_generation_and_smtp_phases(self):
+        memory = InMemorySink()
+        metrics = Metrics([memory])
+        agent = EmailAgent(api_key="dummy", mock_mode=False, metrics=metrics,
+                           smtp_pool=SMTPConnectionPool(metrics=metrics))
+        agent.model = FakeModel(text="Dear team, see attached.")
+        agent.generate_email("Weekly report")
+        with SMTPSink() as sink:
+            agent.deliver("you@example.com", "Hi", "<p>Body</p>", sink.settings(),
+                          [NamedBytesIO(os.urandom(100_000), "data.bin")])
+            pooled_phases = {p for p in ("connect", "auth", "quit") if memory.values("smtp_phase_seconds", phase=p)}
+            agent.smtp_pool.close_all()
+
+        self.assertEqual(memory.values("response_chars", kind="email"), [len("Dear team, see attached.")])
+        for name in ("prompt_build_seconds", "model_latency_seconds", "send_seconds", "attachment_encode_seconds"):
+            self.assertTrue(memory.values(name), name)
+        self.assertEqual(pooled_phases, {"connect", "auth"})  # the session stays open after the send
+        for phase in ("envelope", "data", "quit"):
+            self.assertTrue(memory.values("smtp_phase_seconds", phase=phase), phase)
+        self.assertGreater(memory.values("message_bytes")[0], 100_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
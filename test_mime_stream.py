@@ -0,0 +1,118 @@
+import email
+import email.header
+import io
+import os
+import tracemalloc
+import unittest
+from email_agent import EmailAgent
+from fakes import SMTPSink
+from mime_stream import _SEND_BUFFER, StreamingMessage, send_streaming
+from smtp_pool import SMTPConnectionPool
+
+
+class NamedBytesIO(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+class NullServer:
+    """Accepts a streamed SMTP transaction without keeping the payload."""
+
+    def __init__(self):
+        self.bytes_received = 0
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, addr):
+        return 250, b"OK"
+
+    def rcpt(self, addr):
+        return 250, b"OK"
+
+    def docmd(self, cmd):
+        return 354, b"Go ahead"
+
+    def send(self, data):
+        self.bytes_received += len(data)
+
+    def getreply(self):
+        return 250, b"Queued"
+
+
+class TestStreamingMessage(unittest.TestCase):
+    def setUp(self):
+        self.agent = EmailAgent(api_key="dummy", mock_mode=True)
+
+    def test_stream_parses_like_the_in_memory_message(self):
+        payload = os.urandom(200_000)
+        files = [NamedBytesIO(payload, "report.pdf"), NamedBytesIO(b"hi", "notes.txt")]
+        message = self.agent._build_streaming_message("me@example.com", "you@example.com", "Héllo", "<p>Body</p>", files)
+
+        parsed = email.message_from_bytes(message.as_bytes())
+        self.assertEqual(str(email.header.make_header(email.header.decode_header(parsed["Subject"]))), "Héllo")
+        parts = parsed.get_payload()
+        self.assertEqual(parts[0].get_content_type(), "multipart/alternative")
+        self.assertEqual([p.get_payload() for p in parts[0].get_payload()], ["Body", "<p>Body</p>"])
+        self.assertEqual([p.get_filename() for p in parts[1:]], ["report.pdf", "notes.txt"])
+        self.assertEqual(parts[1].get_payload(decode=True), payload)
+        self.assertTrue(all(len(line) <= 78 for line in message.as_bytes().split(b"\r\n")))
+
+    def test_leading_dots_in_the_body_are_stuffed(self):
+        server = NullServer()
+        sent = []
+        server.send = sent.append
+        message = self.agent._build_streaming_message("me@example.com", "you@example.com", "Hi", "line\n.hidden")
+        send_streaming(server, "me@example.com", ["you@example.com"], message)
+        self.assertIn(b"\r\n..hidden", b"".join(sent))
+
+    def test_dot_lines_survive_coalesced_writes_and_chunk_boundaries(self):
+        # Dot lines open and close the skeleton chunk, which is bigger than one coalesced write
+        lines = [".first"] + [f"line {i} of the report" for i in range(_SEND_BUFFER // 20)] + [".", ".last"]
+        body = "\n".join(lines)
+        pool = SMTPConnectionPool()
+        with SMTPSink() as sink:
+            message = self.agent._build_streaming_message(sink.settings()["email"], "you@example.com", "Hi", body,
+                                                          [NamedBytesIO(b".not a dot line", "notes.txt")])
+            with pool.connection(sink.settings()) as server:
+                send_streaming(server.server, sink.settings()["email"], ["you@example.com"], message)
+            pool.close_all()
+
+        parsed = email.message_from_bytes(sink.messages[0]["data"]).get_payload()
+        self.assertEqual(parsed[0].get_payload()[0].get_payload(decode=True).decode().splitlines(), lines)
+        self.assertEqual(parsed[1].get_payload(decode=True), b".not a dot line")
+
+    def test_small_messages_go_out_in_one_write(self):
+        # Separate tiny writes stall on Nagle + delayed ACK (~40 ms per message)
+        server = NullServer()
+        sent = []
+        server.send = sent.append
+        message = self.agent._build_streaming_message("me@example.com", "you@example.com", "Hi", "Body",
+                                                      [NamedBytesIO(b"hi", "notes.txt")])
+        send_streaming(server, "me@example.com", ["you@example.com"], message)
+        self.assertEqual(len(sent), 1)
+        self.assertTrue(sent[0].endswith(b"--\r\n.\r\n"))
+
+    def test_peak_memory_stays_flat_for_large_attachments(self):
+        attachment = NamedBytesIO(os.urandom(20 * 1024 * 1024), "big.bin")
+        message = StreamingMessage(self.agent._build_message("me@example.com", "you@example.com", "Hi", "Body"),
+                                   [attachment])
+        server = NullServer()
+
+        tracemalloc.start()
+        try:
+            send_streaming(server, "me@example.com", ["you@example.com"], message)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertGreater(server.bytes_received, 27 * 1024 * 1024)
+        # Building the message in memory would hold several encoded copies (~80MB+)
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import FakeModel
+from model_registry import ModelRegistry, model_tier
+from resilience import CircuitBreaker, ResilientCaller
+from response_cache import ResponseCache
+
+LISTED = ["gemini-2.0-flash", "gemini-2.0-flash-lite", "gemini-1.5-pro", "gemini-2.5-flash-preview-05-20",
+          "gemini-2.0-flash-exp-image-generation", "text-embedding-004", "gemma-3-27b-it"]
+
+
+class UpstreamError(Exception):
+    code = 503
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_path = os.path.join(self.tmp.name, "models.json")
+        self.listed = []
+
+    def lister(self, api_key):
+        self.listed.append(api_key)
+        return list(LISTED)
+
+    def registry(self, **kwargs):
+        return ModelRegistry(cache_path=self.cache_path, lister=self.lister, **kwargs)
+
+    def test_model_list_is_cached_on_disk_with_ttl(self):
+        self.assertEqual(self.registry().models("key"), LISTED)
+        self.assertEqual(self.registry().models("key"), LISTED)  # new process, same disk cache
+        self.assertEqual(self.listed, ["key"])
+        self.registry(ttl=0).models("key")
+        self.assertEqual(len(self.listed), 2)
+        with open(self.cache_path) as f:
+            self.assertNotIn('"key"', f.read())  # API keys are stored hashed
+
+    def test_discovery_failure_falls_back_to_default(self):
+        def broken(api_key):
+            raise ConnectionError("offline")
+
+        with patch('builtins.print'):
+            registry = ModelRegistry(cache_path=None, lister=broken)
+            self.assertEqual(registry.route("key"), ["gemini-2.0-flash"])
+
+    def test_tiers_and_variants_filter_eligible_models(self):
+        self.assertEqual(sorted(self.registry().eligible(LISTED)), ["gemini-1.5-pro", "gemini-2.0-flash"])
+        self.assertIn("gemini-2.0-flash-lite", self.registry(min_tier="lite").eligible(LISTED))
+        self.assertEqual(self.registry(min_tier="pro").eligible(LISTED), ["gemini-1.5-pro"])
+
+    def test_routes_to_fastest_healthy_model(self):
+        registry = self.registry(min_tier="lite")
+        for _ in range(3):
+            registry.record("gemini-2.0-flash", 0.4, ok=True)
+            registry.record("gemini-2.0-flash-lite", 0.9, ok=True)
+        self.assertEqual(registry.route("key")[0], "gemini-2.0-flash")
+        for _ in range(3):
+            registry.record("gemini-2.0-flash", 5.0, ok=False)
+        self.assertEqual(registry.route("key")[0], "gemini-2.0-flash-lite")
+        self.assertFalse({row["model"]: row for row in registry.stats()}["gemini-2.0-flash"]["healthy"])
+
+    def test_unmeasured_ties_go_to_the_configured_model_then_newer_versions(self):
+        registry = ModelRegistry(cache_path=None, explore_every=0, lister=lambda key: [
+            "gemini-1.5-flash", "gemini-1.5-flash-8b", "gemini-2.0-flash", "gemini-2.5-flash"])
+        self.assertEqual(model_tier("gemini-1.5-flash-8b"), "lite")
+        self.assertEqual(registry.route("key"), ["gemini-2.0-flash", "gemini-2.5-flash", "gemini-1.5-flash"])
+        self.assertEqual(registry.route("key", preferred=["gemini-2.5-flash"])[0], "gemini-2.5-flash")
+
+    def test_untried_models_get_exploration_calls(self):
+        registry = ModelRegistry(cache_path=None, explore_every=3,
+                                 lister=lambda key: ["gemini-2.0-flash", "gemini-2.5-flash"])
+        for _ in range(3):
+            registry.record("gemini-2.0-flash", 0.4, ok=True)
+        firsts = [registry.route("key")[0] for _ in range(6)]
+        self.assertEqual(firsts.count("gemini-2.5-flash"), 2)
+        self.assertEqual(registry.route("key", explore=False)[0], "gemini-2.0-flash")
+
+    def test_fallback_models_use_the_agents_resilience_settings(self):
+        registry = ModelRegistry(cache_path=None, lister=lambda key: ["gemini-reg-flash"])
+        agent = EmailAgent(api_key="dummy", mock_mode=True, model_registry=registry,
+                           resilience=ResilientCaller(deadline=5.0, max_attempts=7))
+        caller = agent._caller_for("gemini-reg-flash")
+        self.assertEqual((caller.deadline, caller.max_attempts), (5.0, 7))
+        self.assertIsNot(caller.breaker, agent.resilience.breaker)
+
+    def test_cached_drafts_are_keyed_by_the_model_that_answered(self):
+        registry = ModelRegistry(cache_path=None, explore_every=0,
+                                 lister=lambda key: ["gemini-reg-flash", "gemini-reg-pro"])
+        failing = [True]
+
+        def flash(prompt):
+            if failing:
+                raise UpstreamError()
+            return "Dear team, flash answered."
+
+        models = {"gemini-reg-flash": FakeModel(text=flash), "gemini-reg-pro": FakeModel(text="Dear team, pro answered.")}
+        agent = EmailAgent(api_key="dummy", mock_mode=True, model_registry=registry, cache=ResponseCache())
+        for name in models:
+            agent._callers[name] = ResilientCaller(max_attempts=1, breaker=CircuitBreaker())
+
+        with patch('email_agent.get_shared_model', side_effect=lambda key, name, instruction: models[name]):
+            self.assertEqual(agent.generate_email("Status"), "Dear team, pro answered.")
+            failing.clear()
+            # flash still routes first: pro's cached answer isn't served as flash's
+            self.assertEqual(agent.generate_email("Status"), "Dear team, flash answered.")
+            self.assertEqual(agent.generate_email("Status"), "Dear team, flash answered.")
+        self.assertEqual(models["gemini-reg-flash"].calls, 2)
+
+    def test_agent_falls_back_when_a_model_fails(self):
+        registry = ModelRegistry(cache_path=None, lister=lambda key: ["gemini-reg-flash", "gemini-reg-pro"])
+        models = {"gemini-reg-flash": FakeModel(text=lambda prompt: (_ for _ in ()).throw(UpstreamError())),
+                  "gemini-reg-pro": FakeModel(text="Dear team, the fallback answered.")}
+        agent = EmailAgent(api_key="dummy", mock_mode=True, model_registry=registry)
+        for name in models:
+            agent._callers[name] = ResilientCaller(max_attempts=1, breaker=CircuitBreaker())
+
+        with patch('email_agent.get_shared_model', side_effect=lambda key, name, instruction: models[name]):
+            self.assertEqual(agent.generate_email("Status"), "Dear team, the fallback answered.")
+        self.assertEqual(agent.last_model, "gemini-reg-pro")
+        self.assertEqual(models["gemini-reg-flash"].calls, 1)
+        self.assertEqual(registry.profile("gemini-reg-flash").error_rate(), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import SMTPSink
+from attachment_store import AttachmentStore
+from outbox import Outbox
+from smtp_pool import SMTPConnectionPool
+
+
+class FakeUpload:
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "outbox.db")
+        self.sink = SMTPSink().start()
+        self.addCleanup(self.sink.stop)
+        pool = SMTPConnectionPool()
+        self.addCleanup(pool.close_all)
+        self.agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=pool)
+        patcher = patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queued_email_is_sent_with_attachments(self):
+        outbox = Outbox(self.db_path, agent=self.agent)
+        handle = outbox.enqueue("a@example.com", "Hi", "<b>Body</b>", self.sink.settings(),
+                                [FakeUpload("notes.txt", b"hello")])
+        self.assertEqual(handle.status()["status"], "pending")
+
+        self.assertTrue(outbox.process_next())
+        self.assertTrue(handle.done)
+        self.assertEqual(handle.status()["status"], "sent")
+        self.assertIn(b'filename="notes.txt"', self.sink.messages[0]["data"])
+
+    def test_stored_attachments_are_kept_by_reference(self):
+        store = AttachmentStore(os.path.join(os.path.dirname(self.db_path), "store"), grace=0)
+        outbox = Outbox(self.db_path, agent=self.agent, store=store)
+        stored = store.put("session", FakeUpload("report.pdf", b"%PDF-1.4 report"))
+        handle = outbox.enqueue("a@example.com", "Hi", "Body", self.sink.settings(),
+                                [stored, FakeUpload("notes.txt", b"hello")])
+        self.assertEqual(outbox._db().execute("SELECT SUM(LENGTH(data)) FROM attachments").fetchone()[0], 0)
+
+        # The session is gone, but the queued job still needs both files
+        store.release("session")
+        store.cleanup(now=time.time() + 1)
+        self.assertTrue(outbox.process_next())
+        self.assertEqual(handle.status()["status"], "sent")
+        self.assertIn(b'filename="report.pdf"', self.sink.messages[0]["data"])
+        self.assertIn(b'filename="notes.txt"', self.sink.messages[0]["data"])
+
+        store.cleanup(now=time.time() + 1)
+        with self.assertRaises(FileNotFoundError):
+            store.open(stored.digest, "report.pdf")
+
+    def test_cc_bcc_go_in_one_transaction_and_refusals_are_kept(self):
+        self.sink.reject.add("gone@example.com")
+        outbox = Outbox(self.db_path, agent=self.agent)
+        handle = outbox.enqueue(["a@example.com", "b@example.com"], "Hi", "<b>Body</b>", self.sink.settings(),
+                                cc=["gone@example.com"], bcc=["hidden@example.com"])
+
+        self.assertTrue(outbox.process_next())
+        status = handle.status()
+        self.assertEqual(status["status"], "sent")
+        self.assertEqual(list(status["refused"]), ["gone@example.com"])
+        self.assertEqual(len(self.sink.messages), 1)
+        self.assertEqual(self.sink.messages[0]["to"], ["a@example.com", "b@example.com", "hidden@example.com"])
+        self.assertIn(b"Cc: gone@example.com", self.sink.messages[0]["data"])
+        self.assertNotIn(b"hidden@example.com", self.sink.messages[0]["data"])  # BCC stays out of the headers
+
+    def test_failed_send_is_retried_later(self):
+        outbox = Outbox(self.db_path, agent=self.agent, base_delay=60)
+        settings = dict(self.sink.settings(), port=1)  # nothing listens here
+        handle = outbox.enqueue("a@example.com", "Hi", "Body", settings)
+
+        outbox.process_next()
+        status = handle.status()
+        self.assertEqual((status["status"], status["attempts"]), ("pending", 1))
+        # Backed off: not due again yet
+        self.assertFalse(outbox.process_next())
+
+    def test_jobs_survive_restart_and_wait_for_credentials(self):
+        handle = Outbox(self.db_path, agent=self.agent).enqueue("a@example.com", "Hi", "Body", self.sink.settings())
+
+        restarted = Outbox(self.db_path, agent=self.agent)
+        # The password was never written to disk, so nothing can be sent yet
+        self.assertFalse(restarted.process_next())
+        restarted.register_credentials(self.sink.settings())
+        self.assertTrue(restarted.process_next())
+        self.assertEqual(restarted.status(handle.job_id)["status"], "sent")
+
+    def test_jobs_being_sent_elsewhere_are_taken_over_only_after_their_lease(self):
+        first = Outbox(self.db_path, agent=self.agent, lease_seconds=60)
+        handle = first.enqueue("a@example.com", "Hi", "Body", self.sink.settings())
+        self.assertEqual(first._claim(), handle.job_id)  # mid-send in the first process
+
+        second = Outbox(self.db_path, agent=self.agent)
+        second.register_credentials(self.sink.settings())
+        self.assertFalse(second.process_next())
+        self.assertEqual(second.status(handle.job_id)["status"], "sending")
+
+        # The first process died: once the lease runs out, the send is retried
+        with patch('outbox.time.time', return_value=time.time() + 61):
+            self.assertTrue(second.process_next())
+        self.assertEqual(second.status(handle.job_id)["status"], "sent")
+        self.assertEqual(len(self.sink.messages), 1)
+
+    def test_accounts_waiting_for_credentials_do_not_starve_others(self):
+        waiting = dict(self.sink.settings(), email="locked@example.com")
+        outbox = Outbox(self.db_path, agent=self.agent)
+        for i in range(60):
+            outbox.enqueue(f"user{i}@example.com", "Hi", "Body", waiting)
+        handle = outbox.enqueue("a@example.com", "Hi", "Body", self.sink.settings())
+
+        restarted = Outbox(self.db_path, agent=self.agent)
+        restarted.register_credentials(self.sink.settings())
+        self.assertTrue(restarted.process_next())
+        self.assertEqual(restarted.status(handle.job_id)["status"], "sent")
+        self.assertFalse(restarted.process_next())
+
+    def test_background_workers_drain_the_queue(self):
+        outbox = Outbox(self.db_path, agent=self.agent, poll_interval=0.05).start(workers=2)
+        self.addCleanup(outbox.stop)
+        handles = [outbox.enqueue(f"user{i}@example.com", "Hi", "Body", self.sink.settings()) for i in range(5)]
+
+        deadline = time.time() + 5
+        while not all(h.done for h in handles) and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertEqual([h.status()["status"] for h in handles], ["sent"] * 5)
+        self.assertEqual(len(self.sink.messages), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
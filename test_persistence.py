@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch
+from persistence import QueryParamSync, SecretStore
+
+
+class FakeQueryParams(dict):
+    """Stands in for st.query_params, counting the writes that would reach the browser."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = 0
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.writes += 1
+
+    def from_dict(self, params):
+        self.clear()
+        super().update(params)
+        self.writes += 1
+
+
+class TestQueryParamSync(unittest.TestCase):
+    def _sync(self, store=None):
+        return QueryParamSync(["theme", "smtp_port", "to_email"], secret_keys=["api_key"], secret_store=store)
+
+    def test_restores_missing_keys_from_the_url(self):
+        params = FakeQueryParams(theme="Dark", smtp_port="465")
+        session = {"theme": "Light"}
+        self._sync().restore(session, params, types={"smtp_port": int})
+        self.assertEqual(session, {"theme": "Light", "smtp_port": 465})
+
+    def test_only_changed_keys_are_written_once_per_rerun(self):
+        params = FakeQueryParams(theme="Dark", smtp_port="587")
+        sync = self._sync()
+        session = {}
+        sync.restore(session, params, types={"smtp_port": int})
+
+        self.assertFalse(sync.flush(session, params))
+        session["to_email"] = "a@example.com"
+        session["theme"] = "Light"
+        self.assertTrue(sync.flush(session, params))
+        self.assertEqual(params.writes, 1)
+        self.assertEqual(params, {"theme": "Light", "smtp_port": "587", "to_email": "a@example.com"})
+
+        self.assertFalse(sync.flush(session, params))
+        session["to_email"] = ""
+        self.assertTrue(sync.flush(session, params))
+        self.assertNotIn("to_email", params)
+        self.assertEqual(params.writes, 2)
+
+    def test_secrets_go_to_the_store_not_the_url(self):
+        store = SecretStore()
+        params = FakeQueryParams()
+        sync = self._sync(store)
+        sync.flush({"api_key": "secret-key", "theme": "Dark"}, params)
+        self.assertNotIn("secret-key", params.values())
+        self.assertEqual(store.load(params["sid"]), {"api_key": "secret-key"})
+
+        # A reload with the same URL gets the key back
+        session = {}
+        self._sync(store).restore(session, FakeQueryParams(params))
+        self.assertEqual(session, {"api_key": "secret-key", "theme": "Dark"})
+
+    def test_secrets_in_old_links_move_to_the_store(self):
+        store = SecretStore()
+        params = FakeQueryParams(api_key="secret-key", theme="Dark")
+        sync = self._sync(store)
+        session = {}
+        sync.restore(session, params)
+        self.assertEqual(session["api_key"], "secret-key")
+        self.assertTrue(sync.flush(session, params))
+        self.assertEqual(params.writes, 1)
+        self.assertEqual(set(params), {"theme", "sid"})
+        self.assertEqual(store.load(params["sid"]), {"api_key": "secret-key"})
+
+    def test_secrets_are_not_persisted_without_a_store(self):
+        params = FakeQueryParams(api_key="secret-key")
+        sync = self._sync()
+        sync.flush({"api_key": "secret-key"}, params)
+        self.assertEqual(params, {})
+
+
+class TestSecretStore(unittest.TestCase):
+    def test_tokens_expire_when_unused(self):
+        store = SecretStore(ttl=60)
+        token = store.new_token()
+        store.save(token, {"api_key": "k"})
+        with patch("persistence.time.time", return_value=10 ** 12):
+            self.assertEqual(store.load(token), {})
+        self.assertEqual(store.load("unknown"), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from profiler import RerunProfiler
+
+
+class TestRerunProfiler(unittest.TestCase):
+    def test_laps_and_sections_are_recorded_per_run(self):
+        profiler = RerunProfiler()
+        run = profiler.start_run()
+        time.sleep(0.01)
+        run.lap("css")
+        with run.section("model_call"):
+            time.sleep(0.01)
+        run.lap("css")  # repeated names accumulate
+        record = run.finish()
+
+        self.assertEqual(set(record["sections"]), {"css", "model_call"})
+        self.assertGreaterEqual(record["sections"]["css"], 10)
+        self.assertGreaterEqual(record["total_ms"], 20)
+        self.assertIsNone(run.finish())
+        self.assertEqual(len(profiler.runs()), 1)
+
+    def test_unfinished_run_is_closed_on_next_start(self):
+        profiler = RerunProfiler()
+        run = profiler.start_run()
+        run.lap("sidebar")
+        profiler.start_run(previous=run)  # e.g. the script ended in st.rerun()
+        self.assertTrue(profiler.runs()[0]["interrupted"])
+
+    def test_ring_buffer_and_percentiles(self):
+        profiler = RerunProfiler(capacity=100)
+        for ms in range(1, 201):
+            profiler.record({"ts": 0, "total_ms": ms, "sections": {"quill": ms}, "interrupted": False})
+        rows = {row["section"]: row for row in profiler.summary()}
+        self.assertEqual(rows["quill"]["count"], 100)  # only the newest 100 runs are kept
+        self.assertEqual(rows["quill"]["p50_ms"], 150)
+        self.assertEqual(rows["quill"]["p95_ms"], 195)
+
+    def test_export_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, "live.jsonl")
+            profiler = RerunProfiler(log_path=log_path)
+            for _ in range(3):
+                profiler.start_run().finish()
+            export_path = os.path.join(tmp, "export.jsonl")
+            self.assertEqual(profiler.export_jsonl(export_path), 3)
+            for path in (log_path, export_path):
+                with open(path) as f:
+                    self.assertEqual(len([json.loads(line) for line in f]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
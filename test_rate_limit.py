@@ -0,0 +1,57 @@
+import threading
+import unittest
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import FakeModel
+from rate_limit import RateLimiter, TokenBucket, is_rate_limited
+
+
+class QuotaExceeded(Exception):
+    code = 429
+
+
+class TestRateLimiting(unittest.TestCase):
+    def test_bucket_blocks_once_capacity_is_spent(self):
+        bucket = TokenBucket(rate_per_minute=600, capacity=2)  # 10 tokens/s
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertGreater(bucket.acquire(), 0.0)
+
+    def test_throttling_halves_rate_and_success_recovers(self):
+        limiter = RateLimiter(requests_per_minute=100, recovery=0.25)
+        limiter.on_throttled()
+        self.assertEqual(limiter._requests.rate_per_minute, 50)
+        limiter.on_success()
+        self.assertEqual(limiter._requests.rate_per_minute, 75)
+
+    def test_is_rate_limited(self):
+        self.assertTrue(is_rate_limited(QuotaExceeded("quota")))
+        self.assertTrue(is_rate_limited(Exception("429 Resource has been exhausted")))
+        self.assertFalse(is_rate_limited(ValueError("bad prompt")))
+
+
+class TestGenerateEmails(unittest.TestCase):
+    def test_results_keep_input_order_and_429s_are_retried(self):
+        failed_once = threading.Event()
+
+        def respond(prompt):
+            if "Invoice" in prompt and not failed_once.is_set():
+                failed_once.set()
+                raise QuotaExceeded("429 quota exceeded")
+            return "Body for " + prompt.split("'")[1]
+
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        agent.model = FakeModel(text=respond, latency=0.05)
+        subjects = ["Weekly status report", "Invoice follow-up", "Team lunch", "Trip"]
+
+        with patch('builtins.print'), patch('email_agent.random.uniform', return_value=0.0):
+            report = agent.generate_emails(subjects, concurrency=4, requests_per_minute=6000)
+
+        self.assertEqual(report["emails"], ["Body for " + s for s in subjects])
+        self.assertEqual(report["throttled"], 1)
+        # Four 50ms calls in parallel finish well under the serial baseline
+        self.assertLess(report["wall_time"], report["serial_time"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from recipients import normalize_address, parse_recipients
+
+
+class TestRecipients(unittest.TestCase):
+    def test_lists_are_normalized_and_deduplicated_across_to_cc_bcc(self):
+        recipients = parse_recipients("Ann <ann@Example.COM>; bob@example.com,\nANN@example.com",
+                                      cc=["bob@example.com", "cat@example.com"], bcc="cat@example.com, dan@example.com")
+        self.assertEqual(recipients.to, ["ann@example.com", "bob@example.com"])
+        self.assertEqual(recipients.cc, ["cat@example.com"])
+        self.assertEqual(recipients.bcc, ["dan@example.com"])
+        self.assertEqual(recipients.invalid, [])
+
+    def test_malformed_entries_are_reported(self):
+        recipients = parse_recipients("ok@example.com, not-an-address, x@nodot")
+        self.assertEqual(recipients.to, ["ok@example.com"])
+        self.assertEqual(recipients.invalid, ["not-an-address", "x@nodot"])
+        self.assertIsNone(normalize_address("a b@example.com"))
+        self.assertEqual(parse_recipients(None), ([], [], [], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+import unittest
+from email_agent import EmailAgent
+from fakes import FakeModel
+from metrics import InMemorySink, Metrics
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientCaller
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class Flaky:
+    """Fails with the given codes in turn, then answers "ok"."""
+
+    def __init__(self, *codes, delays=()):
+        self.codes = list(codes)
+        self.delays = list(delays)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            self.calls += 1
+            code = self.codes.pop(0) if self.codes else None
+            delay = self.delays.pop(0) if self.delays else 0
+        time.sleep(delay)
+        if code:
+            raise UpstreamError(code)
+        return "ok"
+
+
+class TestResilientCaller(unittest.TestCase):
+    def setUp(self):
+        self.sink = InMemorySink()
+        self.metrics = Metrics([self.sink])
+
+    def caller(self, **kwargs):
+        kwargs.setdefault("base_delay", 0.01)
+        return ResilientCaller(metrics=self.metrics, **kwargs)
+
+    def test_retries_retryable_errors_with_backoff(self):
+        fn = Flaky(503, 500)
+        self.assertEqual(self.caller().call(fn, kind="email"), "ok")
+        self.assertEqual(fn.calls, 3)
+        self.assertEqual(self.sink.counter("model_retries_total", kind="email"), 2)
+
+    def test_non_retryable_errors_propagate_at_once(self):
+        fn = Flaky(400)
+        with self.assertRaises(UpstreamError):
+            self.caller().call(fn)
+        self.assertEqual(fn.calls, 1)
+
+    def test_deadline_abandons_a_stuck_call(self):
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            self.caller(deadline=0.1).call(Flaky(delays=[1.0]))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.sink.counter("model_deadline_exceeded_total"), 1)
+
+    def test_hedge_wins_over_a_slow_primary(self):
+        caller = self.caller(hedge=True, hedge_min_delay=0.02, hedge_min_samples=5)
+        caller._latencies.extend([0.01] * 5)
+        start = time.monotonic()
+        self.assertEqual(caller.call(Flaky(delays=[1.0, 0.0])), "ok")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.sink.counter("model_hedge_wins_total", winner="hedge"), 1)
+
+    def test_async_deadline_and_retry(self):
+        async def scenario():
+            attempts = []
+
+            async def fn(timeout):
+                attempts.append(timeout)
+                if len(attempts) == 1:
+                    raise UpstreamError(503)
+                return "ok"
+
+            async def stuck(timeout):
+                await asyncio.sleep(1)
+
+            caller = self.caller(deadline=0.2)
+            self.assertEqual(await caller.call_async(fn), "ok")
+            with self.assertRaises(DeadlineExceeded):
+                await caller.call_async(stuck)
+            return attempts
+
+        self.assertEqual(len(asyncio.run(scenario())), 2)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_fails_fast_and_recovers_through_a_probe(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+        caller = ResilientCaller(max_attempts=1, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(UpstreamError):
+                caller.call(Flaky(503))
+        self.assertEqual(breaker.state, "open")
+
+        fn = Flaky()
+        with self.assertRaises(CircuitOpenError):
+            caller.call(fn)
+        self.assertEqual(fn.calls, 0)
+
+        time.sleep(0.15)
+        self.assertEqual(caller.call(fn), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+    def test_rate_limits_do_not_trip_the_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        with self.assertRaises(UpstreamError):
+            ResilientCaller(max_attempts=1, breaker=breaker).call(Flaky(429))
+        self.assertEqual(breaker.state, "closed")
+
+
+    def test_a_rate_limited_probe_lets_the_next_call_probe_again(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        caller = ResilientCaller(max_attempts=1, breaker=breaker)
+        with self.assertRaises(UpstreamError):
+            caller.call(Flaky(503))
+        time.sleep(0.1)
+        with self.assertRaises(UpstreamError):
+            caller.call(Flaky(429))  # the half-open probe is throttled
+        self.assertEqual(breaker.state, "half_open")
+
+        self.assertEqual(caller.call(Flaky()), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+    def test_a_cancelled_async_probe_is_released(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        caller = ResilientCaller(max_attempts=1, breaker=breaker)
+        with self.assertRaises(UpstreamError):
+            caller.call(Flaky(503))
+        time.sleep(0.1)
+
+        async def hang(timeout):
+            await asyncio.sleep(10)
+
+        async def scenario():
+            task = asyncio.ensure_future(caller.call_async(hang))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+        self.assertEqual(caller.call(Flaky()), "ok")
+
+
+class TestAgentResilience(unittest.TestCase):
+    def test_generate_email_survives_a_transient_failure(self):
+        failures = [UpstreamError(503)]
+
+        def respond(prompt):
+            if failures:
+                raise failures.pop()
+            return "Dear team, all good."
+
+        agent = EmailAgent(api_key="dummy", mock_mode=True, resilience=ResilientCaller(base_delay=0.01))
+        agent.model = FakeModel(text=respond)
+        self.assertEqual(agent.generate_email("Status"), "Dear team, all good.")
+        self.assertEqual(agent.model.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import FakeModel
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru_eviction_and_counters(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")          # "a" becomes most recently used
+        cache.set("c", "3")     # evicts "b"
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = ResponseCache(ttl=60)
+        with patch('response_cache.time.time', return_value=1000):
+            cache.set("k", "v")
+        with patch('response_cache.time.time', return_value=1061):
+            self.assertIsNone(cache.get("k"))
+
+    def test_sqlite_tier_is_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "responses.db")
+            ResponseCache(db_path=path).set("k", "shared")
+            other = ResponseCache(db_path=path)
+            self.assertEqual(other.get("k"), "shared")
+            self.assertEqual(other.stats()["disk_hits"], 1)
+
+    def test_key_depends_on_model_and_attachments(self):
+        base = ResponseCache.make_key("prompt", "gemini-2.0-flash")
+        self.assertNotEqual(base, ResponseCache.make_key("prompt", "gemini-1.5-pro"))
+        self.assertNotEqual(base, ResponseCache.make_key("prompt", "gemini-2.0-flash", ["a.pdf"]))
+
+
+class TestAgentCaching(unittest.TestCase):
+    def test_repeat_subject_is_served_from_cache_unless_regenerating(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True, cache=ResponseCache())
+        agent.model = FakeModel(text="Dear team, the weekly report is ready.")
+
+        first = agent.generate_email("Weekly status report")
+        second = agent.generate_email("Weekly status report")
+        self.assertEqual(first, second)
+        self.assertEqual(agent.model.calls, 1)
+
+        agent.generate_email("Weekly status report", regenerate=True)
+        self.assertEqual(agent.model.calls, 2)
+
+    def test_errors_are_not_cached(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True, cache=ResponseCache())
+        agent.model = FakeModel(text=lambda prompt: 1 / 0)
+        self.assertTrue(agent.optimize_subject("Invoice").startswith("Error"))
+        self.assertEqual(agent.cache.stats()["entries"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
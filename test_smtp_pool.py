@@ -0,0 +1,67 @@
+import smtplib
+import unittest
+from unittest.mock import MagicMock, patch
+from smtp_pool import SMTPConnectionPool
+
+SETTINGS = {"server": "smtp.example.com", "port": 587, "email": "me@example.com", "password": "secret"}
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+    @patch('smtp_pool.smtplib.SMTP')
+    def test_session_is_reused_between_sends(self, mock_smtp):
+        pool = SMTPConnectionPool()
+        pool.sendmail(SETTINGS, "me@example.com", "a@example.com", "msg")
+        pool.sendmail(SETTINGS, "me@example.com", "b@example.com", "msg")
+
+        # One handshake, two messages
+        self.assertEqual(mock_smtp.call_count, 1)
+        server = mock_smtp.return_value
+        server.starttls.assert_called_once()
+        server.login.assert_called_once_with("me@example.com", "secret")
+        self.assertEqual(server.sendmail.call_count, 2)
+        self.assertEqual(pool.idle_count(SETTINGS), 1)
+
+    @patch('smtp_pool.smtplib.SMTP')
+    def test_warm_session_is_used_by_next_send(self, mock_smtp):
+        pool = SMTPConnectionPool()
+        pool.warm(SETTINGS)
+        pool.sendmail(SETTINGS, "me@example.com", "a@example.com", "msg")
+        self.assertEqual(mock_smtp.call_count, 1)
+
+    @patch('smtp_pool.smtplib.SMTP')
+    def test_stale_session_reconnects(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        stale.sendmail.side_effect = smtplib.SMTPServerDisconnected("gone")
+        mock_smtp.side_effect = [stale, fresh]
+
+        pool = SMTPConnectionPool()
+        pool.warm(SETTINGS)
+        pool.sendmail(SETTINGS, "me@example.com", "a@example.com", "msg")
+
+        fresh.sendmail.assert_called_once()
+        self.assertEqual(pool.idle_count(SETTINGS), 1)
+
+    @patch('smtp_pool.smtplib.SMTP')
+    def test_failed_noop_health_check_replaces_session(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        stale.noop.return_value = (421, b"closing")
+        mock_smtp.side_effect = [stale, fresh]
+
+        pool = SMTPConnectionPool(health_check_after=0)
+        pool.warm(SETTINGS)
+        pool.sendmail(SETTINGS, "me@example.com", "a@example.com", "msg")
+
+        stale.sendmail.assert_not_called()
+        fresh.sendmail.assert_called_once()
+
+    @patch('smtp_pool.smtplib.SMTP')
+    def test_idle_sessions_are_evicted(self, mock_smtp):
+        pool = SMTPConnectionPool(idle_timeout=0)
+        pool.warm(SETTINGS)
+        self.assertEqual(pool.evict_idle(), 1)
+        self.assertEqual(pool.idle_count(), 0)
+        mock_smtp.return_value.quit.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
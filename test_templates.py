@@ -0,0 +1,56 @@
+import datetime
+import unittest
+from unittest.mock import patch
+from email_agent import EmailAgent
+from fakes import FakeModel, SMTPSink
+from smtp_pool import SMTPConnectionPool
+from templates import EmailTemplate, TemplateError, variable_type
+
+
+class TestEmailTemplate(unittest.TestCase):
+    def test_render_formats_typed_variables(self):
+        template = EmailTemplate("Hi [Name], [Total] is due on [Due Date]. Pay at [Payment Link].")
+        self.assertEqual(variable_type("Due Date"), "date")
+        text = template.render({"name": "Ann", "total": 1234.5, "due date": "2026-11-02",
+                                "Payment Link": "https://pay.example.com"})
+        self.assertEqual(text, "Hi Ann, 1,234.50 is due on November 02, 2026. Pay at https://pay.example.com.")
+        self.assertIn("March 01", template.render({"Due Date": datetime.date(2026, 3, 1)}))
+
+    def test_mistyped_value_raises(self):
+        with self.assertRaises(TemplateError):
+            EmailTemplate("Join at [Meeting Link]").render({"Meeting Link": "not a link"})
+
+    def test_unfilled_variables_are_left_for_validate_email(self):
+        template = EmailTemplate("Hi [Name], welcome to [Company].")
+        text = template.render({"Name": "Ann"})
+        self.assertEqual(template.missing({"Name": "Ann"}), ["Company"])
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        self.assertEqual(agent.validate_email(text), [])  # [Company] alone isn't a missing-info label
+        self.assertEqual(agent.validate_email(text, template=template), ["[Company]"])
+
+    def test_html_templates_escape_values(self):
+        self.assertEqual(EmailTemplate("Hi [Name]", html=True).render({"Name": "<b>Ann</b>"}), "Hi &lt;b&gt;Ann&lt;/b&gt;")
+
+
+class TestTemplateSendMany(unittest.TestCase):
+    def test_one_model_call_serves_every_recipient(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=False, smtp_pool=SMTPConnectionPool())
+        agent.model = FakeModel(text="Dear [Name],\nYour plan renews on [Renewal Date].")
+        template = agent.generate_template("Renewal notice", variables=["Name", "Renewal Date"])
+        recipients = [{"email": f"user{i}@example.com", "Name": f"User {i}", "Renewal Date": "2026-12-01"}
+                      for i in range(50)]
+        recipients.append({"email": "nodate@example.com", "Name": "No Date"})
+
+        with SMTPSink() as sink, patch("builtins.print"):
+            summary = agent.send_many(recipients, "Renewal for [Name]", template, sink.settings())
+            agent.smtp_pool.close_all()
+
+        self.assertEqual(agent.model.calls, 1)
+        self.assertEqual((summary["accepted"], summary["invalid"]), (50, 1))
+        self.assertEqual(summary["results"][-1]["error"], "[Renewal Date]")
+        self.assertIn(b"Dear User 7,<br>Your plan renews on December 01, 2026.", b"".join(
+            m["data"] for m in sink.messages))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from types import SimpleNamespace
+from email_agent import EMAIL_SYSTEM_INSTRUCTION, EmailAgent
+from fakes import FakeModel
+from token_usage import TokenUsage, key_usage
+
+
+class UsageModel(FakeModel):
+    """FakeModel whose responses carry usage_metadata, like the real API's."""
+
+    def _respond(self, prompt):
+        response = super()._respond(prompt)
+        response.usage_metadata = SimpleNamespace(prompt_token_count=120, candidates_token_count=45)
+        return response
+
+
+class TestTokenUsage(unittest.TestCase):
+    def test_report_totals_and_budget(self):
+        usage = TokenUsage(budget=1000)
+        usage.record("email", 100, 50, latency=0.2)
+        usage.record("email", 120, 30, latency=0.4)
+        usage.record("subject", 20, 5, estimated=True)
+
+        rows = {row["kind"]: row for row in usage.report()}
+        self.assertEqual(rows["email"]["avg_input"], 110.0)
+        self.assertAlmostEqual(rows["email"]["avg_latency_ms"], 300.0)
+        self.assertEqual(rows["total"]["calls"], 3)
+        self.assertEqual(rows["total"]["estimated_calls"], 1)
+        self.assertEqual(rows["total"]["remaining"], 1000 - 325)
+        self.assertEqual(usage.remaining(), 675)
+
+    def test_prompt_carries_only_per_call_details(self):
+        agent = EmailAgent(api_key="dummy", mock_mode=True)
+        prompt = agent._build_email_prompt("Invoice", ["q3.pdf"])
+        self.assertEqual(prompt, "Subject: 'Invoice'\nAttached files: q3.pdf")
+        self.assertNotIn("Guidelines", prompt)
+        self.assertTrue(EMAIL_SYSTEM_INSTRUCTION.startswith("You write"))
+
+    def test_agent_records_usage_per_session_and_key(self):
+        first = EmailAgent(api_key="usage-key", mock_mode=True)
+        second = EmailAgent(api_key="usage-key", mock_mode=True)
+        first.model = UsageModel()
+        second.model = FakeModel(text="Hello there, friend.")  # no usage_metadata: estimated
+
+        first.generate_email("Invoice")
+        second.generate_email("Party")
+
+        self.assertEqual(first.usage.report()[-1]["input_tokens"], 120)
+        self.assertEqual(second.usage.report()[-1]["estimated_calls"], 1)
+        self.assertIs(first.key_usage, key_usage("usage-key"))
+        self.assertEqual(key_usage("usage-key").report()[-1]["calls"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
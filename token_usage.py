@@ -0,0 +1,90 @@
+import hashlib
+import threading
+
+
+def usage_counts(response):
+    """(input_tokens, output_tokens) from a Gemini response's usage_metadata, or None if absent."""
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", None)
+    if not isinstance(input_tokens, int) or not input_tokens:
+        return None
+    output_tokens = getattr(usage, "candidates_token_count", 0)
+    return input_tokens, output_tokens if isinstance(output_tokens, int) else 0
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for when the API reports none."""
+    return len(text) // 4
+
+
+class TokenUsage:
+    """Running token and latency totals per call kind, with an optional budget.
+
+    Counts come from the API's usage_metadata; calls where it was missing are
+    estimated and reported separately as `estimated_calls`.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self._kinds = {}  # kind -> [calls, input, output, latency, estimated_calls]
+        self._lock = threading.Lock()
+
+    def record(self, kind, input_tokens, output_tokens, latency=0.0, estimated=False):
+        with self._lock:
+            totals = self._kinds.setdefault(kind, [0, 0, 0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += input_tokens
+            totals[2] += output_tokens
+            totals[3] += latency
+            totals[4] += int(estimated)
+
+    @property
+    def total_tokens(self):
+        with self._lock:
+            return sum(totals[1] + totals[2] for totals in self._kinds.values())
+
+    def average_input_tokens(self, kind):
+        """Mean input tokens per call of `kind`, or None before the first call."""
+        with self._lock:
+            totals = self._kinds.get(kind)
+            return totals[1] / totals[0] if totals else None
+
+    def remaining(self):
+        return None if self.budget is None else max(0, self.budget - self.total_tokens)
+
+    def report(self):
+        """One row per call kind plus a total row, with budget use when a budget is set."""
+        with self._lock:
+            items = sorted(self._kinds.items())
+        rows = []
+        overall = [0, 0, 0, 0.0, 0]
+        for kind, totals in items + [("total", overall)]:
+            if kind != "total":
+                overall[:] = [a + b for a, b in zip(overall, totals)]
+            calls, input_tokens, output_tokens, latency, estimated = totals
+            rows.append({
+                "kind": kind, "calls": calls, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                "avg_input": round(input_tokens / calls, 1) if calls else 0.0,
+                "avg_latency_ms": round(latency / calls * 1000, 1) if calls else 0.0,
+                "estimated_calls": estimated,
+            })
+        if self.budget is not None:
+            rows[-1]["budget"] = self.budget
+            rows[-1]["remaining"] = max(0, self.budget - input_tokens - output_tokens)
+        return rows
+
+
+_key_usage = {}
+_key_usage_lock = threading.Lock()
+
+
+def key_usage(api_key, budget=None):
+    """Process-wide TokenUsage per API key (hashed), shared by every session using that key."""
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    with _key_usage_lock:
+        usage = _key_usage.get(key_hash)
+        if usage is None:
+            usage = _key_usage[key_hash] = TokenUsage(budget)
+        elif budget is not None:
+            usage.budget = budget
+        return usage